@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: decompile every tests/end_to_end/*/*.s file, plus the
+stress inputs from benchmarks/stress.py, several times over, and report the
+median and 95th percentile time of each phase.
+
+Run from the repository root:
+
+    python3 -m benchmarks.e2e [--repeat R] [--save-baseline FILE]
+    python3 -m benchmarks.e2e --baseline FILE [--threshold 0.2]
+
+With --baseline, the exit code is 1 if any phase or input got slower than the
+baseline by more than the threshold.
+"""
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from run_tests import get_test_flags
+from src.api import decompile
+from src.main import parse_flags
+from src.options import Options
+from src.profiling import FUNCTION_PHASES, profiling
+
+from .stress import GENERATORS
+
+# Parameter for each stress input generator, chosen so that each input takes
+# a fraction of a second to decompile.
+STRESS_SIZES: Dict[str, int] = {
+    "straight_line": 2000,
+    "deep_nesting": 60,
+    "large_switch": 300,
+    "many_phis": 150,
+}
+
+# Order in which phases are reported: the whole decompile() call, its
+# file-level and per-function timings, and the phases within each function.
+PHASES: List[str] = ["total", "parse", "context", "translate", "format"]
+PHASES.extend(FUNCTION_PHASES)
+
+# Inputs faster than this (in seconds) are too noisy to flag as regressions.
+MIN_TIME = 0.005
+
+
+def load_cases(e2e_dir: Path) -> List[Tuple[str, str, Options]]:
+    cases: List[Tuple[str, str, Options]] = []
+    for asm_file_path in sorted(e2e_dir.glob("*/*.s")):
+        flags_path = asm_file_path.parent / (asm_file_path.stem + "-flags.txt")
+        flags = [str(asm_file_path), "test", "--stop-on-error"]
+        flags.extend(get_test_flags(flags_path))
+        options = parse_flags(flags)
+        name = str(asm_file_path.relative_to(e2e_dir))
+        cases.append((name, asm_file_path.read_text(encoding="utf-8-sig"), options))
+    for gen_name, size in STRESS_SIZES.items():
+        options = parse_flags([f"{gen_name}.s", "test"])
+        cases.append((f"stress/{gen_name}-{size}", GENERATORS[gen_name](size), options))
+    return cases
+
+
+def run_case(asm_text: str, options: Options) -> Dict[str, float]:
+    """Decompile once, returning the time spent in each phase and in total."""
+    start = time.perf_counter()
+    with profiling() as profile:
+        result = decompile(asm_text, options.function_index_or_name, options)
+    timings: Dict[str, float] = {"total": time.perf_counter() - start}
+    timings.update(result.timings)
+    for phase in FUNCTION_PHASES:
+        timings[phase] = sum(fn.timings.get(phase, 0.0) for fn in profile.functions)
+    return timings
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {"median": statistics.median(samples), "p95": percentile(samples, 95)}
+
+
+def compare(
+    current: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    threshold: float,
+) -> List[str]:
+    regressions: List[str] = []
+    for section in ("phases", "cases"):
+        for name, stats in current[section].items():
+            old = baseline.get(section, {}).get(name)
+            if old is None or old["median"] < MIN_TIME:
+                continue
+            ratio = stats["median"] / old["median"]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{name}: {old['median'] * 1000:.2f} ms -> "
+                    f"{stats['median'] * 1000:.2f} ms ({(ratio - 1) * 100:+.0f}%)"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the decompiler on the end-to-end tests and "
+        "synthetic stress inputs."
+    )
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=5, help="number of runs"
+    )
+    parser.add_argument(
+        "--filter",
+        dest="filter",
+        default="",
+        help="only run inputs whose name contains this string",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        dest="baseline",
+        help="compare against results saved with --save-baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown of a median that counts as a regression "
+        "(default: 0.2)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        metavar="FILE",
+        dest="save_baseline",
+        help="write the results to FILE as JSON",
+    )
+    args = parser.parse_args()
+    sys.setrecursionlimit(min(2 ** 31 - 1, 10 * sys.getrecursionlimit()))
+
+    e2e_dir = Path(__file__).parent.parent / "tests" / "end_to_end"
+    cases = [case for case in load_cases(e2e_dir) if args.filter in case[0]]
+
+    phase_samples: Dict[str, List[float]] = {}
+    case_samples: Dict[str, List[float]] = {name: [] for name, _, _ in cases}
+    for _ in range(args.repeat):
+        run_totals: Dict[str, float] = {}
+        for name, asm_text, options in cases:
+            timings = run_case(asm_text, options)
+            case_samples[name].append(timings["total"])
+            for phase, seconds in timings.items():
+                run_totals[phase] = run_totals.get(phase, 0.0) + seconds
+        for phase, seconds in run_totals.items():
+            phase_samples.setdefault(phase, []).append(seconds)
+
+    results = {
+        "phases": {
+            name: summarize(phase_samples[name])
+            for name in PHASES
+            if name in phase_samples
+        },
+        "cases": {name: summarize(s) for name, s in case_samples.items()},
+    }
+
+    print(f"{'phase':<20} {'median':>10} {'p95':>10}   (ms, all inputs)")
+    for name, stats in results["phases"].items():
+        print(f"{name:<20} {stats['median'] * 1000:10.2f} {stats['p95'] * 1000:10.2f}")
+    print()
+    slowest = sorted(
+        results["cases"].items(), key=lambda item: item[1]["median"], reverse=True
+    )
+    print(f"{'input':<40} {'median':>10} {'p95':>10}   (ms, 10 slowest)")
+    for name, stats in slowest[:10]:
+        print(f"{name:<40} {stats['median'] * 1000:10.2f} {stats['p95'] * 1000:10.2f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print()
+        if regressions:
+            print(f"Regressions beyond {args.threshold * 100:.0f}%:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions beyond {args.threshold * 100:.0f}%.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Scaling study: decompile the synthetic inputs from benchmarks/stress.py at
+increasing sizes, and report the time spent in each pipeline stage and the
+peak memory use against size.
+
+Run from the repository root:
+
+    python3 -m benchmarks.scaling [--shape SHAPE] [--sizes 10,20,40]
+        [--csv FILE] [--plot FILE]
+
+--plot needs matplotlib.
+"""
+import argparse
+import csv
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from src.api import decompile
+from src.main import parse_flags
+from src.profiling import FUNCTION_PHASES, profiling
+
+from .stress import GENERATORS
+
+DEFAULT_SIZES: Dict[str, List[int]] = {
+    "straight_line": [250, 500, 1000, 2000, 4000],
+    "deep_nesting": [10, 20, 40, 80],
+    "large_switch": [50, 100, 200, 400, 800],
+    "many_phis": [25, 50, 100, 200],
+    "diamond_chain": [50, 100, 200, 400],
+    "nested_loops": [10, 20, 40, 80],
+    "many_calls": [50, 100, 200, 400],
+}
+
+STAGES: List[str] = ["parse", *FUNCTION_PHASES]
+
+
+def measure(asm_text: str, repeat: int) -> Dict[str, float]:
+    """Best-of-'repeat' time of each stage in seconds, plus the peak memory
+    use in bytes. Memory is measured in a separate run, because tracing
+    allocations slows everything down."""
+    options = parse_flags(["stress.s", "test"])
+    best: Dict[str, float] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with profiling() as profile:
+            result = decompile(asm_text, None, options)
+        if not result.success:
+            raise Exception("\n".join(result.errors))
+        timings = {
+            "total": time.perf_counter() - start,
+            "parse": result.timings.get("parse", 0.0),
+        }
+        for phase in FUNCTION_PHASES:
+            timings[phase] = sum(fn.timings.get(phase, 0.0) for fn in profile.functions)
+        for stage, seconds in timings.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    tracemalloc.start()
+    try:
+        decompile(asm_text, None, options)
+        best["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best
+
+
+def plot(rows: List[Dict[str, object]], shapes: List[str], filename: str) -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(
+        len(shapes), 2, figsize=(12, 4 * len(shapes)), squeeze=False
+    )
+    for (time_ax, mem_ax), shape in zip(axes, shapes):
+        shape_rows = [row for row in rows if row["shape"] == shape]
+        sizes = [row["size"] for row in shape_rows]
+        for stage in ["total", *STAGES]:
+            time_ax.plot(
+                sizes, [row[stage] for row in shape_rows], marker="o", label=stage
+            )
+        time_ax.set_title(f"{shape}: time (ms)")
+        time_ax.set_xlabel("size")
+        time_ax.legend(fontsize="small")
+        mem_ax.plot(sizes, [row["peak_kib"] for row in shape_rows], marker="o")
+        mem_ax.set_title(f"{shape}: peak memory (KiB)")
+        mem_ax.set_xlabel("size")
+    fig.tight_layout()
+    fig.savefig(filename)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure how decompilation time and memory scale with the "
+        "size of synthetic inputs."
+    )
+    parser.add_argument(
+        "--shape",
+        dest="shapes",
+        action="append",
+        choices=list(GENERATORS),
+        help="input shape to measure; can be given several times (default: all)",
+    )
+    parser.add_argument(
+        "--sizes",
+        dest="sizes",
+        help="comma-separated sizes to use for every shape, instead of the defaults",
+    )
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=3, help="number of timed runs"
+    )
+    parser.add_argument(
+        "--csv", metavar="FILE", dest="csv", help="also write the results as CSV"
+    )
+    parser.add_argument(
+        "--plot",
+        metavar="FILE",
+        dest="plot",
+        help="plot time and memory against size into FILE (needs matplotlib)",
+    )
+    args = parser.parse_args()
+    sys.setrecursionlimit(min(2 ** 31 - 1, 10 * sys.getrecursionlimit()))
+
+    shapes: List[str] = args.shapes or list(GENERATORS)
+    override: Optional[List[int]] = None
+    if args.sizes:
+        override = [int(size) for size in args.sizes.split(",")]
+
+    columns = ["shape", "size", "total", *STAGES, "peak_kib"]
+    print(" ".join(f"{column:>15}" for column in columns), "  (times in ms)")
+    rows: List[Dict[str, object]] = []
+    for shape in shapes:
+        for size in override or DEFAULT_SIZES[shape]:
+            stats = measure(GENERATORS[shape](size), args.repeat)
+            row: Dict[str, object] = {"shape": shape, "size": size}
+            for stage in ["total", *STAGES]:
+                row[stage] = round(stats[stage] * 1000, 3)
+            row["peak_kib"] = round(stats["peak_memory"] / 1024)
+            rows.append(row)
+            print(" ".join(f"{row[column]:>15}" for column in columns))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if args.plot:
+        try:
+            plot(rows, shapes, args.plot)
+        except ImportError:
+            print("--plot requires matplotlib to be installed.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
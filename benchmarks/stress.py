@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Synthetic MIPS assembly for stress-testing the decompiler.
+
+Each generator returns the text of an IDO-style .s file containing a single
+function called "test", whose size grows with the parameter. To write one to
+a file, run from the repository root:
+
+    python3 -m benchmarks.stress SHAPE SIZE [-o FILE]
+"""
+import argparse
+import sys
+from typing import Callable, Dict, List
+
+STRAIGHT_LINE_OPS = [
+    "addu {dst}, {src}, $a1",
+    "xor {dst}, {src}, $a2",
+    "sll {dst}, {src}, 2",
+    "addiu {dst}, {src}, 7",
+    "subu {dst}, {src}, $a3",
+    "srl {dst}, {src}, 1",
+    "or {dst}, {src}, $a1",
+    "and {dst}, {src}, $a2",
+]
+
+
+def straight_line(n: int) -> str:
+    """n arithmetic instructions without any control flow. Every fourth result
+    is stored to a global, which keeps expressions from nesting too deeply."""
+    lines = ["glabel test"]
+    src = "$a0"
+    for i in range(n):
+        dst = f"$t{i % 8}"
+        lines.append(
+            STRAIGHT_LINE_OPS[i % len(STRAIGHT_LINE_OPS)].format(dst=dst, src=src)
+        )
+        if i % 4 == 3:
+            lines.append(f"lui $at, %hi(D_{i})")
+            lines.append(f"sw {dst}, %lo(D_{i})($at)")
+        src = dst
+    lines.append("jr $ra")
+    lines.append(f"move $v0, {src}")
+    return "\n".join(lines) + "\n"
+
+
+def deep_nesting(depth: int) -> str:
+    """Ifs nested 'depth' levels deep, each also updating $v0 on the way out."""
+    lines = ["glabel test", "move $v0, $zero"]
+    for d in range(depth):
+        lines.append(f"slti $at, $a0, {d}")
+        lines.append(f"bnez $at, .Lend{d}")
+        lines.append("nop")
+        lines.append(f"addiu $v0, $v0, {d}")
+    lines.append("addu $v0, $v0, $a1")
+    for d in reversed(range(depth)):
+        lines.append(f".Lend{d}:")
+        lines.append("addiu $v0, $v0, 1")
+    lines.append("jr $ra")
+    lines.append("nop")
+    return "\n".join(lines) + "\n"
+
+
+def large_switch(cases: int) -> str:
+    """A switch on $a0 with 'cases' cases, through a jump table in .rodata."""
+    lines = [".rdata", "glabel jtbl_test"]
+    lines.extend(f".word .Lcase{i}" for i in range(cases))
+    lines.extend(
+        [
+            ".text",
+            "glabel test",
+            f"sltiu $at, $a0, {cases}",
+            "beqz $at, .Ldefault",
+            "sll $t6, $a0, 2",
+            "lui $at, %hi(jtbl_test)",
+            "addu $at, $at, $t6",
+            "lw $t6, %lo(jtbl_test)($at)",
+            "jr $t6",
+            "nop",
+        ]
+    )
+    for i in range(cases):
+        lines.append(f".Lcase{i}:")
+        lines.append("b .Lend")
+        lines.append(f"addiu $v0, $a1, {i * 3}")
+    lines.extend([".Ldefault:", "move $v0, $zero", ".Lend:", "jr $ra", "nop"])
+    return "\n".join(lines) + "\n"
+
+
+def many_phis(n: int) -> str:
+    """n diamonds in a row, each assigning $v0 and one of several temporaries
+    on both sides, so every join point needs phis."""
+    lines = ["glabel test", "move $v0, $a0"]
+    for i in range(n):
+        reg = f"$t{i % 6}"
+        lines.append(f"andi $at, $a1, {1 << (i % 16)}")
+        lines.append(f"beqz $at, .Lelse{i}")
+        lines.append("nop")
+        lines.append(f"addiu $v0, $v0, {i + 1}")
+        lines.append(f"b .Ljoin{i}")
+        lines.append(f"addu {reg}, $v0, $a2")
+        lines.append(f".Lelse{i}:")
+        lines.append(f"subu {reg}, $v0, $a3")
+        lines.append("sll $v0, $v0, 1")
+        lines.append(f".Ljoin{i}:")
+        lines.append(f"addu $v0, $v0, {reg}")
+    lines.append("jr $ra")
+    lines.append("nop")
+    return "\n".join(lines) + "\n"
+
+
+def diamond_chain(n: int) -> str:
+    """n if/else diamonds in a row, each branching on a different bit of $a1
+    and updating $v0 differently on each side."""
+    lines = ["glabel test", "move $v0, $a0"]
+    for i in range(n):
+        lines.append(f"andi $at, $a1, {1 << (i % 16)}")
+        lines.append(f"beqz $at, .Lelse{i}")
+        lines.append("nop")
+        lines.append(f"b .Ljoin{i}")
+        lines.append(f"addiu $v0, $v0, {i + 1}")
+        lines.append(f".Lelse{i}:")
+        lines.append(f"addiu $v0, $v0, -{i + 1}")
+        lines.append(f".Ljoin{i}:")
+    lines.append("jr $ra")
+    lines.append("nop")
+    return "\n".join(lines) + "\n"
+
+
+def nested_loops(depth: int) -> str:
+    """'depth' nested counting loops, with their counters in stack slots so
+    that the depth isn't limited by the number of registers."""
+    frame = (4 * depth + 7) // 8 * 8
+    lines = ["glabel test", f"addiu $sp, $sp, -{frame}", "move $v0, $zero"]
+    for d in range(depth):
+        lines.append(f"sw $zero, {4 * d}($sp)")
+        lines.append(f".Lloop{d}:")
+    lines.append("addu $v0, $v0, $a1")
+    for d in reversed(range(depth)):
+        lines.append(f"lw $t0, {4 * d}($sp)")
+        lines.append("addiu $t0, $t0, 1")
+        lines.append(f"sw $t0, {4 * d}($sp)")
+        lines.append("slt $at, $t0, $a0")
+        lines.append(f"bnez $at, .Lloop{d}")
+        lines.append("nop")
+    lines.append("jr $ra")
+    lines.append(f"addiu $sp, $sp, {frame}")
+    return "\n".join(lines) + "\n"
+
+
+def many_calls(k: int) -> str:
+    """k calls in a row, each passing on the result of the previous one."""
+    lines = ["glabel test", "addiu $sp, $sp, -0x18", "sw $ra, 0x14($sp)"]
+    for i in range(k):
+        if i != 0:
+            lines.append("move $a0, $v0")
+        lines.append(f"jal func_{i % 16}")
+        lines.append(f"addiu $a1, $zero, {i}")
+    lines.append("lw $ra, 0x14($sp)")
+    lines.append("jr $ra")
+    lines.append("addiu $sp, $sp, 0x18")
+    return "\n".join(lines) + "\n"
+
+
+GENERATORS: Dict[str, Callable[[int], str]] = {
+    "straight_line": straight_line,
+    "deep_nesting": deep_nesting,
+    "large_switch": large_switch,
+    "many_phis": many_phis,
+    "diamond_chain": diamond_chain,
+    "nested_loops": nested_loops,
+    "many_calls": many_calls,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic MIPS assembly file."
+    )
+    parser.add_argument("shape", choices=list(GENERATORS), help="kind of function")
+    parser.add_argument("size", type=int, help="size parameter for the shape")
+    parser.add_argument(
+        "-o", metavar="FILE", dest="output", help="output file (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    asm = GENERATORS[args.shape](args.size)
+    if args.output is None:
+        sys.stdout.write(asm)
+    else:
+        with open(args.output, "w") as f:
+            f.write(asm)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
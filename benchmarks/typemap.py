@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark typemap construction on a large synthetic C header.
+
+Run from the repository root:
+
+    python3 -m benchmarks.typemap [--structs N] [--repeat R]
+"""
+import argparse
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from pycparser import c_ast as ca
+
+from src.c_types import (
+    TypeMap,
+    build_typemap,
+    get_struct,
+    parse_all_definitions,
+    parse_constant_int,
+)
+
+
+def make_header(num_structs: int) -> str:
+    lines: List[str] = []
+    for i in range(num_structs):
+        lines.append(f"enum Enum{i} {{ E{i}_A, E{i}_B = E{i}_A + 4, E{i}_C }};")
+        lines.append(f"typedef struct Struct{i} {{")
+        lines.append("    int a;")
+        lines.append("    char name[16];")
+        lines.append(f"    enum Enum{i} kind;")
+        lines.append(f"    float values[E{i}_C];")
+        if i > 0:
+            lines.append(f"    struct Struct{i // 2} half;")
+            lines.append(f"    Struct{i - 1} *prev;")
+        lines.append("    union { short s; long long ll; } u;")
+        lines.append(f"}} Struct{i};")
+        lines.append(f"Struct{i} *func{i}(int x, Struct{i} *s);")
+        lines.append(f"extern Struct{i} gStruct{i};")
+    return "\n".join(lines) + "\n"
+
+
+def time_call(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def lookup_few(typemap: TypeMap, num_structs: int) -> None:
+    # Roughly what decompiling a single function touches: a handful of
+    # structs and enum constants.
+    for i in range(0, num_structs, max(1, num_structs // 5)):
+        get_struct(ca.Struct(f"Struct{i}", None), typemap)
+        parse_constant_int(ca.ID(f"E{i}_C"), typemap)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark build_typemap.")
+    parser.add_argument(
+        "--structs",
+        dest="structs",
+        type=int,
+        default=2000,
+        help="number of structs in the synthetic header",
+    )
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=3, help="number of runs"
+    )
+    args = parser.parse_args()
+
+    source = make_header(args.structs)
+    results: List[Tuple[str, float]] = []
+    results.append(("build", time_call(lambda: build_typemap(source), args.repeat)))
+
+    def build_and_lookup() -> None:
+        lookup_few(build_typemap(source), args.structs)
+
+    def build_and_parse_all() -> None:
+        parse_all_definitions(build_typemap(source))
+
+    results.append(("build+lookup", time_call(build_and_lookup, args.repeat)))
+    results.append(("build+parse all", time_call(build_and_parse_all, args.repeat)))
+
+    print(f"{args.structs} structs, {len(source)} bytes of C")
+    for name, t in results:
+        print(f"{name:<16} {t * 1000:10.2f} ms (best of {args.repeat})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
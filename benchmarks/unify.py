@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the union-find in src/types.py.
+
+Run from the repository root:
+
+    python3 -m benchmarks.unify [--size N] [--repeat R]
+"""
+import argparse
+import random
+import sys
+import timeit
+from typing import Callable, List, Tuple
+
+from src.types import Type
+
+
+def unify_chain(size: int) -> None:
+    # Each new type absorbs everything unified so far, which degenerates into
+    # a linked list without union by rank.
+    types = [Type.any() for _ in range(size)]
+    for prev, cur in zip(types, types[1:]):
+        cur.unify(prev)
+    for t in types:
+        t.get_representative()
+
+
+def unify_concrete(size: int) -> None:
+    # Lots of identical, already-concrete types, as produced by e.g. as_s32.
+    types = [Type.s32() for _ in range(size)]
+    for prev, cur in zip(types, types[1:]):
+        prev.unify(cur)
+    for t in types:
+        t.is_int()
+
+
+def unify_random(size: int) -> None:
+    rng = random.Random(0)
+    makers: List[Callable[[], Type]] = [Type.any, Type.intish, Type.intptr, Type.u32]
+    types = [rng.choice(makers)() for _ in range(size)]
+    for _ in range(size):
+        a = rng.choice(types)
+        b = rng.choice(types)
+        a.unify(b)
+    for t in types:
+        str(t)
+
+
+BENCHMARKS: List[Tuple[str, Callable[[int], None]]] = [
+    ("chain", unify_chain),
+    ("concrete", unify_concrete),
+    ("random", unify_random),
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Type.unify.")
+    parser.add_argument(
+        "--size", dest="size", type=int, default=20000, help="number of types"
+    )
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=5, help="number of runs"
+    )
+    args = parser.parse_args()
+
+    for name, fn in BENCHMARKS:
+        times = timeit.repeat(lambda: fn(args.size), number=1, repeat=args.repeat)
+        print(f"{name:<10} {min(times) * 1000:10.2f} ms (best of {args.repeat})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,21 +17,50 @@ parser.add_argument(
     help="emit a .coverage file",
     action="store_true",
 )
+parser.add_argument(
+    "-j",
+    dest="jobs",
+    type=int,
+    default=1,
+    help="number of worker processes to run test cases in (default: 1)",
+)
 args = parser.parse_args()
 
-cov = Coverage(
-    include="src/*", data_file=".coverage" if args.emit_data_file else None, branch=True
-)
+if args.jobs == 1:
+    cov = Coverage(
+        include="src/*",
+        data_file=".coverage" if args.emit_data_file else None,
+        branch=True,
+    )
+else:
+    # Worker processes each write a data file of their own, which get combined
+    # once the tests are done.
+    cov = Coverage(
+        include="src/*",
+        data_file=".coverage",
+        data_suffix=True,
+        branch=True,
+        concurrency="multiprocessing",
+    )
 cov.start()
 
 import run_tests
 
 run_tests.set_up_logging(debug=False)
-ret = run_tests.main(should_overwrite=False, coverage=cov)
+if args.jobs == 1:
+    ret = run_tests.main(should_overwrite=False, coverage=cov)
+else:
+    ret = run_tests.main(should_overwrite=False, coverage=None, jobs=args.jobs)
 
 cov.stop()
+if args.jobs != 1:
+    cov.save()
+    cov.combine()
 
 cov.html_report(directory=args.dir, show_contexts=True, skip_empty=True)
 print(f"Wrote html to {args.dir}")
 
+if args.jobs != 1 and not args.emit_data_file:
+    cov.erase()
+
 sys.exit(ret)
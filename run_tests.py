@@ -2,19 +2,37 @@
 import argparse
 import contextlib
 import difflib
+import hashlib
 import io
+import json
 import logging
+import multiprocessing
 import shlex
+import subprocess
 import sys
+import tempfile
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Dict, List, NamedTuple, Optional
 
+from src.api import decompile
 from src.main import parse_flags
-from src.main import run as decompile
+from src.main import run as run_main
 from src.options import Options
 
 CRASH_STRING = "CRASHED\n"
 
+# Inputs of the tests that --dedupe doesn't change the output.
+DEDUPE_TESTS_PATH = Path(__file__).parent / "tests" / "dedupe"
+
+# Where --incremental remembers the inputs of the test cases that passed.
+INCREMENTAL_CACHE_PATH = Path(__file__).parent / ".run_tests_cache.json"
+
+
+class TestCase(NamedTuple):
+    asm_file_path: Path
+    output_path: Path
+    flags_path: Path
+
 
 def set_up_logging(debug: bool) -> None:
     logging.basicConfig(
@@ -61,10 +79,29 @@ def decompile_and_compare(
 
     options = parse_flags(flags)
     final_contents = decompile_and_capture_output(options)
+    # The decompile() API only takes assembly text.
+    if asm_file_path.suffix == ".s":
+        api_contents = decompile_and_capture_api_output(options)
+    else:
+        api_contents = final_contents
 
     if should_overwrite:
         output_path.write_text(final_contents)
 
+    if api_contents != final_contents:
+        logging.info(
+            "\n".join(
+                [
+                    f"Output of {asm_file_path} from the decompile() API differs "
+                    "from the command line! Diff:",
+                    *difflib.unified_diff(
+                        final_contents.splitlines(), api_contents.splitlines()
+                    ),
+                ]
+            )
+        )
+        return False
+
     changed = final_contents != original_contents
     if changed:
         logging.info(
@@ -83,38 +120,234 @@ def decompile_and_compare(
 def decompile_and_capture_output(options: Options) -> str:
     out_string = io.StringIO()
     with contextlib.redirect_stdout(out_string):
-        returncode = decompile(options)
+        returncode = run_main(options)
     if returncode == 0:
         return out_string.getvalue()
     else:
         return CRASH_STRING
 
 
+def decompile_and_capture_api_output(options: Options) -> str:
+    """Decompile through the decompile() API instead, formatted the way the
+    command line prints the result, which it should match."""
+    asm_text = Path(options.filename).read_text(encoding="utf-8-sig")
+    result = decompile(asm_text, options.function_index_or_name, options)
+    if not result.success:
+        return CRASH_STRING
+    warnings = "".join(f"{warning}\n" for warning in result.warnings)
+    return warnings + result.c_code
+
+
+def find_test_cases(e2e_test_path: Path) -> List[TestCase]:
+    cases = []
+    # Inputs are assembly files, or ELF objects assembled from them by
+    # tests/add_elf_test.py.
+    input_paths = [*e2e_test_path.glob("*.s"), *e2e_test_path.glob("*.o")]
+    for asm_file_path in input_paths:
+        old_output_path = asm_file_path.parent.joinpath(asm_file_path.stem + "-out.c")
+        flags_path = asm_file_path.parent.joinpath(asm_file_path.stem + "-flags.txt")
+        cases.append(TestCase(asm_file_path, old_output_path, flags_path))
+    return cases
+
+
 def run_e2e_test(
     e2e_top_dir: Path, e2e_test_path: Path, should_overwrite: bool, coverage: Any
 ) -> bool:
     logging.info(f"Running test: {e2e_test_path.name}")
 
     ret = True
-    for asm_file_path in e2e_test_path.glob("*.s"):
-        old_output_path = asm_file_path.parent.joinpath(asm_file_path.stem + "-out.c")
-        flags_path = asm_file_path.parent.joinpath(asm_file_path.stem + "-flags.txt")
+    for case in find_test_cases(e2e_test_path):
         if coverage:
-            coverage.switch_context(str(asm_file_path.relative_to(e2e_top_dir)))
+            coverage.switch_context(str(case.asm_file_path.relative_to(e2e_top_dir)))
         if not decompile_and_compare(
-            asm_file_path, old_output_path, flags_path, should_overwrite
+            case.asm_file_path, case.output_path, case.flags_path, should_overwrite
         ):
             ret = False
     return ret
 
 
-def main(should_overwrite: bool, coverage: Any) -> int:
+def run_test_case(e2e_top_dir: Path, case: TestCase, should_overwrite: bool) -> bool:
+    # If code_coverage.py measures worker processes, give each test case its
+    # own coverage context, like run_e2e_test does.
+    if "coverage" in sys.modules:
+        from coverage import Coverage  # type: ignore
+
+        coverage = Coverage.current()
+        if coverage is not None:
+            coverage.switch_context(str(case.asm_file_path.relative_to(e2e_top_dir)))
+    return decompile_and_compare(
+        case.asm_file_path, case.output_path, case.flags_path, should_overwrite
+    )
+
+
+def run_dedupe_test(test_path: Path) -> bool:
+    """Check that deduplicating the functions in a test's assembly files gives
+    the same output as decompiling each of them, both for the functions of one
+    file, and for files decompiled with mips_to_c_batch.py."""
+    logging.info(f"Running dedupe test: {test_path.name}")
+    asm_paths = sorted(test_path.glob("*.s"))
+    context_path = test_path / "ctx.c"
+    context_flags = ["--context", str(context_path)] if context_path.is_file() else []
+
+    ret = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        all_path = tmp_path / "all.s"
+        all_path.write_text("".join(path.read_text() for path in asm_paths))
+        outputs = [
+            decompile_and_capture_output(
+                parse_flags([str(all_path), *context_flags, *dedupe_flags])
+            )
+            for dedupe_flags in [[], ["--dedupe"]]
+        ]
+        if outputs[0] != outputs[1]:
+            logging.info(
+                "\n".join(
+                    [
+                        f"Output of {test_path} changed with --dedupe! Diff:",
+                        *difflib.unified_diff(
+                            outputs[0].splitlines(), outputs[1].splitlines()
+                        ),
+                    ]
+                )
+            )
+            ret = False
+
+        batch_script = Path(__file__).parent / "mips_to_c_batch.py"
+        for name, dedupe_flags in [("plain", []), ("dedupe", ["--dedupe"])]:
+            subprocess.run(
+                [sys.executable, str(batch_script), *map(str, asm_paths)]
+                + ["-o", str(tmp_path / name), *context_flags, *dedupe_flags],
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+        for asm_path in asm_paths:
+            output_name = asm_path.stem + ".c"
+            plain = (tmp_path / "plain" / output_name).read_text()
+            deduped = (tmp_path / "dedupe" / output_name).read_text()
+            if plain != deduped:
+                logging.info(
+                    "\n".join(
+                        [
+                            f"Batch output of {asm_path} changed with --dedupe! "
+                            "Diff:",
+                            *difflib.unified_diff(
+                                plain.splitlines(), deduped.splitlines()
+                            ),
+                        ]
+                    )
+                )
+                ret = False
+    return ret
+
+
+def hash_src_tree() -> str:
+    digest = hashlib.sha256()
+    src_dir = Path(__file__).parent / "src"
+    for path in sorted(src_dir.rglob("*.py")):
+        digest.update(str(path.relative_to(src_dir)).encode("utf-8") + b"\0")
+        digest.update(path.read_bytes() + b"\0")
+    return digest.hexdigest()
+
+
+def hash_test_case(case: TestCase, src_hash: str) -> str:
+    """Hash everything the result of a test case depends on: the decompiler
+    source, the input, its flags, any files the flags refer to, and the
+    expected output."""
+    options = parse_flags(
+        [str(case.asm_file_path), "test"] + get_test_flags(case.flags_path)
+    )
+    paths = [case.asm_file_path, case.flags_path, case.output_path]
+    paths.extend(Path(path) for path in options.rodata_files)
+    if options.c_context is not None:
+        paths.append(Path(options.c_context))
+
+    digest = hashlib.sha256(src_hash.encode("utf-8"))
+    for path in paths:
+        digest.update(str(path).encode("utf-8") + b"\0")
+        try:
+            digest.update(path.read_bytes() + b"\0")
+        except FileNotFoundError:
+            digest.update(b"(missing)\0")
+    return digest.hexdigest()
+
+
+def load_incremental_cache() -> Dict[str, str]:
+    try:
+        with INCREMENTAL_CACHE_PATH.open() as f:
+            cache: Dict[str, str] = json.load(f)
+            return cache
+    except (OSError, ValueError):
+        return {}
+
+
+def main(
+    should_overwrite: bool, coverage: Any, jobs: int = 1, incremental: bool = False
+) -> int:
+    ret = run_e2e_tests(should_overwrite, coverage, jobs, incremental)
+    for dedupe_test_path in sorted(DEDUPE_TESTS_PATH.iterdir()):
+        if not run_dedupe_test(dedupe_test_path):
+            ret = 1
+    return ret
+
+
+def run_e2e_tests(
+    should_overwrite: bool, coverage: Any, jobs: int, incremental: bool
+) -> int:
     ret = 0
     e2e_top_dir = Path(__file__).parent / "tests" / "end_to_end"
-    for e2e_test_path in e2e_top_dir.iterdir():
-        if not run_e2e_test(e2e_top_dir, e2e_test_path, should_overwrite, coverage):
+    if coverage is not None or (jobs == 1 and not incremental):
+        for e2e_test_path in e2e_top_dir.iterdir():
+            if not run_e2e_test(e2e_top_dir, e2e_test_path, should_overwrite, coverage):
+                ret = 1
+        return ret
+
+    cases: List[TestCase] = []
+    for e2e_test_path in sorted(e2e_top_dir.iterdir()):
+        cases.extend(find_test_cases(e2e_test_path))
+
+    keys = [str(case.asm_file_path.relative_to(e2e_top_dir)) for case in cases]
+    to_run: List[int] = []
+    cache: Dict[str, str] = {}
+    if incremental:
+        src_hash = hash_src_tree()
+        cache = load_incremental_cache()
+        for i, case in enumerate(cases):
+            if cache.get(keys[i]) == hash_test_case(case, src_hash):
+                logging.debug(f"Skipping unchanged test case {keys[i]}")
+            else:
+                to_run.append(i)
+    else:
+        to_run = list(range(len(cases)))
+    if len(to_run) != len(cases):
+        logging.info(
+            f"Skipping {len(cases) - len(to_run)} of {len(cases)} test cases, "
+            "which are unchanged since they last passed."
+        )
+
+    work = [(e2e_top_dir, cases[i], should_overwrite) for i in to_run]
+    if jobs == 1:
+        results = [run_test_case(*args) for args in work]
+    else:
+        # Workers inherit the logging setup when forked, but not when spawned.
+        debug = logging.getLogger().getEffectiveLevel() <= logging.DEBUG
+        with multiprocessing.Pool(
+            jobs, initializer=set_up_logging, initargs=(debug,)
+        ) as pool:
+            results = pool.starmap(run_test_case, work)
+
+    for i, passed in zip(to_run, results):
+        if not passed:
+            cache.pop(keys[i], None)
             ret = 1
+        elif incremental:
+            # Hash after running, since --overwrite may have changed the output.
+            cache[keys[i]] = hash_test_case(cases[i], src_hash)
 
+    if incremental:
+        with INCREMENTAL_CACHE_PATH.open("w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+            f.write("\n")
     return ret
 
 
@@ -134,10 +367,30 @@ if __name__ == "__main__":
             "Do this once before committing."
         ),
     )
+    parser.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="number of worker processes to run test cases in "
+        "(0 for one per CPU; default: 1)",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help=(
+            "skip test cases whose input, flags, context, expected output and "
+            "src/ are unchanged since they last passed"
+        ),
+    )
     args = parser.parse_args()
     set_up_logging(args.debug)
 
     if args.should_overwrite:
         logging.info("Overwriting test output files.")
-    ret = main(args.should_overwrite, coverage=None)
+    jobs = args.jobs or multiprocessing.cpu_count()
+    ret = main(
+        args.should_overwrite, coverage=None, jobs=jobs, incremental=args.incremental
+    )
     sys.exit(ret)
@@ -0,0 +1,162 @@
+"""Programmatic interface to the decompiler, for embedding it as a library.
+
+Unlike main.run, nothing is printed: the C code, warnings and errors are
+returned in a DecompResult. Separate threads may call decompile() at the same
+time."""
+
+import io
+import traceback
+from typing import Dict, List, Optional
+
+import attr
+
+from .c_types import TypeMap, build_typemap, dump_typemap
+from .diagnostics import capture_diagnostics
+from .error import DecompFailure
+from .if_statements import get_function_text
+from .input_file import open_text_input
+from .options import Options
+from .parse_file import Function, MIPSFile, load_rodata_file, parse_file
+from .profiling import profile_function, timed, traced
+from .translate import translate_to_ast
+
+
+@attr.s
+class DecompResult:
+    # C code for the functions that were decompiled, each ending in a newline
+    # and separated by blank lines, like the command-line output.
+    c_code: str = attr.ib()
+    warnings: List[str] = attr.ib()
+    errors: List[str] = attr.ib()
+    # Seconds spent in each phase: "parse", "context", "translate" and "format".
+    timings: Dict[str, float] = attr.ib()
+    # False if some function could not be decompiled at all, in which case the
+    # reason is in 'errors'. Errors that decompilation recovered from (with
+    # stop_on_error unset) are reported in 'errors' without clearing this.
+    success: bool = attr.ib()
+
+
+def decompile(
+    asm_text: str,
+    function: Optional[str],
+    options: Options,
+    *,
+    typemap: Optional[TypeMap] = None,
+) -> DecompResult:
+    """Decompile 'function' (a name or index, or None for every function) from
+    the MIPS assembly in 'asm_text'. This is used instead of
+    options.function_index_or_name, while options.filename is only used as a
+    name in messages. Rodata files and the C context given in 'options' are
+    read from disk, unless a 'typemap' built from the context is passed in,
+    which lets several calls share it.
+
+    Options that only make sense on the command line (print_assembly,
+    visualize_flowgraph, pdb_translate) are ignored. Output enabled by 'debug'
+    still goes to stdout."""
+    # parse_file records assumed preprocessor defines in the options, so give
+    # it a copy to keep 'options' safe to share between threads.
+    options = attr.evolve(options, preproc_defines=dict(options.preproc_defines))
+    timings: Dict[str, float] = {}
+    chunks: List[str] = []
+    with capture_diagnostics() as diagnostics:
+        success = decompile_into(
+            asm_text, function, options, typemap, chunks, diagnostics.errors, timings
+        )
+    return DecompResult(
+        c_code="\n".join(chunks),
+        warnings=diagnostics.warnings,
+        errors=diagnostics.errors,
+        timings=timings,
+        success=success,
+    )
+
+
+def select_functions(
+    mips_file: MIPSFile, function: Optional[str], errors: List[str]
+) -> Optional[List[Function]]:
+    if function is None:
+        return mips_file.functions
+    try:
+        index = int(function)
+        count = len(mips_file.functions)
+        if not (0 <= index < count):
+            errors.append(
+                f"Function index {index} is out of bounds (must be between "
+                f"0 and {count - 1})."
+            )
+            return None
+        return [mips_file.functions[index]]
+    except ValueError:
+        for fn in mips_file.functions:
+            if fn.name == function:
+                return [fn]
+        errors.append(f"Function {function} not found.")
+        return None
+
+
+def decompile_into(
+    asm_text: str,
+    function: Optional[str],
+    options: Options,
+    typemap: Optional[TypeMap],
+    chunks: List[str],
+    errors: List[str],
+    timings: Dict[str, float],
+) -> bool:
+    try:
+        with timed(timings, "parse"), traced(
+            "parse", "file", {"file": options.filename}
+        ):
+            mips_file = parse_file(io.StringIO(asm_text), options)
+
+            # Move over jtbl rodata from files given by --rodata
+            for rodata_file in options.rodata_files:
+                mips_file.rodata.add_lazy_file(load_rodata_file(rodata_file, options))
+
+        if typemap is None and options.c_context is not None:
+            with timed(timings, "context"), traced(
+                "context", "file", {"file": options.c_context}
+            ):
+                with open_text_input(options.c_context) as f:
+                    typemap = build_typemap(f.read())
+    except (OSError, DecompFailure) as e:
+        errors.append(str(e))
+        return False
+
+    if options.dump_typemap:
+        if typemap is None:
+            errors.append("Dumping the typemap requires a C context.")
+            return False
+        out = io.StringIO()
+        try:
+            dump_typemap(typemap, out)
+        except DecompFailure as e:
+            errors.append(str(e))
+            return False
+        chunks.append(out.getvalue())
+        return True
+
+    functions = select_functions(mips_file, function, errors)
+    if functions is None:
+        return False
+
+    success = True
+    for fn in functions:
+        try:
+            with profile_function(fn.name):
+                with timed(timings, "translate"):
+                    function_info = translate_to_ast(
+                        fn, options, mips_file.rodata, typemap
+                    )
+                with timed(timings, "format"):
+                    chunks.append(get_function_text(function_info, options) + "\n")
+        except DecompFailure as e:
+            errors.append(f"Failed to decompile function {fn.name}:\n\n{e}")
+            success = False
+        except Exception:
+            errors.append(
+                f"Internal error while decompiling function {fn.name}:\n\n"
+                + traceback.format_exc()
+            )
+            success = False
+    return success
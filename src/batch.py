@@ -0,0 +1,354 @@
+"""Decompile many assembly files against one C context, e.g. a whole
+asm/nonmatchings/ tree with one .s file per function. The context is parsed
+once, files are processed in a pool of worker processes, and each result is
+written to a mirrored path in an output directory."""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .api import decompile
+from .c_types import TypeMap, build_typemap
+from .dedupe import CanonicalForm, canonicalize, rename_output
+from .diagnostics import capture_diagnostics
+from .error import DecompFailure
+from .input_file import COMPRESSED_SUFFIXES, open_text_input
+from .main import parse_flags
+from .parse_file import parse_file
+from .results_db import decompiler_hash, file_state, rodata_hash
+
+# The TypeMap for the batch, built once before the worker processes start.
+# Forked workers inherit it; spawned ones rebuild it in init_worker().
+batch_typemap: Optional[TypeMap] = None
+
+# Written to the output directory, with the stamp of each output file.
+STAMPS_FILE_NAME = ".mips_to_c_stamps.json"
+
+
+class BatchJob(NamedTuple):
+    asm_path: Path
+    output_path: Path
+    # A hash of the inputs, see job_stamp().
+    stamp: str
+
+
+class BatchResult(NamedTuple):
+    asm_path: Path
+    success: bool
+    messages: List[str]
+    c_code: str
+
+
+# Files whose output is made from the output of a file with the same
+# canonical form, by the path of that file (for --dedupe).
+Duplicates = Dict[Path, Tuple[CanonicalForm, List[Tuple[BatchJob, CanonicalForm]]]]
+
+
+def load_context(c_context: Optional[str]) -> Optional[TypeMap]:
+    if c_context is None:
+        return None
+    with open_text_input(c_context) as f:
+        return build_typemap(f.read())
+
+
+def init_worker(c_context: Optional[str]) -> None:
+    global batch_typemap
+    if batch_typemap is None:
+        batch_typemap = load_context(c_context)
+
+
+def find_inputs(patterns: List[str], manifest: Optional[str]) -> List[Path]:
+    paths: List[Path] = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches and not glob.has_magic(pattern):
+            matches = [pattern]
+        paths.extend(Path(match) for match in sorted(matches))
+    if manifest is not None:
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.append(Path(line))
+    # Drop duplicates, keeping the first occurrence.
+    return list(dict.fromkeys(paths))
+
+
+def output_path_for(path: Path) -> Path:
+    """Replace the extension of an input path by .c, e.g. func.s.gz -> func.c."""
+    if path.suffix in COMPRESSED_SUFFIXES:
+        path = path.with_suffix("")
+    return path.with_suffix(".c")
+
+
+def job_stamp(asm_path: Path, dependencies: List[Path], flags: List[str]) -> str:
+    """Hash everything the output for a file depends on: the file, the context
+    and --rodata files (by modification time and size), the flags passed on
+    to mips_to_c, and the decompiler itself."""
+    states: List[Optional[Tuple[str, int, int]]] = []
+    for path in [asm_path, *dependencies]:
+        try:
+            states.append(file_state(str(path)))
+        except OSError:
+            states.append(None)
+    state = {"inputs": states, "flags": flags, "decompiler": decompiler_hash()}
+    return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+def stamp_key(job: BatchJob, output_dir: Path) -> str:
+    return job.output_path.relative_to(output_dir).as_posix()
+
+
+def load_stamps(output_dir: Path) -> Dict[str, str]:
+    try:
+        with open(output_dir / STAMPS_FILE_NAME, "r", encoding="utf-8") as f:
+            stamps: Dict[str, str] = json.load(f)
+            return stamps
+    except (OSError, ValueError):
+        return {}
+
+
+def is_up_to_date(job: BatchJob, output_dir: Path, stamps: Dict[str, str]) -> bool:
+    """Whether the output for a file exists and was made from the same inputs."""
+    return (
+        job.output_path.is_file()
+        and stamps.get(stamp_key(job, output_dir)) == job.stamp
+    )
+
+
+def run_job(job: BatchJob, flags: List[str]) -> BatchResult:
+    options = parse_flags([str(job.asm_path), *flags])
+    with open_text_input(str(job.asm_path)) as f:
+        asm_text = f.read()
+    result = decompile(asm_text, None, options, typemap=batch_typemap)
+    messages = result.warnings + result.errors
+    if result.success:
+        write_output(job.output_path, result.c_code)
+    return BatchResult(job.asm_path, result.success, messages, result.c_code)
+
+
+def run_job_star(args: Tuple[BatchJob, List[str]]) -> BatchResult:
+    return run_job(*args)
+
+
+def write_output(path: Path, c_code: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(c_code)
+    os.replace(tmp_path, path)
+
+
+def canonicalize_job(job: BatchJob, flags: List[str]) -> Optional[CanonicalForm]:
+    """The canonical form of the functions in a file, for --dedupe. The file's
+    rodata is part of the key, since the output depends on it too."""
+    options = parse_flags([str(job.asm_path), *flags])
+    # Problems with the file are reported when it's decompiled.
+    with capture_diagnostics():
+        try:
+            with open_text_input(str(job.asm_path)) as f:
+                mips_file = parse_file(f, options)
+        except (OSError, DecompFailure):
+            return None
+    return canonicalize(
+        mips_file.functions, batch_typemap, salt=rodata_hash(mips_file.rodata)
+    )
+
+
+def canonicalize_job_star(args: Tuple[BatchJob, List[str]]) -> Optional[CanonicalForm]:
+    return canonicalize_job(*args)
+
+
+def find_duplicates(
+    jobs: List[BatchJob], forms: List[Optional[CanonicalForm]]
+) -> Tuple[List[BatchJob], Duplicates]:
+    """Split the jobs into those that need to be run, and the duplicates of
+    each of them."""
+    first: Dict[str, BatchJob] = {}
+    unique: List[BatchJob] = []
+    duplicates: Duplicates = {}
+    for job, form in zip(jobs, forms):
+        if form is None:
+            unique.append(job)
+        elif form.key not in first:
+            first[form.key] = job
+            unique.append(job)
+            duplicates[job.asm_path] = (form, [])
+        else:
+            duplicates[first[form.key].asm_path][1].append((job, form))
+    return unique, duplicates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Decompile many MIPS assembly files against one C context.",
+        epilog="Any arguments after '--' are passed on as options for every "
+        "file, e.g. '-- --no-casts'.",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        metavar="ASM",
+        help="assembly files or glob patterns (use '**' to match directories "
+        "recursively, and quote patterns to keep the shell from expanding them)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        dest="manifest",
+        help="file listing assembly files to decompile, one per line",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        metavar="DIR",
+        dest="output_dir",
+        required=True,
+        help="directory to write .c files to, mirroring the input tree",
+    )
+    parser.add_argument(
+        "--root",
+        metavar="DIR",
+        dest="root",
+        help="directory that output paths are relative to "
+        "(default: the common parent of all inputs)",
+    )
+    parser.add_argument(
+        "--context",
+        metavar="C_FILE",
+        dest="c_context",
+        help="read variable types/function signatures/structs from an existing C "
+        "file, parsed only once for the whole batch",
+    )
+    parser.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=0,
+        help="number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--dedupe",
+        dest="dedupe",
+        action="store_true",
+        help="decompile files whose functions only differ in their names and the "
+        "names of their labels once, and write renamed copies of the output for "
+        "the others",
+    )
+    parser.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="decompile files even if their inputs, the flags and the decompiler "
+        "are unchanged since their output was written",
+    )
+    argv = sys.argv[1:]
+    flags: List[str] = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, flags = argv[:index], argv[index + 1 :]
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(min(2 ** 31 - 1, 10 * sys.getrecursionlimit()))
+
+    inputs = find_inputs(args.inputs, args.manifest)
+    if not inputs:
+        parser.error("no input files")
+    if args.root is not None:
+        root = Path(args.root)
+    else:
+        root = Path(os.path.commonpath([str(path.parent) for path in inputs]))
+    output_dir = Path(args.output_dir)
+
+    # The flags are the same for every file, so parse them once to find the
+    # files they refer to.
+    file_options = parse_flags(["-", *flags])
+    dependencies = [Path(path) for path in file_options.rodata_files]
+    for c_context in [args.c_context, file_options.c_context]:
+        if c_context is not None:
+            dependencies.append(Path(c_context))
+    stamps = load_stamps(output_dir)
+    jobs: List[BatchJob] = []
+    for asm_path in inputs:
+        try:
+            relative = asm_path.relative_to(root)
+        except ValueError:
+            print(f"{asm_path} is not inside {root}.", file=sys.stderr)
+            sys.exit(1)
+        stamp = job_stamp(asm_path, dependencies, flags)
+        job = BatchJob(asm_path, output_path_for(output_dir / relative), stamp)
+        if args.force or not is_up_to_date(job, output_dir, stamps):
+            jobs.append(job)
+    print(
+        f"Decompiling {len(jobs)} of {len(inputs)} files "
+        f"({len(inputs) - len(jobs)} up to date).",
+        file=sys.stderr,
+    )
+    if not jobs:
+        sys.exit(0)
+
+    global batch_typemap
+    try:
+        batch_typemap = load_context(args.c_context)
+    except (OSError, DecompFailure) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    num_failed = 0
+    num_saved = 0
+    jobs_by_path = {job.asm_path: job for job in jobs}
+    try:
+        with multiprocessing.Pool(
+            args.jobs or None, initializer=init_worker, initargs=(args.c_context,)
+        ) as pool:
+            duplicates: Duplicates = {}
+            if args.dedupe:
+                forms = pool.map(canonicalize_job_star, [(job, flags) for job in jobs])
+                jobs, duplicates = find_duplicates(jobs, forms)
+            work = [(job, flags) for job in jobs]
+            while work:
+                retry: List[Tuple[BatchJob, List[str]]] = []
+                for result in pool.imap_unordered(run_job_star, work):
+                    for message in result.messages:
+                        print(f"{result.asm_path}: {message}", file=sys.stderr)
+                    result_job = jobs_by_path[result.asm_path]
+                    if result.success:
+                        stamps[stamp_key(result_job, output_dir)] = result_job.stamp
+                    else:
+                        stamps.pop(stamp_key(result_job, output_dir), None)
+                        num_failed += 1
+                    source, copies = duplicates.pop(result.asm_path, (None, []))
+                    for job, form in copies:
+                        renamed: Optional[str] = None
+                        if result.success:
+                            assert source is not None
+                            renamed = rename_output(result.c_code, source, form)
+                        if renamed is not None:
+                            write_output(job.output_path, renamed)
+                            stamps[stamp_key(job, output_dir)] = job.stamp
+                            num_saved += 1
+                        else:
+                            # Error messages mention file names and line
+                            # numbers, and names that can't be renamed may
+                            # appear in the output, so decompile the copies
+                            # to get their own.
+                            retry.append((job, flags))
+                work = retry
+    finally:
+        # Also record the outputs written so far if interrupted.
+        write_output(output_dir / STAMPS_FILE_NAME, json.dumps(stamps, indent=1))
+
+    if args.dedupe:
+        print(
+            f"{num_saved} translations saved by deduplicating files.",
+            file=sys.stderr,
+        )
+
+    if num_failed:
+        print(f"Failed to decompile {num_failed} files.", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
@@ -3,7 +3,8 @@ based on a C AST. Based on the pycparser library."""
 
 from collections import defaultdict
 import copy
-from typing import Any, Dict, Match, Set, List, Tuple, Optional, Union
+import threading
+from typing import Any, Dict, Match, Set, List, TextIO, Tuple, Optional, Union
 import re
 
 import attr
@@ -33,6 +34,12 @@ class Struct:
     # TODO: bitfields
     size: int = attr.ib()
     align: int = attr.ib()
+    # The keys of 'fields', in sorted order, for binary searching.
+    sorted_offsets: List[int] = attr.ib()
+    # Memoized field choices for types.get_field, keyed by (offset, target size).
+    field_choices: Dict[Tuple[int, Optional[int]], StructField] = attr.ib(
+        factory=dict, repr=False
+    )
 
 
 @attr.s
@@ -56,6 +63,26 @@ class TypeMap:
     named_structs: Dict[str, Struct] = attr.ib(factory=dict)
     anon_structs: Dict[int, Struct] = attr.ib(factory=dict)
     enum_values: Dict[str, int] = attr.ib(factory=dict)
+    # Struct layouts and enum values are computed lazily, the first time they
+    # are needed. build_typemap only indexes where they are defined.
+    struct_defs: Dict[str, StructUnion] = attr.ib(factory=dict, repr=False)
+    enumerator_defs: Dict[str, ca.Enum] = attr.ib(factory=dict, repr=False)
+    # Enums whose values are all in enum_values, and enums being parsed by the
+    # thread holding enum_lock (to detect enumerators that refer to themselves).
+    parsed_enums: Set[int] = attr.ib(factory=set, repr=False)
+    parsing_enums: Set[int] = attr.ib(factory=set, repr=False)
+    enum_lock: threading.RLock = attr.ib(factory=threading.RLock, repr=False, eq=False)
+    definitions: List[Union[StructUnion, ca.Enum]] = attr.ib(factory=list, repr=False)
+    # Memo tables for resolve_typedefs and var_size_align, keyed by the id() of
+    # the type node. The node itself is stored as well, to keep its id unique.
+    # Only nodes of the C context are memoized, which the typemap keeps alive
+    # anyway.
+    resolved_typedefs: Dict[int, Tuple[CType, CType]] = attr.ib(
+        factory=dict, repr=False
+    )
+    size_aligns: Dict[int, Tuple[CType, Tuple[int, int]]] = attr.ib(
+        factory=dict, repr=False
+    )
 
 
 def to_c(node: ca.Node) -> str:
@@ -71,14 +98,26 @@ def pointer(type: CType) -> CType:
     return PtrDecl(quals=[], type=type)
 
 
-def resolve_typedefs(type: CType, typemap: TypeMap) -> CType:
-    while (
+def is_typedef_name(type: CType, typemap: TypeMap) -> bool:
+    return (
         isinstance(type, TypeDecl)
         and isinstance(type.type, IdentifierType)
         and len(type.type.names) == 1
         and type.type.names[0] in typemap.typedefs
-    ):
+    )
+
+
+def resolve_typedefs(type: CType, typemap: TypeMap) -> CType:
+    if not is_typedef_name(type, typemap):
+        return type
+    cached = typemap.resolved_typedefs.get(id(type))
+    if cached is not None and cached[0] is type:
+        return cached[1]
+    orig_type = type
+    while is_typedef_name(type, typemap):
+        assert isinstance(type, TypeDecl) and isinstance(type.type, IdentifierType)
         type = typemap.typedefs[type.type.names[0]]
+    typemap.resolved_typedefs[id(orig_type)] = (orig_type, type)
     return type
 
 
@@ -198,7 +237,20 @@ def function_arg_size_align(type: CType, typemap: TypeMap) -> Tuple[int, int]:
 
 
 def var_size_align(type: CType, typemap: TypeMap) -> Tuple[int, int]:
+    type = resolve_typedefs(type, typemap)
+    # Only arrays and structs take any work, so only those are memoized. They
+    # always come from the C context: the types made while decompiling (e.g. by
+    # pointer_decay) are pointers and primitives, and shouldn't be kept alive.
+    memoize = isinstance(type, ArrayDecl) or (
+        isinstance(type, TypeDecl) and isinstance(type.type, (ca.Struct, ca.Union))
+    )
+    if memoize:
+        cached = typemap.size_aligns.get(id(type))
+        if cached is not None and cached[0] is type:
+            return cached[1]
     size, align, _ = parse_struct_member(type, "", typemap, allow_unsized=True)
+    if memoize:
+        typemap.size_aligns[id(type)] = (type, (size, align))
     return size, align
 
 
@@ -268,6 +320,10 @@ def parse_constant_int(expr: "ca.Expression", typemap: TypeMap) -> int:
         except ValueError:
             raise DecompFailure(f"Failed to parse {to_c(expr)} as an int literal")
     if isinstance(expr, ca.ID):
+        if expr.name not in typemap.enum_values:
+            enum = typemap.enumerator_defs.get(expr.name)
+            if enum is not None:
+                parse_enum(enum, typemap)
         if expr.name in typemap.enum_values:
             return typemap.enum_values[expr.name]
     if isinstance(expr, ca.BinaryOp):
@@ -338,34 +394,49 @@ def parse_enum(enum: ca.Enum, typemap: TypeMap) -> None:
 
     We match IDO in treating all enums as having size 4, so no need to compute
     size or alignment here."""
-    if enum.values is None:
+    if enum.values is None or id(enum) in typemap.parsed_enums:
         return
-    next_value = 0
-    for enumerator in enum.values.enumerators:
-        if enumerator.value:
-            value = parse_constant_int(enumerator.value, typemap)
-        else:
-            value = next_value
-        next_value = value + 1
-        typemap.enum_values[enumerator.name] = value
+    # Another thread sharing the typemap may be parsing the same enum; wait
+    # for it, rather than seeing only some of the values.
+    with typemap.enum_lock:
+        if id(enum) in typemap.parsed_enums or id(enum) in typemap.parsing_enums:
+            return
+        typemap.parsing_enums.add(id(enum))
+        try:
+            next_value = 0
+            for enumerator in enum.values.enumerators:
+                if enumerator.value:
+                    value = parse_constant_int(enumerator.value, typemap)
+                else:
+                    value = next_value
+                next_value = value + 1
+                typemap.enum_values[enumerator.name] = value
+        finally:
+            typemap.parsing_enums.discard(id(enum))
+        typemap.parsed_enums.add(id(enum))
 
 
 def get_struct(
     struct: Union[ca.Struct, ca.Union], typemap: TypeMap
 ) -> Optional[Struct]:
+    """Get the layout of a struct, computing it if this is the first time it is
+    asked for. Returns None if the struct has not been defined."""
+    definition: Optional[StructUnion]
     if struct.name:
-        return typemap.named_structs.get(struct.name)
+        existing = typemap.named_structs.get(struct.name)
+        if existing:
+            return existing
+        definition = typemap.struct_defs.get(struct.name)
+        if definition is None and struct.decls is not None:
+            definition = struct
     else:
-        return typemap.anon_structs.get(id(struct))
-
-
-def parse_struct(struct: Union[ca.Struct, ca.Union], typemap: TypeMap) -> Struct:
-    existing = get_struct(struct, typemap)
-    if existing:
-        return existing
-    if struct.decls is None:
-        raise DecompFailure(f"Tried to use struct {struct.name} before it is defined.")
-    ret = do_parse_struct(struct, typemap)
+        existing = typemap.anon_structs.get(id(struct))
+        if existing:
+            return existing
+        definition = struct
+    if definition is None or definition.decls is None:
+        return None
+    ret = do_parse_struct(definition, typemap)
     if struct.name:
         typemap.named_structs[struct.name] = ret
     else:
@@ -373,6 +444,13 @@ def parse_struct(struct: Union[ca.Struct, ca.Union], typemap: TypeMap) -> Struct
     return ret
 
 
+def parse_struct(struct: Union[ca.Struct, ca.Union], typemap: TypeMap) -> Struct:
+    ret = get_struct(struct, typemap)
+    if ret is None:
+        raise DecompFailure(f"Tried to use struct {struct.name} before it is defined.")
+    return ret
+
+
 def parse_struct_member(
     type: CType, field_name: str, typemap: TypeMap, *, allow_unsized: bool
 ) -> Tuple[int, int, Optional[Struct]]:
@@ -395,8 +473,6 @@ def parse_struct_member(
     if isinstance(inner_type, (ca.Struct, ca.Union)):
         substr = parse_struct(inner_type, typemap)
         return substr.size, substr.align, substr
-    if isinstance(inner_type, ca.Enum):
-        parse_enum(inner_type, typemap)
     # Otherwise it has to be of type Enum or IdentifierType
     size = primitive_size(inner_type)
     if size == 0 and not allow_unsized:
@@ -494,8 +570,6 @@ def do_parse_struct(struct: Union[ca.Struct, ca.Union], typemap: TypeMap) -> Str
                     union_size = max(union_size, substr.size)
                 else:
                     offset += substr.size
-        elif isinstance(type, ca.Enum):
-            parse_enum(type, typemap)
 
     if not is_union and bit_offset != 0:
         bit_offset = 0
@@ -503,7 +577,7 @@ def do_parse_struct(struct: Union[ca.Struct, ca.Union], typemap: TypeMap) -> Str
 
     size = union_size if is_union else offset
     size = (size + align - 1) & -align
-    return Struct(fields=fields, size=size, align=align)
+    return Struct(fields=fields, size=size, align=align, sorted_offsets=sorted(fields))
 
 
 def add_builtin_typedefs(source: str) -> str:
@@ -564,6 +638,38 @@ def parse_c(source: str) -> ca.FileAST:
         raise DecompFailure(f"Syntax error when parsing C context.\n{msg}{posstr}")
 
 
+def index_definitions(type: ca.Node, typemap: TypeMap) -> None:
+    """Record the struct, union and enum definitions within a type (including
+    ones nested in struct members), so they can be parsed on demand."""
+    while isinstance(type, (TypeDecl, PtrDecl, ArrayDecl)):
+        type = type.type
+    if isinstance(type, (ca.Struct, ca.Union)):
+        if type.decls is None:
+            return
+        typemap.definitions.append(type)
+        if type.name:
+            typemap.struct_defs.setdefault(type.name, type)
+        for decl in type.decls:
+            if isinstance(decl, ca.Decl):
+                index_definitions(decl.type, typemap)
+    elif isinstance(type, ca.Enum):
+        if type.values is None:
+            return
+        typemap.definitions.append(type)
+        for enumerator in type.values.enumerators:
+            typemap.enumerator_defs[enumerator.name] = type
+
+
+def parse_all_definitions(typemap: TypeMap) -> None:
+    """Eagerly compute all struct layouts and enum values, in the order they
+    are defined."""
+    for definition in typemap.definitions:
+        if isinstance(definition, ca.Enum):
+            parse_enum(definition, typemap)
+        else:
+            parse_struct(definition, typemap)
+
+
 def build_typemap(source: str) -> TypeMap:
     source = add_builtin_typedefs(source)
     source = strip_comments(source)
@@ -585,12 +691,10 @@ def build_typemap(source: str) -> TypeMap:
 
     class Visitor(ca.NodeVisitor):
         def visit_Struct(self, struct: ca.Struct) -> None:
-            if struct.decls is not None:
-                parse_struct(struct, ret)
+            index_definitions(struct, ret)
 
         def visit_Union(self, union: ca.Union) -> None:
-            if union.decls is not None:
-                parse_struct(union, ret)
+            index_definitions(union, ret)
 
         def visit_Decl(self, decl: ca.Decl) -> None:
             if decl.name is not None:
@@ -599,7 +703,7 @@ def build_typemap(source: str) -> TypeMap:
                 self.visit(decl.type)
 
         def visit_Enum(self, enum: ca.Enum) -> None:
-            parse_enum(enum, ret)
+            index_definitions(enum, ret)
 
         def visit_FuncDef(self, fn: ca.FuncDef) -> None:
             if fn.decl.name is not None:
@@ -635,12 +739,13 @@ def type_to_string(type: CType) -> str:
     return to_c(decl)
 
 
-def dump_typemap(typemap: TypeMap) -> None:
-    print("Variables:")
+def dump_typemap(typemap: TypeMap, out: TextIO) -> None:
+    parse_all_definitions(typemap)
+    print("Variables:", file=out)
     for var, type in typemap.var_types.items():
-        print(f"{var}:", type_to_string(type))
-    print()
-    print("Functions:")
+        print(f"{var}:", type_to_string(type), file=out)
+    print(file=out)
+    print("Functions:", file=out)
     for name, fn in typemap.functions.items():
         if fn.params is None:
             params_str = ""
@@ -650,18 +755,18 @@ def dump_typemap(typemap: TypeMap) -> None:
                 params.append("...")
             params_str = ", ".join(params) or "void"
         ret_str = "void" if fn.ret_type is None else type_to_string(fn.ret_type)
-        print(f"{name}: {ret_str}({params_str})")
-    print()
-    print("Structs:")
+        print(f"{name}: {ret_str}({params_str})", file=out)
+    print(file=out)
+    print("Structs:", file=out)
     for name, struct in typemap.named_structs.items():
-        print(f"{name}: size {struct.size}, align {struct.align}")
+        print(f"{name}: size {struct.size}, align {struct.align}", file=out)
         for offset, fields in struct.fields.items():
-            print(f"  {hex(offset)}:", end="")
+            print(f"  {hex(offset)}:", end="", file=out)
             for field in fields:
-                print(f" {field.name} ({type_to_string(field.type)})", end="")
-            print()
-    print()
-    print("Enums:")
+                print(f" {field.name} ({type_to_string(field.type)})", end="", file=out)
+            print(file=out)
+    print(file=out)
+    print("Enums:", file=out)
     for name, value in typemap.enum_values.items():
-        print(f"{name}: {value}")
-    print()
+        print(f"{name}: {value}", file=out)
+    print(file=out)
@@ -0,0 +1,184 @@
+"""Finding functions whose bodies are identical except for their own names
+and the names of their local labels, like stubs, copied helpers and template
+instantiations, so that only one of them has to be decompiled. The output for
+the others is made by renaming the function and labels in that one's output,
+unless their names appear in it as anything but the functions' declarators and
+calls to them.
+"""
+
+import hashlib
+import re
+from typing import Dict, List, Match, Optional, Set, Tuple
+
+import attr
+
+from .c_types import TypeMap
+from .parse_file import Function, Label
+from .parse_instruction import Instruction
+
+# Symbol names as they appear in instructions and in the C output.
+RE_NAME = re.compile(r"(?<![\w.$])[A-Za-z_.$][\w.$]*")
+
+# String and character literals and comments in the C output.
+RE_LITERAL_OR_COMMENT = (
+    r'"(?:\\.|[^"\\\n])*"' r"|'(?:\\.|[^'\\\n])*'" r"|//[^\n]*|/\*.*?\*/"
+)
+RE_MEMBER_ACCESS = re.compile(r"(?:\.|->)\s*$")
+RE_CALL = re.compile(r"\s*\(")
+
+
+@attr.s
+class CanonicalForm:
+    # A hash of the functions with their names and labels numbered.
+    key: str = attr.ib()
+    # The numbered names, in order.
+    names: List[str] = attr.ib()
+    # Which of them are the names of the functions, rather than labels.
+    functions: Set[str] = attr.ib()
+
+
+def canonicalize(
+    functions: List[Function], typemap: Optional[TypeMap], salt: str = ""
+) -> Optional[CanonicalForm]:
+    """Compute the canonical form of a group of functions, which are output
+    together: the names of the functions and their labels are replaced by
+    numbers in order of appearance. Other symbols are kept, so e.g. calls to
+    different functions or loads of different jump tables don't compare equal.
+    'salt' is hashed along, for anything else the output depends on.
+
+    Functions with a signature in the C context are not deduplicated, since
+    their output depends on their name. For those, None is returned."""
+    numbers: Dict[str, int] = {}
+    for function in functions:
+        if typemap and function.name in typemap.functions:
+            return None
+        numbers.setdefault(function.name, len(numbers))
+        for item in function.body:
+            if isinstance(item, Label):
+                numbers.setdefault(item.name, len(numbers))
+
+    def number(m: Match[str]) -> str:
+        name = m.group()
+        index = numbers.get(name.lstrip("."))
+        if index is None:
+            return name
+        return "." * (len(name) - len(name.lstrip("."))) + f"<{index}>"
+
+    h = hashlib.sha1(salt.encode("utf-8"))
+    for function in functions:
+        h.update(f"function <{numbers[function.name]}>\n".encode("utf-8"))
+        for item in function.body:
+            if isinstance(item, Label):
+                line = f"<{numbers[item.name]}>:"
+            else:
+                assert isinstance(item, Instruction)
+                line = RE_NAME.sub(number, str(item))
+                # Which branches match a --goto pattern isn't visible in the
+                # instruction, but changes the output.
+                if item.meta.emit_goto:
+                    line += " # goto"
+            h.update(f"{line}\n".encode("utf-8"))
+    return CanonicalForm(
+        key=h.hexdigest(),
+        names=list(numbers),
+        functions={function.name for function in functions},
+    )
+
+
+def rename_output(
+    text: str, source: CanonicalForm, target: CanonicalForm
+) -> Optional[str]:
+    """Turn the output for the functions with the canonical form 'source' into
+    the output for 'target', which has the same key.
+
+    Only the functions' declarators and calls to them can be renamed, since
+    the same name may also be e.g. a struct field, or appear in a string or a
+    comment, which the target's output would have unchanged. If any of the
+    names to rename appear otherwise, None is returned, and the target has to
+    be decompiled by itself."""
+    assert source.key == target.key
+    renames = {old: new for old, new in zip(source.names, target.names) if old != new}
+    if not renames:
+        return text
+    names = "|".join(re.escape(name) for name in sorted(renames, key=len, reverse=True))
+    name_pattern = re.compile(r"(?<![\w$])(" + names + r")(?![\w.$])")
+    pattern = re.compile(
+        RE_LITERAL_OR_COMMENT + r"|(?<![\w$])(?P<name>" + names + r")(?![\w.$])",
+        re.S,
+    )
+    parts: List[str] = []
+    pos = 0
+    for m in pattern.finditer(text):
+        name = m.group("name")
+        if name is None:
+            if name_pattern.search(m.group()):
+                return None
+            continue
+        if (
+            name not in source.functions
+            or RE_MEMBER_ACCESS.search(text, max(0, m.start() - 16), m.start())
+            or not RE_CALL.match(text, m.end())
+        ):
+            return None
+        parts.append(text[pos : m.start()])
+        parts.append(renames[name])
+        pos = m.end()
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+@attr.s
+class Deduplicator:
+    """Outputs of functions with duplicates, during a run over the functions
+    of a file."""
+
+    # The canonical form of each function to be decompiled, by index in the
+    # file, or None for functions that aren't deduplicated.
+    forms: List[Optional[CanonicalForm]] = attr.ib()
+    # How many functions have each key.
+    counts: Dict[str, int] = attr.ib()
+    # The first output for each key with duplicates.
+    outputs: Dict[str, Tuple[CanonicalForm, str]] = attr.ib(factory=dict)
+    saved: int = attr.ib(default=0)
+
+    @staticmethod
+    def build(
+        functions: List[Function], selected: List[bool], typemap: Optional[TypeMap]
+    ) -> "Deduplicator":
+        forms: List[Optional[CanonicalForm]] = []
+        counts: Dict[str, int] = {}
+        for function, is_selected in zip(functions, selected):
+            form = canonicalize([function], typemap) if is_selected else None
+            forms.append(form)
+            if form is not None:
+                counts[form.key] = counts.get(form.key, 0) + 1
+        return Deduplicator(forms, counts)
+
+    def has_duplicates(self, index: int) -> bool:
+        form = self.forms[index]
+        return form is not None and self.counts[form.key] > 1
+
+    def reuse(self, index: int) -> Optional[str]:
+        """The output for a function, if a duplicate of it has been output and
+        can be renamed."""
+        form = self.forms[index]
+        if form is None or form.key not in self.outputs:
+            return None
+        source, text = self.outputs[form.key]
+        renamed = rename_output(text, source, form)
+        if renamed is not None:
+            self.saved += 1
+        return renamed
+
+    def add_output(self, index: int, text: str) -> None:
+        form = self.forms[index]
+        assert form is not None
+        self.outputs.setdefault(form.key, (form, text))
+
+    def summary(self) -> str:
+        num_classes = sum(1 for count in self.counts.values() if count > 1)
+        num_functions = sum(count for count in self.counts.values() if count > 1)
+        return (
+            f"Found {num_functions} functions with duplicates, in {num_classes} "
+            f"groups; {self.saved} translations saved."
+        )
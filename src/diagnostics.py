@@ -0,0 +1,46 @@
+"""Warnings and recoverable errors reported while decompiling.
+
+On the command line these are printed as they happen. The decompile() API in
+api.py instead collects them per thread using capture_diagnostics(), so that
+several decompilations can run concurrently without touching stdout."""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import attr
+
+
+@attr.s
+class Diagnostics:
+    warnings: List[str] = attr.ib(factory=list)
+    errors: List[str] = attr.ib(factory=list)
+
+
+_state = threading.local()
+
+
+def current_diagnostics() -> Optional[Diagnostics]:
+    """Return the diagnostics being captured on this thread, or None if they
+    should be printed."""
+    ret: Optional[Diagnostics] = getattr(_state, "diagnostics", None)
+    return ret
+
+
+@contextmanager
+def capture_diagnostics() -> Iterator[Diagnostics]:
+    prev = current_diagnostics()
+    diagnostics = Diagnostics()
+    _state.diagnostics = diagnostics
+    try:
+        yield diagnostics
+    finally:
+        _state.diagnostics = prev
+
+
+def warn(message: str) -> None:
+    diagnostics = current_diagnostics()
+    if diagnostics is None:
+        print(message)
+    else:
+        diagnostics.warnings.append(message)
@@ -4,7 +4,9 @@ from typing import Any, Counter, Dict, Iterator, List, Optional, Set, Tuple, Uni
 
 import attr
 
+from .diagnostics import warn
 from .error import DecompFailure
+from .profiling import count
 from .parse_file import Function, Label, Rodata
 from .parse_instruction import (
     AsmAddressMode,
@@ -633,7 +635,7 @@ def build_blocks(function: Function, rodata: Rodata) -> List[Block]:
         # anonymous ("jr" instructions create new anonymous blocks, so if it's
         # not we must be missing a "jr $ra").
         label = block_builder.curr_label.name
-        print(f'Warning: missing "jr $ra" in last block (.{label}).\n')
+        warn(f'Warning: missing "jr $ra" in last block (.{label}).\n')
         meta = InstructionMeta.missing()
         block_builder.add_instruction(Instruction("jr", [Register("ra")], meta))
         block_builder.add_instruction(Instruction("nop", [], meta))
@@ -810,7 +812,8 @@ def build_graph_from_block(
                 )
 
             jtbl_name = jtbl_names[0]
-            if jtbl_name not in rodata.values:
+            jtbl_entry = rodata.get(jtbl_name)
+            if jtbl_entry is None:
                 raise DecompFailure(
                     f"Found jr instruction {jump.meta.loc_str()}, but the "
                     "corresponding jump table is not provided.\n"
@@ -823,9 +826,8 @@ def build_graph_from_block(
                     "to get correct control flow for non-jtbl switch jumps.)"
                 )
 
-            jtbl_entries = rodata.values[jtbl_name].data
-            for entry in jtbl_entries:
-                if isinstance(entry, bytes):
+            for entry in jtbl_entry.items:
+                if not isinstance(entry, str):
                     # We have entered padding, stop reading.
                     break
                 entry = entry.lstrip(".")
@@ -1054,6 +1056,8 @@ def build_flowgraph(function: Function, rodata: Rodata) -> FlowGraph:
     nodes = duplicate_premature_returns(nodes)
     ensure_fallthrough(nodes)
     compute_dominators(nodes)
+    count("blocks", len(blocks))
+    count("nodes", len(nodes))
     return FlowGraph(nodes)
 
 
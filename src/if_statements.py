@@ -1,5 +1,6 @@
 from collections import defaultdict
-from typing import Dict, List, Optional, Set, Tuple, Union
+import io
+from typing import Dict, List, Optional, Set, TextIO, Tuple, Union
 
 import attr
 
@@ -13,6 +14,7 @@ from .flow_graph import (
     SwitchNode,
 )
 from .options import CodingStyle, Options
+from .profiling import count, phase
 from .translate import (
     BinaryOp,
     BlockInfo,
@@ -55,35 +57,32 @@ class IfElseStatement:
         return True
 
     def format(self, fmt: Formatter) -> str:
+        out = io.StringIO()
+        self.write(fmt, out)
+        return out.getvalue()
+
+    def write(self, fmt: Formatter, out: TextIO, *, indent_first: bool = True) -> None:
         space = fmt.indent(self.indent, "")
         condition = simplify_condition(self.condition)
         cond_str = format_expr(condition, fmt)
         after_ifelse = f"\n{space}" if fmt.coding_style.newline_after_if else " "
         before_else = f"\n{space}" if fmt.coding_style.newline_before_else else " "
-        if_str = "\n".join(
-            [
-                f"{space}if ({cond_str}){after_ifelse}{{",
-                self.if_body.format(fmt),  # has its own indentation
-                f"{space}}}",
-            ]
-        )
+        if indent_first:
+            out.write(space)
+        out.write(f"if ({cond_str}){after_ifelse}{{\n")
+        self.if_body.write(fmt, out)  # has its own indentation
+        out.write(f"\n{space}}}")
         if self.else_body is not None and not self.else_body.is_empty():
             sub_if = self.else_body.get_lone_if_statement()
             if sub_if:
+                out.write(f"{before_else}else ")
                 fmt.extra_indent -= 1
-                sub_if_str = sub_if.format(fmt).lstrip()
+                sub_if.write(fmt, out, indent_first=False)
                 fmt.extra_indent += 1
-                else_str = f"{before_else}else {sub_if_str}"
             else:
-                else_str = "\n".join(
-                    [
-                        f"{before_else}else{after_ifelse}{{",
-                        self.else_body.format(fmt),
-                        f"{space}}}",
-                    ]
-                )
-            if_str = if_str + else_str
-        return if_str
+                out.write(f"{before_else}else{after_ifelse}{{\n")
+                self.else_body.write(fmt, out)
+                out.write(f"\n{space}}}")
 
 
 @attr.s
@@ -100,6 +99,9 @@ class SimpleStatement:
         else:
             return fmt.indent(self.indent, self.contents.format(fmt))
 
+    def write(self, fmt: Formatter, out: TextIO) -> None:
+        out.write(self.format(fmt))
+
 
 @attr.s
 class LabelStatement:
@@ -123,6 +125,9 @@ class LabelStatement:
             lines.append(f"{label_for_node(self.context, self.node)}:")
         return "\n".join(lines)
 
+    def write(self, fmt: Formatter, out: TextIO) -> None:
+        out.write(self.format(fmt))
+
 
 Statement = Union[SimpleStatement, IfElseStatement, LabelStatement]
 
@@ -168,11 +173,20 @@ class Body:
         return ret
 
     def format(self, fmt: Formatter) -> str:
-        return "\n".join(
-            statement.format(fmt)
-            for statement in self.statements
-            if statement.should_write()
-        )
+        out = io.StringIO()
+        self.write(fmt, out)
+        return out.getvalue()
+
+    def write(self, fmt: Formatter, out: TextIO) -> None:
+        """Write the statements of the body to 'out', separated by newlines.
+        Like format(), this does not end with a newline."""
+        first = True
+        for statement in self.statements:
+            if statement.should_write():
+                if not first:
+                    out.write("\n")
+                statement.write(fmt, out)
+                first = False
 
 
 def label_for_node(context: Context, node: Node) -> str:
@@ -782,15 +796,35 @@ def build_body(context: Context, function_info: FunctionInfo, options: Options)
 
 
 def get_function_text(function_info: FunctionInfo, options: Options) -> str:
+    out = io.StringIO()
+    write_function_text(function_info, options, out)
+    return out.getvalue()
+
+
+def write_function_text(
+    function_info: FunctionInfo, options: Options, out: TextIO
+) -> None:
+    """Write the C code for a function to 'out', without a trailing newline."""
     fmt = Formatter(options.coding_style, skip_casts=options.skip_casts)
     context = Context(flow_graph=function_info.flow_graph, options=options, fmt=fmt)
-    body: Body = build_body(context, function_info, options)
+    with phase("build_body"):
+        body: Body = build_body(context, function_info, options)
+    count("reachable_without", len(context.reachable_without))
 
+    with phase("format"):
+        write_function(context, function_info, body, out)
+
+
+def write_function(
+    context: Context, function_info: FunctionInfo, body: Body, out: TextIO
+) -> None:
+    """Write the function signature, variable declarations and body."""
+    fmt = context.fmt
     function_lines: List[str] = []
 
     fn_name = function_info.stack_info.function.name
     arg_strs = []
-    for arg in function_info.stack_info.arguments:
+    for arg in function_info.stack_info.sorted_arguments():
         arg_strs.append(arg.type.to_decl(arg.format(fmt)))
     if function_info.stack_info.is_variadic:
         arg_strs.append("...")
@@ -806,7 +840,7 @@ def get_function_text(function_info: FunctionInfo, options: Options) -> str:
     function_lines.append(f"{fn_header}{whitespace}{{")
 
     any_decl = False
-    for local_var in function_info.stack_info.local_vars[::-1]:
+    for local_var in function_info.stack_info.sorted_local_vars()[::-1]:
         type_decl = local_var.type.to_decl(local_var.format(fmt))
         function_lines.append(SimpleStatement(1, f"{type_decl};").format(fmt))
         any_decl = True
@@ -826,7 +860,8 @@ def get_function_text(function_info: FunctionInfo, options: Options) -> str:
     if any_decl:
         function_lines.append("")
 
-    function_lines.append(body.format(fmt))
-    function_lines.append("}")
-    full_function_text: str = "\n".join(function_lines)
-    return full_function_text
+    for line in function_lines:
+        out.write(line)
+        out.write("\n")
+    body.write(fmt, out)
+    out.write("\n}")
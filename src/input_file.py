@@ -0,0 +1,128 @@
+"""Opening input files that may be compressed or inside an archive.
+
+A path like "dump.s.gz" is decompressed on the fly (gzip, bz2 and xz are
+recognized by their magic bytes, not the extension), and a path like
+"dumps.tar.xz/asm/func.s" or "dumps.zip/asm/func.s" names a member of an
+archive: if the path doesn't exist, its longest existing prefix that is a
+tar or zip file is opened instead. Everything is streamed through the
+standard library decompressors; nothing is extracted to disk.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import IO, Iterator, Optional, TextIO, Tuple, cast
+
+from .error import DecompFailure
+
+COMPRESSED_MAGICS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+]
+
+# Suffixes dropped from input names when deriving output names.
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz")
+
+
+def split_archive_path(path: str) -> Tuple[str, Optional[str]]:
+    """Split a path into the file on disk and the name of a member inside it,
+    or None if the path is an ordinary file."""
+    if os.path.exists(path):
+        return path, None
+    head, tail = os.path.split(path)
+    member = tail
+    while head and head != os.path.dirname(head):
+        if os.path.isfile(head):
+            if tarfile.is_tarfile(head) or zipfile.is_zipfile(head):
+                return head, member
+            break
+        head, tail = os.path.split(head)
+        member = tail + "/" + member
+    return path, None
+
+
+def input_stat(path: str) -> os.stat_result:
+    """The stat() result of the file on disk that contains the input."""
+    return os.stat(split_archive_path(path)[0])
+
+
+def is_plain_file(path: str) -> bool:
+    """Whether the input is an uncompressed file on disk, which can be seeked
+    in and mapped into memory."""
+    if split_archive_path(path)[1] is not None:
+        return False
+    with open(path, "rb") as f:
+        return compression_of(f.read(6)) is None
+
+
+def compression_of(magic: bytes) -> Optional[str]:
+    for prefix, compression in COMPRESSED_MAGICS:
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+def open_decompressor(f: IO[bytes], compression: str) -> IO[bytes]:
+    stream: io.BufferedIOBase
+    if compression == "gzip":
+        stream = gzip.GzipFile(fileobj=f)
+    elif compression == "bz2":
+        stream = bz2.BZ2File(f)
+    else:
+        stream = lzma.LZMAFile(f)
+    return cast(IO[bytes], stream)
+
+
+def open_archive_member(stack: ExitStack, archive: str, member: str) -> IO[bytes]:
+    if zipfile.is_zipfile(archive):
+        zip_file = stack.enter_context(zipfile.ZipFile(archive))
+        try:
+            return stack.enter_context(zip_file.open(member))
+        except KeyError:
+            pass
+    else:
+        tar_file = stack.enter_context(tarfile.open(archive, "r:*"))
+        for info in tar_file:
+            if info.isfile() and os.path.normpath(info.name) == member:
+                f = tar_file.extractfile(info)
+                assert f is not None
+                return stack.enter_context(f)
+    raise DecompFailure(f"{archive} has no member {member}.")
+
+
+@contextmanager
+def open_binary_input(path: str) -> Iterator[IO[bytes]]:
+    """Open an input file for reading bytes, decompressing it if needed."""
+    archive, member = split_archive_path(path)
+    with ExitStack() as stack:
+        f: IO[bytes]
+        if member is None:
+            f = stack.enter_context(open(path, "rb"))
+        else:
+            f = open_archive_member(stack, archive, os.path.normpath(member))
+        if not isinstance(f, io.BufferedReader):
+            f = stack.enter_context(io.BufferedReader(f))  # type: ignore
+        assert isinstance(f, io.BufferedReader)
+        compression = compression_of(f.peek(6)[:6])
+        if compression is not None:
+            f = stack.enter_context(open_decompressor(f, compression))
+        try:
+            yield f
+        except (EOFError, lzma.LZMAError, zlib.error) as e:
+            raise DecompFailure(f"{path}: failed to decompress: {e}") from None
+
+
+@contextmanager
+def open_text_input(path: str) -> Iterator[TextIO]:
+    """Open an input file for reading text, like open(path, "r",
+    encoding="utf-8-sig"), but decompressing it if needed."""
+    with open_binary_input(path) as f:
+        with io.TextIOWrapper(f, encoding="utf-8-sig") as text:
+            yield text
@@ -1,19 +1,51 @@
 import argparse
+import io
+import os
+from contextlib import redirect_stdout
+import sqlite3
 import sys
+import time
 import traceback
-from typing import List, Optional
+from typing import Dict, List, Optional, TextIO
 
+from .dedupe import Deduplicator
 from .error import DecompFailure
 from .flow_graph import build_flowgraph, visualize_flowgraph
-from .if_statements import get_function_text
+from .if_statements import write_function_text
+from .input_file import open_text_input
 from .options import Options, CodingStyle
-from .parse_file import Function, MIPSFile, Rodata, parse_file
-from .translate import translate_to_ast
+from .parse_elf import is_elf_file, parse_elf_file
+from .parse_file import Function, MIPSFile, Rodata, load_rodata_file, parse_file
+from .profiling import (
+    current_profile,
+    file_phase,
+    profile_function,
+    profiling,
+    tracing,
+)
+from .results_db import ResultsDb
+from .shard import MARKER_FORMAT, assign_shards, parse_shard
+from .sweep import write_sweep
+from .translate import FunctionInfo, translate_to_ast
+from .watch import (
+    POLL_INTERVAL,
+    FileState,
+    FunctionOutput,
+    OutputCache,
+    TypemapHashes,
+    asm_states,
+    context_state,
+    function_key,
+)
 from .c_types import TypeMap, build_typemap, dump_typemap
 
 
 def decompile_function(
-    options: Options, function: Function, rodata: Rodata, typemap: Optional[TypeMap]
+    options: Options,
+    function: Function,
+    rodata: Rodata,
+    typemap: Optional[TypeMap],
+    results_db: Optional[ResultsDb],
 ) -> None:
     if options.print_assembly:
         print(function)
@@ -23,46 +55,237 @@ def decompile_function(
         visualize_flowgraph(build_flowgraph(function, rodata))
         return
 
-    function_info = translate_to_ast(function, options, rodata, typemap)
-    function_text = get_function_text(function_info, options)
-    print(function_text)
+    if results_db is not None:
+        decompile_function_recorded(options, function, rodata, typemap, results_db)
+        return
+
+    # Render into a buffer, so that nothing is printed if rendering fails
+    # part-way (e.g. when a struct is laid out late and isn't defined).
+    out = io.StringIO()
+    with profile_function(function.name):
+        function_info = translate_to_ast(function, options, rodata, typemap)
+        write_function_output(function_info, options, out)
+    out.write("\n")
+    sys.stdout.write(out.getvalue())
+
+
+def write_function_output(
+    function_info: FunctionInfo, options: Options, out: TextIO
+) -> None:
+    if options.sweep:
+        write_sweep(function_info, options, out)
+    else:
+        write_function_text(function_info, options, out)
+
+
+def decompile_function_recorded(
+    options: Options,
+    function: Function,
+    rodata: Rodata,
+    typemap: Optional[TypeMap],
+    results_db: ResultsDb,
+) -> None:
+    """Like decompile_function, but print the result stored in the --db
+    database if the function hasn't changed since it was stored, and store
+    the result otherwise."""
+    stored = results_db.lookup(function)
+    if stored is not None:
+        results_db.keep(function)
+        sys.stdout.write(f"{stored.c_code}\n")
+        return
+
+    out = io.StringIO()
+    start = time.perf_counter()
+
+    def record(status: str, error: Optional[str]) -> None:
+        timings = {"total": time.perf_counter() - start}
+        profile = current_profile()
+        if profile is not None and profile.functions:
+            timings.update(profile.functions[-1].timings)
+        c_code = out.getvalue() if error is None else None
+        results_db.add(function, status, c_code, error, timings)
+
+    try:
+        with profile_function(function.name):
+            function_info = translate_to_ast(function, options, rodata, typemap)
+            write_function_output(function_info, options, out)
+    except DecompFailure as e:
+        record("failed", str(e))
+        raise
+    except Exception:
+        record("internal_error", traceback.format_exc())
+        raise
+    record("ok", None)
+    sys.stdout.write(f"{out.getvalue()}\n")
+
+
+def decompile_function_deduplicated(
+    options: Options,
+    index: int,
+    function: Function,
+    rodata: Rodata,
+    typemap: Optional[TypeMap],
+    results_db: Optional[ResultsDb],
+    dedupe: Deduplicator,
+) -> None:
+    """Like decompile_function, for a function that has duplicates in the file:
+    if one of them was output already, print a renamed copy of its output,
+    and otherwise decompile the function and remember its output."""
+    text = dedupe.reuse(index)
+    if text is not None:
+        sys.stdout.write(text)
+        if results_db is not None:
+            results_db.add(function, "ok", text[:-1], None, {"total": 0.0})
+        return
+
+    out = io.StringIO()
+    try:
+        with redirect_stdout(out):
+            decompile_function(options, function, rodata, typemap, results_db)
+    finally:
+        sys.stdout.write(out.getvalue())
+    # Only successful outputs are reused, since error messages include line
+    # numbers.
+    dedupe.add_output(index, out.getvalue())
 
 
 def run(options: Options) -> int:
+    if options.trace is not None:
+        with tracing() as trace:
+            ret = run_profiled(options)
+        with open(options.trace, "w") as f:
+            trace.write_json(f)
+        return ret
+    return run_profiled(options)
+
+
+def run_profiled(options: Options) -> int:
+    # Per-phase timings are also stored in the --db database.
+    if not options.profile and options.db is None:
+        return decompile_file(options)
+
+    with profiling() as profile:
+        ret = decompile_file(options)
+    if not options.profile:
+        return ret
+    profile.write_summary(sys.stderr)
+    if options.profile_json is not None:
+        with open(options.profile_json, "w") as f:
+            profile.write_json(f)
+    return ret
+
+
+def load_mips_file(options: Options) -> MIPSFile:
     mips_file: MIPSFile
-    typemap: Optional[TypeMap] = None
-    try:
+    with file_phase("parse", options.filename):
         if options.filename == "-":
             mips_file = parse_file(sys.stdin, options)
+        elif is_elf_file(options.filename):
+            mips_file = parse_elf_file(options.filename, options)
         else:
-            with open(options.filename, "r", encoding="utf-8-sig") as f:
+            with open_text_input(options.filename) as f:
                 mips_file = parse_file(f, options)
 
         # Move over jtbl rodata from files given by --rodata
         for rodata_file in options.rodata_files:
-            with open(rodata_file, "r", encoding="utf-8-sig") as f:
-                sub_file = parse_file(f, options)
-                sub_file.rodata.merge_into(mips_file.rodata)
+            mips_file.rodata.add_lazy_file(load_rodata_file(rodata_file, options))
+    return mips_file
+
+
+def load_typemap(options: Options) -> Optional[TypeMap]:
+    if options.c_context is None:
+        return None
+    with file_phase("context", options.c_context):
+        with open_text_input(options.c_context) as f:
+            return build_typemap(f.read())
 
-        if options.c_context is not None:
-            with open(options.c_context, "r", encoding="utf-8-sig") as f:
-                typemap = build_typemap(f.read())
+
+def decompile_file(options: Options) -> int:
+    if options.watch is not None:
+        return watch_file(options)
+
+    mips_file: MIPSFile
+    typemap: Optional[TypeMap] = None
+    try:
+        mips_file = load_mips_file(options)
+        typemap = load_typemap(options)
     except (OSError, DecompFailure) as e:
         print(e)
         return 1
 
     if options.dump_typemap:
         assert typemap
-        dump_typemap(typemap)
+        try:
+            dump_typemap(typemap, sys.stdout)
+        except DecompFailure as e:
+            print(e)
+            return 1
         return 0
 
+    results_db: Optional[ResultsDb] = None
+    if options.db is not None:
+        try:
+            results_db = ResultsDb.open(options.db, options, mips_file)
+        except sqlite3.Error as e:
+            print(f"Failed to open {options.db}: {e}")
+            return 1
+    try:
+        return decompile_functions(options, mips_file, typemap, results_db)
+    finally:
+        if results_db is not None:
+            results_db.close()
+
+
+def decompile_functions(
+    options: Options,
+    mips_file: MIPSFile,
+    typemap: Optional[TypeMap],
+    results_db: Optional[ResultsDb],
+) -> int:
     if options.function_index_or_name is None:
         has_error = False
-        for index, fn in enumerate(mips_file.functions):
-            if index != 0:
+        functions = mips_file.functions
+        if options.shard is not None:
+            shard_index, num_shards = options.shard
+            shards = assign_shards(functions, num_shards)
+        dedupe: Optional[Deduplicator] = None
+        # Debug output and printed assembly can't be renamed reliably.
+        if options.dedupe and not (
+            options.debug or options.print_assembly or options.visualize_flowgraph
+        ):
+            selected = [
+                options.shard is None or shards[index] == shard_index
+                for index in range(len(functions))
+            ]
+            dedupe = Deduplicator.build(functions, selected, typemap)
+        for index, fn in enumerate(functions):
+            if options.shard is not None:
+                # Separate functions with markers instead of blank lines, so
+                # that the outputs of all shards can be merged afterwards.
+                if shards[index] != shard_index:
+                    continue
+                print(
+                    MARKER_FORMAT.format(
+                        index=index, count=len(functions), name=fn.name
+                    )
+                )
+            elif index != 0:
                 print()
             try:
-                decompile_function(options, fn, mips_file.rodata, typemap)
+                if dedupe is not None and dedupe.has_duplicates(index):
+                    decompile_function_deduplicated(
+                        options,
+                        index,
+                        fn,
+                        mips_file.rodata,
+                        typemap,
+                        results_db,
+                        dedupe,
+                    )
+                else:
+                    decompile_function(
+                        options, fn, mips_file.rodata, typemap, results_db
+                    )
             except DecompFailure as e:
                 print(f"Failed to decompile function {fn.name}:\n\n{e}")
                 has_error = True
@@ -70,6 +293,8 @@ def run(options: Options) -> int:
                 print(f"Internal error while decompiling function {fn.name}:\n")
                 traceback.print_exc()
                 has_error = True
+        if dedupe is not None:
+            print(dedupe.summary(), file=sys.stderr)
         if has_error:
             return 1
     else:
@@ -93,13 +318,104 @@ def run(options: Options) -> int:
                 return 1
 
         try:
-            decompile_function(options, function, mips_file.rodata, typemap)
+            decompile_function(options, function, mips_file.rodata, typemap, results_db)
         except DecompFailure as e:
             print(f"Failed to decompile function {function.name}:\n\n{e}")
             return 1
     return 0
 
 
+def function_output(
+    options: Options,
+    function: Function,
+    rodata: Rodata,
+    typemap: Optional[TypeMap],
+    key: str,
+) -> FunctionOutput:
+    """Decompile a function, and return what decompile_functions prints for
+    it, with tracebacks of internal errors included."""
+    out = io.StringIO()
+    ok = False
+    with redirect_stdout(out):
+        try:
+            decompile_function(options, function, rodata, typemap, None)
+            ok = True
+        except DecompFailure as e:
+            print(f"Failed to decompile function {function.name}:\n\n{e}")
+        except Exception:
+            print(f"Internal error while decompiling function {function.name}:\n")
+            traceback.print_exc(file=sys.stdout)
+    return FunctionOutput(key=key, text=out.getvalue(), ok=ok)
+
+
+def watch_file(options: Options) -> int:
+    """Decompile all functions of the file into options.watch, and update it
+    whenever the file, a --rodata file or the --context file changes, until
+    interrupted. Only the functions whose output may have changed are
+    decompiled again."""
+    assert options.watch is not None
+    asm_state: Optional[List[FileState]] = None
+    typemap_state: Optional[FileState] = None
+    mips_file: Optional[MIPSFile] = None
+    typemap: Optional[TypeMap] = None
+    typemap_hashes: Optional[TypemapHashes] = None
+    cache = OutputCache()
+    try:
+        while True:
+            new_asm_state = asm_states(options)
+            new_typemap_state = context_state(options)
+            if new_asm_state == asm_state and new_typemap_state == typemap_state:
+                time.sleep(POLL_INTERVAL)
+                continue
+            start = time.perf_counter()
+            try:
+                if new_asm_state != asm_state or mips_file is None:
+                    mips_file = load_mips_file(options)
+                if new_typemap_state != typemap_state or typemap_hashes is None:
+                    typemap = load_typemap(options)
+                    typemap_hashes = TypemapHashes(typemap)
+            except (OSError, DecompFailure) as e:
+                # Keep the last output, and load everything again once the
+                # files change, so the error is reported until it's fixed.
+                print(e, file=sys.stderr)
+                asm_state, typemap_state = new_asm_state, new_typemap_state
+                mips_file = None
+                typemap_hashes = None
+                continue
+            asm_state, typemap_state = new_asm_state, new_typemap_state
+            assert typemap_hashes is not None
+
+            outputs: Dict[str, FunctionOutput] = {}
+            texts: List[str] = []
+            num_decompiled = 0
+            for fn in mips_file.functions:
+                key = function_key(fn, mips_file.rodata, typemap_hashes)
+                text = cache.lookup(fn, key)
+                if text is None:
+                    output = function_output(
+                        options, fn, mips_file.rodata, typemap, key
+                    )
+                    outputs[fn.name] = output
+                    text = output.text
+                    num_decompiled += 1
+                else:
+                    outputs[fn.name] = cache.outputs[fn.name]
+                texts.append(text)
+            cache = OutputCache(outputs)
+
+            tmp_path = options.watch + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(texts))
+            os.replace(tmp_path, options.watch)
+            print(
+                f"Wrote {options.watch}: decompiled {num_decompiled} of "
+                f"{len(texts)} functions in {time.perf_counter() - start:.2f}s.",
+                file=sys.stderr,
+            )
+    except KeyboardInterrupt:
+        return 0
+
+
 def parse_flags(flags: List[str]) -> Options:
     parser = argparse.ArgumentParser(description="Decompile MIPS assembly to C.")
     parser.add_argument("filename", help="input filename")
@@ -201,6 +517,66 @@ def parse_flags(flags: List[str]) -> Options:
         help="dump information about all functions and structs from the provided C "
         "context. Mainly useful for debugging.",
     )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="print the time spent in each phase and some counters for every "
+        "function to stderr, slowest function first",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        dest="profile_json",
+        help="also write the --profile numbers to FILE as JSON (implies --profile)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        dest="trace",
+        help="write a timeline of the parsing, functions and phases to FILE, in "
+        "the Chrome trace event JSON format (viewable in e.g. Perfetto)",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        dest="shard",
+        type=parse_shard,
+        help="split the functions of the file into N parts, balanced by size, and "
+        "only decompile part I (counting from 0). The outputs of all parts can be "
+        "merged with 'python3 -m src.shard'.",
+    )
+    parser.add_argument(
+        "--db",
+        metavar="FILE",
+        dest="db",
+        help="also store the C code or error, hashes and timings of each function "
+        "in the SQLite database FILE, and reuse the stored output of successful "
+        "functions that are unchanged since an earlier run with the same options",
+    )
+    parser.add_argument(
+        "--dedupe",
+        dest="dedupe",
+        action="store_true",
+        help="decompile functions that only differ in their name and the names of "
+        "their labels once, and output renamed copies for the others. Prints the "
+        "number of translations saved to stderr.",
+    )
+    parser.add_argument(
+        "--sweep",
+        dest="sweep",
+        action="store_true",
+        help="output each function once for every combination of --allman, "
+        "--no-casts, --no-andor and --no-ifs, translating it only once",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="OUTPUT_FILE",
+        dest="watch",
+        help="write the output to OUTPUT_FILE, and keep updating it whenever the "
+        "input, --rodata or --context files change, only decompiling the functions "
+        "that are affected by the change again. Runs until interrupted.",
+    )
     parser.add_argument(
         "--pdb-translate",
         dest="pdb_translate",
@@ -208,6 +584,18 @@ def parse_flags(flags: List[str]) -> Options:
         help=argparse.SUPPRESS,
     )
     args = parser.parse_args(flags)
+    if args.shard is not None and args.function not in (None, "all"):
+        parser.error("--shard can only be used when decompiling all functions")
+    if args.watch is not None:
+        if args.filename == "-" or args.function not in (None, "all"):
+            parser.error(
+                "--watch can only be used when decompiling all functions of a file"
+            )
+        if args.shard or args.db or args.dedupe or args.dump_typemap or args.visualize:
+            parser.error(
+                "--watch can't be combined with --shard, --db, --dedupe, "
+                "--dump-typemap or --visualize"
+            )
     preproc_defines = {
         **{d: 0 for d in args.undefined},
         **{d.split("=")[0]: 1 for d in args.defined},
@@ -237,6 +625,14 @@ def parse_flags(flags: List[str]) -> Options:
         c_context=args.c_context,
         dump_typemap=args.dump_typemap,
         pdb_translate=args.pdb_translate,
+        profile=args.profile or args.profile_json is not None,
+        profile_json=args.profile_json,
+        trace=args.trace,
+        shard=args.shard,
+        db=args.db,
+        dedupe=args.dedupe,
+        sweep=args.sweep,
+        watch=args.watch,
         preproc_defines=preproc_defines,
         coding_style=coding_style,
     )
@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import attr
 
@@ -27,6 +27,14 @@ class Options:
     c_context: Optional[str] = attr.ib()
     dump_typemap: bool = attr.ib()
     pdb_translate: bool = attr.ib()
+    profile: bool = attr.ib()
+    profile_json: Optional[str] = attr.ib()
+    trace: Optional[str] = attr.ib()
+    shard: Optional[Tuple[int, int]] = attr.ib()
+    db: Optional[str] = attr.ib()
+    dedupe: bool = attr.ib()
+    sweep: bool = attr.ib()
+    watch: Optional[str] = attr.ib()
     preproc_defines: Dict[str, int] = attr.ib()
     coding_style: CodingStyle = attr.ib()
 
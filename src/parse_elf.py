@@ -0,0 +1,714 @@
+"""Reading big-endian MIPS ELF relocatable objects (.o files) directly.
+
+This is an alternative to disassembling an object to text and parsing that
+with parse_file: instruction words are decoded straight into Instruction
+objects, with %hi/%lo and jal operands taken from the relocations, and the
+contents of .rodata sections are used as-is. The result is a MIPSFile that
+looks like what parse_file would produce for the disassembly.
+"""
+
+import mmap
+import struct
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Tuple, Union
+
+import attr
+
+from .error import DecompFailure
+from .input_file import is_plain_file, open_binary_input
+from .options import Options
+from .parse_file import MIPSFile, re_local_glabel, re_local_label
+from .parse_instruction import (
+    Argument,
+    AsmAddressMode,
+    AsmGlobalSymbol,
+    AsmLiteral,
+    BinOp,
+    Instruction,
+    InstructionMeta,
+    JumpTarget,
+    Macro,
+    Register,
+    asm_section_global_symbol,
+    normalize_instruction,
+)
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFDATA2MSB = 2
+ET_REL = 1
+EM_MIPS = 8
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_REL = 9
+SHF_WRITE = 0x1
+SHF_EXECINSTR = 0x4
+SHF_STRINGS = 0x20
+
+STT_NOTYPE = 0
+STT_FUNC = 2
+STT_SECTION = 3
+STT_FILE = 4
+STB_GLOBAL = 1
+SHN_UNDEF = 0
+
+R_MIPS_32 = 2
+R_MIPS_26 = 4
+R_MIPS_HI16 = 5
+R_MIPS_LO16 = 6
+
+RODATA_SECTIONS = {".rodata", ".rdata", ".late_rodata"}
+
+# The contents of the file: mapped from disk, or read from a decompressor.
+ElfData = Union[mmap.mmap, bytes]
+
+GPR_NAMES: List[str] = (
+    ["zero", "at", "v0", "v1", "a0", "a1", "a2", "a3"]
+    + [f"t{i}" for i in range(8)]
+    + [f"s{i}" for i in range(8)]
+    + ["t8", "t9", "k0", "k1", "gp", "sp", "fp", "ra"]
+)
+
+# Instruction encodings, as mnemonic and operand format. Operand letters:
+# d/s/t: rd/rs/rt as a GPR, D/S/T: fd/fs/ft as an FPR, C: rd as an FPU control
+# register, a: shift amount, i/u: signed/unsigned immediate, o: offset(base),
+# b: branch target, j: jump target, c: break code, r: rt as a number.
+OPCODES: Dict[int, Tuple[str, str]] = {
+    2: ("j", "j"),
+    3: ("jal", "j"),
+    4: ("beq", "stb"),
+    5: ("bne", "stb"),
+    6: ("blez", "sb"),
+    7: ("bgtz", "sb"),
+    8: ("addi", "tsi"),
+    9: ("addiu", "tsi"),
+    10: ("slti", "tsi"),
+    11: ("sltiu", "tsi"),
+    12: ("andi", "tsu"),
+    13: ("ori", "tsu"),
+    14: ("xori", "tsu"),
+    15: ("lui", "tu"),
+    20: ("beql", "stb"),
+    21: ("bnel", "stb"),
+    22: ("blezl", "sb"),
+    23: ("bgtzl", "sb"),
+    24: ("daddi", "tsi"),
+    25: ("daddiu", "tsi"),
+    26: ("ldl", "to"),
+    27: ("ldr", "to"),
+    32: ("lb", "to"),
+    33: ("lh", "to"),
+    34: ("lwl", "to"),
+    35: ("lw", "to"),
+    36: ("lbu", "to"),
+    37: ("lhu", "to"),
+    38: ("lwr", "to"),
+    39: ("lwu", "to"),
+    40: ("sb", "to"),
+    41: ("sh", "to"),
+    42: ("swl", "to"),
+    43: ("sw", "to"),
+    44: ("sdl", "to"),
+    45: ("sdr", "to"),
+    46: ("swr", "to"),
+    47: ("cache", "ro"),
+    48: ("ll", "to"),
+    49: ("lwc1", "To"),
+    53: ("ldc1", "To"),
+    55: ("ld", "to"),
+    56: ("sc", "to"),
+    57: ("swc1", "To"),
+    61: ("sdc1", "To"),
+    63: ("sd", "to"),
+}
+
+SPECIAL_FUNCTS: Dict[int, Tuple[str, str]] = {
+    0: ("sll", "dta"),
+    2: ("srl", "dta"),
+    3: ("sra", "dta"),
+    4: ("sllv", "dts"),
+    6: ("srlv", "dts"),
+    7: ("srav", "dts"),
+    8: ("jr", "s"),
+    9: ("jalr", "ds"),
+    12: ("syscall", ""),
+    13: ("break", "c"),
+    15: ("sync", ""),
+    16: ("mfhi", "d"),
+    17: ("mthi", "s"),
+    18: ("mflo", "d"),
+    19: ("mtlo", "s"),
+    20: ("dsllv", "dts"),
+    22: ("dsrlv", "dts"),
+    23: ("dsrav", "dts"),
+    24: ("mult", "st"),
+    25: ("multu", "st"),
+    26: ("div", "st"),
+    27: ("divu", "st"),
+    28: ("dmult", "st"),
+    29: ("dmultu", "st"),
+    30: ("ddiv", "st"),
+    31: ("ddivu", "st"),
+    32: ("add", "dst"),
+    33: ("addu", "dst"),
+    34: ("sub", "dst"),
+    35: ("subu", "dst"),
+    36: ("and", "dst"),
+    37: ("or", "dst"),
+    38: ("xor", "dst"),
+    39: ("nor", "dst"),
+    42: ("slt", "dst"),
+    43: ("sltu", "dst"),
+    44: ("dadd", "dst"),
+    45: ("daddu", "dst"),
+    46: ("dsub", "dst"),
+    47: ("dsubu", "dst"),
+    48: ("tge", "st"),
+    49: ("tgeu", "st"),
+    50: ("tlt", "st"),
+    51: ("tltu", "st"),
+    52: ("teq", "st"),
+    54: ("tne", "st"),
+    56: ("dsll", "dta"),
+    58: ("dsrl", "dta"),
+    59: ("dsra", "dta"),
+    60: ("dsll32", "dta"),
+    62: ("dsrl32", "dta"),
+    63: ("dsra32", "dta"),
+}
+
+REGIMM_RTS: Dict[int, Tuple[str, str]] = {
+    0: ("bltz", "sb"),
+    1: ("bgez", "sb"),
+    2: ("bltzl", "sb"),
+    3: ("bgezl", "sb"),
+    8: ("tgei", "si"),
+    9: ("tgeiu", "si"),
+    10: ("tlti", "si"),
+    11: ("tltiu", "si"),
+    12: ("teqi", "si"),
+    14: ("tnei", "si"),
+    16: ("bltzal", "sb"),
+    17: ("bgezal", "sb"),
+}
+
+COP1_RSS: Dict[int, Tuple[str, str]] = {
+    0: ("mfc1", "tS"),
+    1: ("dmfc1", "tS"),
+    2: ("cfc1", "tC"),
+    4: ("mtc1", "tS"),
+    5: ("dmtc1", "tS"),
+    6: ("ctc1", "tC"),
+}
+
+COP1_BRANCHES: List[str] = ["bc1f", "bc1t", "bc1fl", "bc1tl"]
+
+COP1_FORMATS: Dict[int, str] = {16: "s", 17: "d", 20: "w", 21: "l"}
+
+COP1_FUNCTS: Dict[int, Tuple[str, str]] = {
+    0: ("add", "DST"),
+    1: ("sub", "DST"),
+    2: ("mul", "DST"),
+    3: ("div", "DST"),
+    4: ("sqrt", "DS"),
+    5: ("abs", "DS"),
+    6: ("mov", "DS"),
+    7: ("neg", "DS"),
+    8: ("round.l", "DS"),
+    9: ("trunc.l", "DS"),
+    10: ("ceil.l", "DS"),
+    11: ("floor.l", "DS"),
+    12: ("round.w", "DS"),
+    13: ("trunc.w", "DS"),
+    14: ("ceil.w", "DS"),
+    15: ("floor.w", "DS"),
+    32: ("cvt.s", "DS"),
+    33: ("cvt.d", "DS"),
+    36: ("cvt.w", "DS"),
+    37: ("cvt.l", "DS"),
+}
+COP1_FUNCTS.update(
+    (48 + i, (f"c.{cond}", "ST"))
+    for i, cond in enumerate(
+        "f un eq ueq olt ult ole ule sf ngle seq ngl lt nge le ngt".split()
+    )
+)
+
+
+@attr.s(frozen=True)
+class ElfSection:
+    index: int = attr.ib()
+    name: str = attr.ib()
+    type: int = attr.ib()
+    flags: int = attr.ib()
+    offset: int = attr.ib()
+    size: int = attr.ib()
+    link: int = attr.ib()
+    info: int = attr.ib()
+
+    def is_text(self) -> bool:
+        return self.type == SHT_PROGBITS and bool(self.flags & SHF_EXECINSTR)
+
+    def is_rodata(self) -> bool:
+        return (
+            self.type == SHT_PROGBITS
+            and not self.flags & (SHF_WRITE | SHF_EXECINSTR)
+            and (self.name in RODATA_SECTIONS or self.name.startswith(".rodata."))
+        )
+
+    def short_name(self) -> str:
+        """The name used for references to the section without a symbol,
+        like parse_instruction does for e.g. '.rodata + 0x10'."""
+        return self.name.lstrip(".").replace(".", "_")
+
+
+@attr.s(frozen=True)
+class ElfSymbol:
+    name: str = attr.ib()
+    value: int = attr.ib()
+    size: int = attr.ib()
+    type: int = attr.ib()
+    bind: int = attr.ib()
+    shndx: int = attr.ib()
+
+
+@attr.s(frozen=True)
+class Relocation:
+    offset: int = attr.ib()
+    type: int = attr.ib()
+    symbol: ElfSymbol = attr.ib()
+    # For REL sections (as used by MIPS32) this is computed from the
+    # instruction or data that is being relocated.
+    addend: int = attr.ib()
+
+
+def sign_extend_16(value: int) -> int:
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def read_str(data: ElfData, offset: int) -> str:
+    end = data.find(b"\0", offset)
+    return data[offset:end].decode("utf-8", "replace")
+
+
+def is_elf_file(path: str) -> bool:
+    try:
+        with open_binary_input(path) as f:
+            return f.read(4) == ELF_MAGIC
+    except (OSError, DecompFailure):
+        return False
+
+
+@attr.s
+class ElfReader:
+    path: str = attr.ib()
+    data: ElfData = attr.ib()
+    sections: List[ElfSection] = attr.ib(factory=list)
+    symbols: List[ElfSymbol] = attr.ib(factory=list)
+    # Relocations by index of the section they apply to, then by offset.
+    relocations: Dict[int, Dict[int, Relocation]] = attr.ib(factory=dict)
+    # Names of defined symbols by (section index, offset).
+    symbol_names: Dict[Tuple[int, int], str] = attr.ib(factory=dict)
+    # Labels within text sections, by (section index, offset).
+    labels: Dict[Tuple[int, int], str] = attr.ib(factory=dict)
+
+    def word(self, offset: int) -> int:
+        value: int = struct.unpack_from(">I", self.data, offset)[0]
+        return value
+
+    def read_headers(self) -> None:
+        data = self.data
+        if data[:4] != ELF_MAGIC:
+            raise DecompFailure(f"{self.path} is not an ELF file.")
+        if data[4] != ELFCLASS32 or data[5] != ELFDATA2MSB:
+            raise DecompFailure(
+                f"{self.path}: only 32-bit big-endian ELF files are supported."
+            )
+        e_type, e_machine = struct.unpack_from(">HH", data, 16)
+        if e_machine != EM_MIPS:
+            raise DecompFailure(f"{self.path} is not a MIPS ELF file.")
+        if e_type != ET_REL:
+            raise DecompFailure(
+                f"{self.path}: only relocatable object files (.o) are supported."
+            )
+        (e_shoff,) = struct.unpack_from(">I", data, 32)
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from(">HHH", data, 46)
+
+        headers = [
+            struct.unpack_from(">IIIIIIIIII", data, e_shoff + i * e_shentsize)
+            for i in range(e_shnum)
+        ]
+        names_offset = headers[e_shstrndx][4]
+        for i, (name, type, flags, _, offset, size, link, info, _, _) in enumerate(
+            headers
+        ):
+            self.sections.append(
+                ElfSection(
+                    index=i,
+                    name=read_str(data, names_offset + name),
+                    type=type,
+                    flags=flags,
+                    offset=offset,
+                    size=size,
+                    link=link,
+                    info=info,
+                )
+            )
+
+    def read_symbols(self) -> None:
+        for section in self.sections:
+            if section.type != SHT_SYMTAB:
+                continue
+            names_offset = self.sections[section.link].offset
+            for offset in range(section.offset, section.offset + section.size, 16):
+                name, value, size, info, _, shndx = struct.unpack_from(
+                    ">IIIBBH", self.data, offset
+                )
+                symbol = ElfSymbol(
+                    name=read_str(self.data, names_offset + name),
+                    value=value,
+                    size=size,
+                    type=info & 0xF,
+                    bind=info >> 4,
+                    shndx=shndx,
+                )
+                self.symbols.append(symbol)
+                if (
+                    symbol.name
+                    and symbol.shndx != SHN_UNDEF
+                    and symbol.type not in (STT_SECTION, STT_FILE)
+                ):
+                    key = (shndx, value)
+                    # Prefer global names if there are several.
+                    if key not in self.symbol_names or symbol.bind == STB_GLOBAL:
+                        self.symbol_names[key] = symbol.name
+
+    def read_relocations(self) -> None:
+        for section in self.sections:
+            if section.type not in (SHT_REL, SHT_RELA):
+                continue
+            target = self.sections[section.info]
+            entry_size = 8 if section.type == SHT_REL else 12
+            raw: List[Tuple[int, int, int, Optional[int]]] = []
+            for offset in range(
+                section.offset, section.offset + section.size, entry_size
+            ):
+                r_offset, r_info = struct.unpack_from(">II", self.data, offset)
+                addend: Optional[int] = None
+                if section.type == SHT_RELA:
+                    (addend,) = struct.unpack_from(">i", self.data, offset + 8)
+                raw.append((r_offset, r_info & 0xFF, r_info >> 8, addend))
+            relocations = self.relocations.setdefault(target.index, {})
+            for i, (r_offset, r_type, r_sym, addend) in enumerate(raw):
+                if addend is None:
+                    addend = self.implicit_addend(target, raw, i)
+                relocations[r_offset] = Relocation(
+                    offset=r_offset,
+                    type=r_type,
+                    symbol=self.symbols[r_sym],
+                    addend=addend,
+                )
+
+    def implicit_addend(
+        self,
+        section: ElfSection,
+        raw: List[Tuple[int, int, int, Optional[int]]],
+        index: int,
+    ) -> int:
+        r_offset, r_type, r_sym, _ = raw[index]
+        word = self.word(section.offset + r_offset)
+        if r_type == R_MIPS_32:
+            return word
+        if r_type == R_MIPS_26:
+            return (word & 0x3FFFFFF) << 2
+        if r_type == R_MIPS_HI16:
+            # The addend of a %hi is split between it and the matching %lo
+            # that follows it.
+            for lo_offset, lo_type, lo_sym, _ in raw[index + 1 :]:
+                if lo_type == R_MIPS_LO16 and lo_sym == r_sym:
+                    lo = self.word(section.offset + lo_offset) & 0xFFFF
+                    return ((word & 0xFFFF) << 16) + sign_extend_16(lo)
+            return (word & 0xFFFF) << 16
+        if r_type == R_MIPS_LO16:
+            lo = sign_extend_16(word & 0xFFFF)
+            for hi_offset, hi_type, hi_sym, _ in reversed(raw[:index]):
+                if hi_type == R_MIPS_HI16 and hi_sym == r_sym:
+                    hi = self.word(section.offset + hi_offset) & 0xFFFF
+                    return (hi << 16) + lo
+            return lo
+        return 0
+
+    def label_at(self, section_index: int, offset: int) -> str:
+        key = (section_index, offset)
+        label = self.labels.get(key)
+        if label is None:
+            # Like in parse_file, labels written as '.name' are called 'name'.
+            name = self.symbol_names.get(key)
+            label = name.lstrip(".") if name else f"L{offset:08X}"
+            self.labels[key] = label
+        return label
+
+    def symbol_ref(self, symbol: ElfSymbol, addend: int) -> Argument:
+        if symbol.type == STT_SECTION:
+            name = self.symbol_names.get((symbol.shndx, addend))
+            if name is not None:
+                return AsmGlobalSymbol(name)
+            section = self.sections[symbol.shndx]
+            return asm_section_global_symbol(section.short_name(), addend)
+        sym = AsmGlobalSymbol(symbol.name)
+        if addend == 0:
+            return sym
+        return BinOp("+", sym, AsmLiteral(addend))
+
+    def reloc_error(self, section: ElfSection, reloc: Relocation) -> DecompFailure:
+        return DecompFailure(
+            f"Unsupported relocation type {reloc.type} at "
+            f"{section.name}+0x{reloc.offset:X} in {self.path}."
+        )
+
+    def decode(self, section: ElfSection, offset: int, word: int) -> Instruction:
+        meta = InstructionMeta(
+            emit_goto=False,
+            filename=f"{self.path} {section.name}",
+            lineno=offset,
+            synthetic=False,
+        )
+        reloc = self.relocations.get(section.index, {}).get(offset)
+        op = word >> 26
+        rs = (word >> 21) & 0x1F
+        rt = (word >> 16) & 0x1F
+        rd = (word >> 11) & 0x1F
+        entry: Optional[Tuple[str, str]]
+        if op == 0:
+            entry = SPECIAL_FUNCTS.get(word & 0x3F)
+        elif op == 1:
+            entry = REGIMM_RTS.get(rt)
+        elif op == 17:
+            if rs == 8:
+                entry = (COP1_BRANCHES[rt & 3], "b")
+            elif rs in COP1_FORMATS:
+                entry = COP1_FUNCTS.get(word & 0x3F)
+                if entry is not None:
+                    entry = (f"{entry[0]}.{COP1_FORMATS[rs]}", entry[1])
+            else:
+                entry = COP1_RSS.get(rs)
+        else:
+            entry = OPCODES.get(op)
+        if entry is None:
+            # Let translation report it like an unknown instruction.
+            return Instruction(".word", [AsmLiteral(word)], meta)
+        mnemonic, operands = entry
+
+        def immediate(value: int) -> Argument:
+            if reloc is None:
+                return AsmLiteral(value)
+            ref = self.symbol_ref(reloc.symbol, reloc.addend)
+            if reloc.type == R_MIPS_HI16:
+                return Macro("hi", ref)
+            if reloc.type == R_MIPS_LO16:
+                return Macro("lo", ref)
+            raise self.reloc_error(section, reloc)
+
+        args: List[Argument] = []
+        for kind in operands:
+            if kind == "d":
+                args.append(Register(GPR_NAMES[rd]))
+            elif kind == "s":
+                args.append(Register(GPR_NAMES[rs]))
+            elif kind == "t":
+                args.append(Register(GPR_NAMES[rt]))
+            elif kind == "D":
+                args.append(Register(f"f{(word >> 6) & 0x1F}"))
+            elif kind == "S":
+                args.append(Register(f"f{rd}"))
+            elif kind == "T":
+                args.append(Register(f"f{rt}"))
+            elif kind == "C":
+                args.append(Register(str(rd)))
+            elif kind == "a":
+                args.append(AsmLiteral((word >> 6) & 0x1F))
+            elif kind == "r":
+                args.append(AsmLiteral(rt))
+            elif kind == "c":
+                args.append(AsmLiteral((word >> 16) & 0x3FF))
+            elif kind == "i":
+                args.append(immediate(sign_extend_16(word & 0xFFFF)))
+            elif kind == "u":
+                args.append(immediate(word & 0xFFFF))
+            elif kind == "o":
+                lhs = immediate(sign_extend_16(word & 0xFFFF))
+                assert isinstance(lhs, (AsmLiteral, Macro))
+                args.append(AsmAddressMode(lhs, Register(GPR_NAMES[rs])))
+            elif kind == "b":
+                if reloc is not None:
+                    raise self.reloc_error(section, reloc)
+                target = offset + 4 + (sign_extend_16(word & 0xFFFF) << 2)
+                args.append(JumpTarget(self.label_at(section.index, target)))
+            elif kind == "j":
+                if reloc is None:
+                    args.append(AsmLiteral((word & 0x3FFFFFF) << 2))
+                elif reloc.type != R_MIPS_26:
+                    raise self.reloc_error(section, reloc)
+                elif (
+                    mnemonic == "j"
+                    and reloc.symbol.type == STT_SECTION
+                    and (reloc.symbol.shndx, reloc.addend) not in self.symbol_names
+                ):
+                    label = self.label_at(reloc.symbol.shndx, reloc.addend)
+                    args.append(JumpTarget(label))
+                else:
+                    args.append(self.symbol_ref(reloc.symbol, reloc.addend))
+
+        if mnemonic == "jalr" and rd == 31:
+            # Written as just 'jalr $t9'.
+            args = args[1:]
+        elif mnemonic in ("subu", "dsubu") and rs == 0:
+            mnemonic, args = ("negu" if mnemonic == "subu" else "dnegu"), [
+                args[0],
+                args[2],
+            ]
+        return normalize_instruction(Instruction(mnemonic, args, meta))
+
+    def is_function_symbol(self, symbol: ElfSymbol) -> bool:
+        if symbol.type == STT_FUNC:
+            return True
+        return (
+            symbol.type == STT_NOTYPE
+            and bool(symbol.name)
+            and not symbol.name.startswith(".")
+            and not re_local_glabel.match(symbol.name)
+            and not re_local_label.match(symbol.name)
+        )
+
+    def find_functions(self, section: ElfSection) -> List[Tuple[int, str]]:
+        """Return the offset and name of each function in a text section,
+        and create labels for the other symbols in it."""
+        starts: Dict[int, str] = {}
+        for symbol in self.symbols:
+            if symbol.shndx == section.index and symbol.name:
+                if self.is_function_symbol(symbol):
+                    starts.setdefault(symbol.value, symbol.name)
+                elif symbol.type not in (STT_SECTION, STT_FILE):
+                    self.label_at(section.index, symbol.value)
+        if section.size and 0 not in starts:
+            # Code before the first symbol, which a disassembler would have
+            # given a name of its own.
+            starts[0] = asm_section_global_symbol(section.short_name(), 0).symbol_name
+        return sorted(starts.items())
+
+    def read_rodata_section(self, section: ElfSection, mips_file: MIPSFile) -> None:
+        # Each symbol starts an entry, as does every offset that is
+        # referenced relative to the section rather than through a symbol.
+        starts: Dict[int, str] = {}
+        for (shndx, offset), name in self.symbol_names.items():
+            if shndx == section.index:
+                starts[offset] = name
+        for relocations in self.relocations.values():
+            for reloc in relocations.values():
+                symbol = reloc.symbol
+                if symbol.type == STT_SECTION and symbol.shndx == section.index:
+                    if reloc.addend not in starts:
+                        name = asm_section_global_symbol(
+                            section.short_name(), reloc.addend
+                        ).symbol_name
+                        starts[reloc.addend] = name
+
+        relocations = self.relocations.get(section.index, {})
+        bounds = sorted(starts) + [section.size]
+        for start, end in zip(bounds, bounds[1:]):
+            mips_file.new_rodata_label(starts[start])
+            data = self.data[section.offset + start : section.offset + end]
+            is_string = bool(section.flags & SHF_STRINGS) or looks_like_string(data)
+            pos = start
+            for reloc_offset in sorted(o for o in relocations if start <= o < end):
+                reloc = relocations[reloc_offset]
+                if reloc.type != R_MIPS_32:
+                    raise self.reloc_error(section, reloc)
+                if pos < reloc_offset:
+                    mips_file.new_rodata_bytes(
+                        data[pos - start : reloc_offset - start], is_string=is_string
+                    )
+                mips_file.new_rodata_sym(self.data_symbol(reloc))
+                pos = reloc_offset + 4
+            if pos < end:
+                mips_file.new_rodata_bytes(data[pos - start :], is_string=is_string)
+
+    def data_symbol(self, reloc: Relocation) -> str:
+        """The symbol of a .word in .rodata, like it would be written in a
+        disassembly. Jump table targets become labels."""
+        symbol = reloc.symbol
+        if symbol.type == STT_SECTION:
+            if self.sections[symbol.shndx].is_text() and (
+                (symbol.shndx, reloc.addend) not in self.symbol_names
+            ):
+                return "." + self.label_at(symbol.shndx, reloc.addend)
+        return str(self.symbol_ref(symbol, reloc.addend))
+
+
+def looks_like_string(data: bytes) -> bool:
+    """Whether a piece of rodata looks like a C string: mostly printable
+    characters, followed by NUL padding."""
+    text = data.rstrip(b"\0")
+    if len(text) < 4 or len(text) == len(data):
+        return False
+    printable = sum(1 for c in text if 0x20 <= c < 0x7F or c in b"\t\n\r")
+    return printable >= 0.9 * len(text)
+
+
+def parse_elf_file(path: str, options: Options) -> MIPSFile:
+    mips_file = MIPSFile(path)
+    with ExitStack() as stack:
+        data: ElfData
+        if is_plain_file(path):
+            f = stack.enter_context(open(path, "rb"))
+            if not f.read(4):
+                raise DecompFailure(f"{path} is not an ELF file.")
+            data = stack.enter_context(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+        else:
+            # Compressed files and archive members can't be mapped.
+            with open_binary_input(path) as stream:
+                data = stream.read()
+        reader = ElfReader(path, data)
+        reader.read_headers()
+        reader.read_symbols()
+        reader.read_relocations()
+
+        for section in reader.sections:
+            if section.is_rodata():
+                reader.read_rodata_section(section, mips_file)
+
+        decoded: List[Tuple[ElfSection, List[Tuple[int, str]], List[Instruction]]]
+        decoded = []
+        for section in reader.sections:
+            if not section.is_text():
+                continue
+            functions = reader.find_functions(section)
+            instructions = [
+                reader.decode(section, offset, word)
+                for offset, (word,) in zip(
+                    range(0, section.size, 4),
+                    struct.iter_unpack(
+                        ">I",
+                        data[section.offset : section.offset + section.size],
+                    ),
+                )
+            ]
+            decoded.append((section, functions, instructions))
+
+    # Labels are created while decoding (for branch targets) and while reading
+    # rodata (for jump tables), so the instructions can only be split into
+    # functions once everything is decoded.
+    for section, functions, instructions in decoded:
+        bounds = [start for start, _ in functions] + [section.size]
+        for (start, name), end in zip(functions, bounds[1:]):
+            mips_file.new_function(name)
+            for offset in range(start, end, 4):
+                label = reader.labels.get((section.index, offset))
+                if label is not None:
+                    mips_file.new_label(label)
+                mips_file.new_instruction(instructions[offset // 4])
+    return mips_file
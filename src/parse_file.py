@@ -1,11 +1,28 @@
+import os
 import re
 import struct
-import typing
-from typing import Callable, Dict, List, Match, Optional, Set, Tuple, TypeVar, Union
+import threading
+from array import array
+from collections import OrderedDict
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import attr
 
+from .diagnostics import capture_diagnostics, warn
 from .error import DecompFailure
+from .input_file import input_stat, is_plain_file, open_binary_input
 from .options import Options
 from .parse_instruction import Instruction, InstructionMeta, parse_instruction
 
@@ -39,20 +56,62 @@ class Function:
 
 @attr.s
 class RodataEntry:
-    data: List[Union[str, bytes]] = attr.ib(factory=list)
+    # The bytes of all entries in a file are stored back to back in one
+    # buffer, and 'items' refers to them by (start, end) spans, interleaved
+    # with symbol references such as jump table targets. This way appending
+    # to an entry never copies what's already there.
+    buffer: bytearray = attr.ib(factory=bytearray, repr=False, eq=False)
+    items: List[Union[str, Tuple[int, int]]] = attr.ib(factory=list)
     is_string: bool = attr.ib(default=False)
 
+    @property
+    def data(self) -> List[Union[str, memoryview]]:
+        """Symbols and (uncopied) views of the bytes, in order."""
+        view = memoryview(self.buffer)
+        return [
+            item if isinstance(item, str) else view[item[0] : item[1]]
+            for item in self.items
+        ]
+
+    def leading_bytes(self) -> Optional[memoryview]:
+        """A view of the bytes at the start of the entry, if it doesn't start
+        with a symbol."""
+        if not self.items or isinstance(self.items[0], str):
+            return None
+        start, end = self.items[0]
+        return memoryview(self.buffer)[start:end]
+
+    def append_bytes(self, data: bytes) -> None:
+        start = len(self.buffer)
+        self.buffer += data
+        last = self.items[-1] if self.items else None
+        if isinstance(last, tuple) and last[1] == start:
+            self.items[-1] = (last[0], len(self.buffer))
+        else:
+            self.items.append((start, len(self.buffer)))
+
 
 @attr.s
 class Rodata:
+    # Symbol -> entry index. Every label starts a new entry, so symbols
+    # always point at the start of their entry.
     values: Dict[str, RodataEntry] = attr.ib(factory=dict)
+    buffer: bytearray = attr.ib(factory=bytearray, repr=False)
     mentioned_labels: Set[str] = attr.ib(factory=set)
+    # Files given by --rodata, decoded on demand. Later files take precedence
+    # over earlier ones and over 'values'.
+    lazy_files: List["LazyRodataFile"] = attr.ib(factory=list)
 
-    def merge_into(self, other: "Rodata") -> None:
-        for (sym, value) in self.values.items():
-            other.values[sym] = value
-        for label in self.mentioned_labels:
-            other.mentioned_labels.add(label)
+    def get(self, symbol_name: str) -> Optional[RodataEntry]:
+        for lazy_file in reversed(self.lazy_files):
+            entry = lazy_file.get(symbol_name)
+            if entry is not None:
+                return entry
+        return self.values.get(symbol_name)
+
+    def add_lazy_file(self, lazy_file: "LazyRodataFile") -> None:
+        self.lazy_files.append(lazy_file)
+        self.mentioned_labels |= lazy_file.mentioned_labels
 
 
 @attr.s
@@ -76,26 +135,27 @@ class MIPSFile:
         self.current_function.new_label(label_name)
 
     def new_rodata_label(self, symbol_name: str) -> None:
-        self.current_rodata = RodataEntry()
+        self.current_rodata = RodataEntry(buffer=self.rodata.buffer)
         self.rodata.values[symbol_name] = self.current_rodata
 
     def new_rodata_sym(self, sym: str) -> None:
-        self.current_rodata.data.append(sym)
+        self.current_rodata.items.append(sym)
         self.rodata.mentioned_labels.add(sym.lstrip("."))
 
     def new_rodata_bytes(self, data: bytes, *, is_string: bool = False) -> None:
-        if not self.current_rodata.data and is_string:
+        if not self.current_rodata.items and is_string:
             self.current_rodata.is_string = True
-        if self.current_rodata.data and isinstance(self.current_rodata.data[-1], bytes):
-            self.current_rodata.data[-1] += data
-        else:
-            self.current_rodata.data.append(data)
+        self.current_rodata.append_bytes(data)
 
     def __str__(self) -> str:
         functions_str = "\n\n".join(str(function) for function in self.functions)
         return f"# {self.filename}\n{functions_str}"
 
 
+def pack_words(words: List[int]) -> bytes:
+    return struct.pack(f">{len(words)}I", *words)
+
+
 def parse_ascii_directive(line: str, z: bool) -> bytes:
     # This is wrong wrt encodings; the assembler really operates on bytes and
     # not chars. But for our purposes it should be good enough.
@@ -163,29 +223,34 @@ def parse_ascii_directive(line: str, z: bool) -> bytes:
     return b"".join(ret)
 
 
-def parse_file(f: typing.TextIO, options: Options) -> MIPSFile:
-    filename = f.name
-    mips_file: MIPSFile = MIPSFile(filename)
-    defines: Dict[str, int] = options.preproc_defines
-    ifdef_level: int = 0
-    ifdef_levels: List[int] = []
-    curr_section = ".text"
+# https://stackoverflow.com/a/241506
+def re_comment_replacer(match: Match[str]) -> str:
+    s = match.group(0)
+    if s[0] in "/# \t":
+        return " "
+    else:
+        return s
+
+
+re_comment_or_string = re.compile(r'#.*|/\*.*?\*/|"(?:\\.|[^\\"])*"')
+re_whitespace_or_string = re.compile(r'\s+|"(?:\\.|[^\\"])*"')
+re_local_glabel = re.compile("L(_U_)?[0-9A-F]{8}")
+re_local_label = re.compile("loc_|locret_|def_")
+re_label = re.compile(r"([a-zA-Z0-9_.]+):")
+
+
+def strip_comments(line: str) -> str:
+    """Strip comments and whitespace (but not within strings)."""
+    line = re.sub(re_comment_or_string, re_comment_replacer, line)
+    line = re.sub(re_whitespace_or_string, re_comment_replacer, line)
+    return line.strip()
 
-    # https://stackoverflow.com/a/241506
-    def re_comment_replacer(match: Match[str]) -> str:
-        s = match.group(0)
-        if s[0] in "/# \t":
-            return " "
-        else:
-            return s
 
-    re_comment_or_string = re.compile(r'#.*|/\*.*?\*/|"(?:\\.|[^\\"])*"')
-    re_whitespace_or_string = re.compile(r'\s+|"(?:\\.|[^\\"])*"')
-    re_local_glabel = re.compile("L(_U_)?[0-9A-F]{8}")
-    re_local_label = re.compile("loc_|locret_|def_")
-    re_label = re.compile(r"([a-zA-Z0-9_.]+):")
+T = TypeVar("T")
 
-    T = TypeVar("T")
+
+def parse_rodata_directive(line: str, mips_file: MIPSFile) -> None:
+    """Add the data of a directive within .rodata to the current entry."""
 
     def try_parse(parser: Callable[[], T], directive: str) -> T:
         try:
@@ -193,19 +258,79 @@ def parse_file(f: typing.TextIO, options: Options) -> MIPSFile:
         except ValueError:
             raise DecompFailure(f"Could not parse rodata {directive}: {line}")
 
+    # Numbers are packed one directive (or one run of numbers between
+    # symbols) at a time.
+    if line.startswith(".word"):
+        words: List[int] = []
+        for w in line[5:].split(","):
+            w = w.strip()
+            if not w or w[0].isdigit():
+                words.append(try_parse(lambda: int(w, 0), ".word"))
+            else:
+                if words:
+                    mips_file.new_rodata_bytes(pack_words(words))
+                    words = []
+                mips_file.new_rodata_sym(w)
+        if words:
+            mips_file.new_rodata_bytes(pack_words(words))
+    elif line.startswith(".byte"):
+        ivals = try_parse(
+            lambda: [int(w.strip(), 0) for w in line[5:].split(",")], ".byte"
+        )
+        mips_file.new_rodata_bytes(bytes(ivals))
+    elif line.startswith(".float"):
+        fvals = try_parse(
+            lambda: [float(w.strip()) for w in line[6:].split(",")], ".float"
+        )
+        mips_file.new_rodata_bytes(struct.pack(f">{len(fvals)}f", *fvals))
+    elif line.startswith(".double"):
+        fvals = try_parse(
+            lambda: [float(w.strip()) for w in line[7:].split(",")], ".double"
+        )
+        mips_file.new_rodata_bytes(struct.pack(f">{len(fvals)}d", *fvals))
+    elif line.startswith(".asci"):
+        z = line.startswith(".asciz") or line.startswith(".asciiz")
+        mips_file.new_rodata_bytes(parse_ascii_directive(line, z), is_string=True)
+
+
+def parse_file(
+    f: Iterable[str],
+    options: Options,
+    *,
+    rodata_only: bool = False,
+    rodata_index: Optional["LazyRodataFile"] = None,
+) -> MIPSFile:
+    """Parse an assembly file. With rodata_only, the contents of .text are
+    skipped, and the result has rodata but no functions. If rodata_index is
+    also given, the rodata isn't decoded either; its symbols and the line
+    numbers of their directives are recorded in rodata_index instead."""
+    # In-memory inputs (e.g. from api.decompile) have no name of their own.
+    filename = getattr(f, "name", options.filename)
+    mips_file: MIPSFile = MIPSFile(filename)
+    defines: Dict[str, int] = options.preproc_defines
+    ifdef_level: int = 0
+    ifdef_levels: List[int] = []
+    curr_section = ".text"
+    assert rodata_index is None or rodata_only
+
     for lineno, line in enumerate(f, 1):
+        # Only directives matter in .text when skipping it, since they might
+        # switch sections.
+        if rodata_only and curr_section == ".text" and line.lstrip()[:1] != ".":
+            continue
+
         # Check for goto markers before stripping comments
         emit_goto = any(pattern in line for pattern in options.goto_patterns)
 
-        # Strip comments and whitespace (but not within strings)
-        line = re.sub(re_comment_or_string, re_comment_replacer, line)
-        line = re.sub(re_whitespace_or_string, re_comment_replacer, line)
-        line = line.strip()
+        line = strip_comments(line)
 
         def process_label(label: str, *, glabel: bool) -> None:
             if curr_section == ".rodata":
-                mips_file.new_rodata_label(label)
-            elif curr_section == ".text":
+                if rodata_index is not None:
+                    rodata_index.new_label(label)
+                else:
+                    mips_file.new_rodata_label(label)
+            elif curr_section == ".text" and not rodata_only:
                 re_local = re_local_glabel if glabel else re_local_label
                 if label.startswith("."):
                     if mips_file.current_function is None:
@@ -244,7 +369,7 @@ def parse_file(f: typing.TextIO, options: Options) -> MIPSFile:
                 macro_name = line.split()[1]
                 if macro_name not in defines:
                     defines[macro_name] = 0
-                    print(
+                    warn(
                         f"Note: assuming {macro_name} is unset for .ifdef, "
                         f"pass -D{macro_name}/-U{macro_name} to set/unset explicitly."
                     )
@@ -279,36 +404,15 @@ def parse_file(f: typing.TextIO, options: Options) -> MIPSFile:
                 elif line.startswith(".text"):
                     curr_section = ".text"
                 elif curr_section == ".rodata":
-                    if line.startswith(".word"):
-                        for w in line[5:].split(","):
-                            w = w.strip()
-                            if not w or w[0].isdigit():
-                                ival = try_parse(lambda: int(w, 0), ".word")
-                                mips_file.new_rodata_bytes(struct.pack(">I", ival))
-                            else:
-                                mips_file.new_rodata_sym(w)
-                    elif line.startswith(".byte"):
-                        for w in line[5:].split(","):
-                            ival = try_parse(lambda: int(w.strip(), 0), ".byte")
-                            mips_file.new_rodata_bytes(bytes([ival]))
-                    elif line.startswith(".float"):
-                        for w in line[6:].split(","):
-                            fval = try_parse(lambda: float(w.strip()), ".float")
-                            mips_file.new_rodata_bytes(struct.pack(">f", fval))
-                    elif line.startswith(".double"):
-                        for w in line[7:].split(","):
-                            fval = try_parse(lambda: float(w.strip()), ".double")
-                            mips_file.new_rodata_bytes(struct.pack(">d", fval))
-                    elif line.startswith(".asci"):
-                        z = line.startswith(".asciz") or line.startswith(".asciiz")
-                        mips_file.new_rodata_bytes(
-                            parse_ascii_directive(line, z), is_string=True
-                        )
+                    if rodata_index is not None:
+                        rodata_index.new_directive(lineno, line)
+                    else:
+                        parse_rodata_directive(line, mips_file)
         elif ifdef_level == 0:
             if line.startswith("glabel"):
                 process_label(line.split()[1], glabel=True)
 
-            elif curr_section == ".text":
+            elif curr_section == ".text" and not rodata_only:
                 meta = InstructionMeta(
                     emit_goto=emit_goto,
                     filename=filename,
@@ -319,3 +423,163 @@ def parse_file(f: typing.TextIO, options: Options) -> MIPSFile:
                 mips_file.new_instruction(instr)
 
     return mips_file
+
+
+# Maximum number of decoded entries kept per LazyRodataFile.
+LAZY_RODATA_CACHE_SIZE = 256
+
+
+@attr.s(eq=False)
+class LazyRodataFile:
+    """The rodata of a file given by --rodata, decoded on demand.
+
+    Up front, only the line numbers of the directives of each symbol are
+    recorded (plus the labels mentioned by .word directives, which are needed
+    to build flow graphs). The entry for a symbol is decoded from the file
+    the first time it's looked up, and the most recently used entries are
+    kept in memory. Compressed files can't be seeked in, so the text of their
+    directives is kept instead, to not decompress them again for each entry."""
+
+    path: str = attr.ib()
+    mtime_ns: int = attr.ib()
+    size: int = attr.ib()
+    seekable: bool = attr.ib(default=True)
+    line_offsets: "array[int]" = attr.ib(factory=lambda: array("q"), repr=False)
+    directive_lines: Dict[str, List[int]] = attr.ib(factory=dict, repr=False)
+    # The directives by line number, if the file isn't seekable.
+    directive_texts: Dict[int, bytes] = attr.ib(factory=dict, repr=False)
+    mentioned_labels: Set[str] = attr.ib(factory=set, repr=False)
+    current_lines: Optional[List[int]] = attr.ib(default=None, repr=False)
+    decoded: "OrderedDict[str, RodataEntry]" = attr.ib(factory=OrderedDict, repr=False)
+    lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    def new_label(self, symbol_name: str) -> None:
+        self.current_lines = []
+        self.directive_lines[symbol_name] = self.current_lines
+
+    def new_directive(self, lineno: int, line: str) -> None:
+        # Data before the first label isn't reachable by any symbol.
+        if self.current_lines is None:
+            return
+        self.current_lines.append(lineno)
+        if not self.seekable:
+            self.directive_texts[lineno] = line.encode("utf-8")
+        if line.startswith(".word"):
+            for w in line[5:].split(","):
+                w = w.strip()
+                if w and not w[0].isdigit():
+                    self.mentioned_labels.add(w.lstrip("."))
+
+    def get(self, symbol_name: str) -> Optional[RodataEntry]:
+        with self.lock:
+            entry = self.decoded.get(symbol_name)
+            if entry is not None:
+                self.decoded.move_to_end(symbol_name)
+                return entry
+            linenos = self.directive_lines.get(symbol_name)
+            if linenos is None:
+                return None
+            entry = self.decode(symbol_name, linenos)
+            self.decoded[symbol_name] = entry
+            if len(self.decoded) > LAZY_RODATA_CACHE_SIZE:
+                self.decoded.popitem(last=False)
+            return entry
+
+    def read_lines(self, linenos: List[int]) -> Iterator[bytes]:
+        """Read the given (increasing) lines of the file. Uncompressed files
+        are seeked in directly; for other ones, the directives kept while
+        indexing are used."""
+        if not self.seekable:
+            for lineno in linenos:
+                yield self.directive_texts[lineno]
+            return
+        if input_stat(self.path).st_mtime_ns != self.mtime_ns:
+            raise DecompFailure(f"{self.path} changed while decompiling.")
+        with open(self.path, "rb") as f:
+            for lineno in linenos:
+                f.seek(self.line_offsets[lineno - 1])
+                yield f.readline()
+
+    def decode(self, symbol_name: str, linenos: List[int]) -> RodataEntry:
+        mips_file = MIPSFile(self.path)
+        mips_file.new_rodata_label(symbol_name)
+        for raw_line in self.read_lines(linenos):
+            line = strip_comments(raw_line.decode("utf-8-sig"))
+            # Skip past any labels on the same line, like parse_file does.
+            while True:
+                g = re_label.match(line)
+                if not g:
+                    break
+                line = line[len(g.group(1)) + 1 :].strip()
+            parse_rodata_directive(line, mips_file)
+        return mips_file.rodata.values[symbol_name]
+
+
+def index_rodata_file(path: str, options: Options) -> LazyRodataFile:
+    stat = input_stat(path)
+    index = LazyRodataFile(
+        path=path,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        seekable=is_plain_file(path),
+    )
+
+    def read_lines() -> Iterator[str]:
+        with open_binary_input(path) as f:
+            offset = 0
+            for raw_line in f:
+                if index.seekable:
+                    index.line_offsets.append(offset)
+                    offset += len(raw_line)
+                yield raw_line.decode("utf-8-sig")
+
+    parse_file(read_lines(), options, rodata_only=True, rodata_index=index)
+    return index
+
+
+@attr.s
+class CachedRodata:
+    mtime_ns: int = attr.ib()
+    size: int = attr.ib()
+    rodata: LazyRodataFile = attr.ib()
+    assumed_defines: Dict[str, int] = attr.ib()
+    warnings: List[str] = attr.ib()
+
+
+# Rodata loaded by load_rodata_file(), keyed by absolute path and the
+# preprocessor defines given. Their index is never mutated after parsing, so
+# they can be shared between runs and threads.
+rodata_cache: Dict[Tuple[str, Tuple[Tuple[str, int], ...]], CachedRodata] = {}
+rodata_cache_lock = threading.Lock()
+
+
+def load_rodata_file(path: str, options: Options) -> LazyRodataFile:
+    """Index the rodata of a file given by --rodata, reusing the result of an
+    earlier call if the file hasn't changed since."""
+    defines = options.preproc_defines
+    key = (os.path.abspath(path), tuple(sorted(defines.items())))
+    stat = input_stat(path)
+    with rodata_cache_lock:
+        cached = rodata_cache.get(key)
+    if cached is None or (cached.mtime_ns, cached.size) != (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        with capture_diagnostics() as diagnostics:
+            rodata = index_rodata_file(path, options)
+        given_defines = dict(key[1])
+        assumed_defines = {d: v for d, v in defines.items() if d not in given_defines}
+        cached = CachedRodata(
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            rodata=rodata,
+            assumed_defines=assumed_defines,
+            warnings=diagnostics.warnings,
+        )
+        with rodata_cache_lock:
+            rodata_cache[key] = cached
+    # Replay the side effects of parsing: notes about assumed .ifdef values.
+    options.preproc_defines.update(cached.assumed_defines)
+    for message in cached.warnings:
+        warn(message)
+    return cached.rodata
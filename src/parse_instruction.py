@@ -7,6 +7,7 @@ from typing import List, Optional, Set, Union
 
 import attr
 
+from .diagnostics import current_diagnostics
 from .error import DecompFailure
 
 LENGTH_TWO: Set[str] = {
@@ -494,7 +495,10 @@ def parse_instruction(line: str, meta: InstructionMeta) -> Instruction:
         instr = Instruction(mnemonic, args, meta)
         return normalize_instruction(instr)
     except Exception as e:
-        print(
-            f"Failed to parse instruction: {line}, {meta.loc_str()}\n", file=sys.stderr
-        )
+        message = f"Failed to parse instruction: {line}, {meta.loc_str()}"
+        diagnostics = current_diagnostics()
+        if diagnostics is None:
+            print(f"{message}\n", file=sys.stderr)
+        else:
+            diagnostics.errors.append(message)
         raise e
@@ -0,0 +1,253 @@
+"""Wall time and counters per decompilation phase, for --profile and --trace.
+
+A Profile is activated for the current thread with profiling(), and a Trace for
+the whole process with tracing(). Code in the pipeline marks its phases with
+phase() and reports sizes with count(); both do nothing unless a function is
+being profiled or traced."""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+import attr
+
+from . import types
+
+# Phases timed inside each function, in pipeline order.
+FUNCTION_PHASES: List[str] = [
+    "build_flowgraph",
+    "get_stack_info",
+    "translate_graph",
+    "assign_phis",
+    "build_body",
+    "format",
+]
+
+# Counters reported for each function.
+FUNCTION_COUNTERS: List[str] = [
+    "instructions",
+    "blocks",
+    "nodes",
+    "phis",
+    "used_phis",
+    "temps",
+    "reachable_without",
+    "unify_calls",
+]
+
+
+@attr.s
+class FunctionProfile:
+    name: str = attr.ib()
+    total: float = attr.ib(default=0.0)
+    timings: Dict[str, float] = attr.ib(factory=dict)
+    counters: Dict[str, int] = attr.ib(factory=dict)
+
+
+@attr.s
+class Profile:
+    # File-level phases, e.g. "parse" and "context".
+    timings: Dict[str, float] = attr.ib(factory=dict)
+    functions: List[FunctionProfile] = attr.ib(factory=list)
+
+    def to_json(self) -> Dict[str, object]:
+        return {
+            "timings": self.timings,
+            "functions": [attr.asdict(fn) for fn in self.functions],
+        }
+
+    def write_json(self, out: TextIO) -> None:
+        json.dump(self.to_json(), out, indent=2)
+        out.write("\n")
+
+    def write_summary(self, out: TextIO) -> None:
+        """Write a table of the profiled functions, slowest first. Times are in
+        milliseconds."""
+        for name, seconds in self.timings.items():
+            out.write(f"{name}: {seconds * 1000:.1f} ms\n")
+        headers = ["function", "total", *FUNCTION_PHASES, *FUNCTION_COUNTERS]
+        rows = [headers]
+        for fn in sorted(self.functions, key=lambda fn: fn.total, reverse=True):
+            rows.append(
+                [
+                    fn.name,
+                    f"{fn.total * 1000:.2f}",
+                    *(f"{fn.timings.get(p, 0.0) * 1000:.2f}" for p in FUNCTION_PHASES),
+                    *(str(fn.counters.get(c, 0)) for c in FUNCTION_COUNTERS),
+                ]
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+        for row in rows:
+            cells = [row[0].ljust(widths[0])]
+            cells.extend(cell.rjust(width) for cell, width in zip(row[1:], widths[1:]))
+            out.write("  ".join(cells).rstrip() + "\n")
+
+
+@attr.s
+class Trace:
+    """Spans in the Chrome trace event format, which trace viewers such as
+    chrome://tracing and Perfetto can load. Unlike a Profile, a trace collects
+    spans from all threads at once."""
+
+    start: float = attr.ib(factory=time.perf_counter)
+    events: List[Dict[str, object]] = attr.ib(factory=list)
+    named_threads: Set[Tuple[int, int]] = attr.ib(factory=set)
+
+    def add_span(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        args: Optional[Dict[str, object]],
+    ) -> None:
+        pid = os.getpid()
+        tid = threading.get_ident()
+        if (pid, tid) not in self.named_threads:
+            self.named_threads.add((pid, tid))
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                }
+            )
+        event: Dict[str, object] = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.start) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def write_json(self, out: TextIO) -> None:
+        json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, out)
+        out.write("\n")
+
+
+_state = threading.local()
+_trace: Optional[Trace] = None
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace
+
+
+@contextmanager
+def tracing() -> Iterator[Trace]:
+    global _trace
+    prev = _trace
+    trace = Trace()
+    _trace = trace
+    try:
+        yield trace
+    finally:
+        _trace = prev
+
+
+def current_profile() -> Optional[Profile]:
+    ret: Optional[Profile] = getattr(_state, "profile", None)
+    return ret
+
+
+def current_function_profile() -> Optional[FunctionProfile]:
+    ret: Optional[FunctionProfile] = getattr(_state, "function", None)
+    return ret
+
+
+@contextmanager
+def profiling() -> Iterator[Profile]:
+    prev = current_profile()
+    profile = Profile()
+    _state.profile = profile
+    try:
+        yield profile
+    finally:
+        _state.profile = prev
+
+
+@contextmanager
+def timed(timings: Dict[str, float], name: str) -> Iterator[None]:
+    """Add the time spent inside the block to timings[name]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def traced(
+    name: str, category: str, args: Optional[Dict[str, object]] = None
+) -> Iterator[None]:
+    """Record the block as a span in the active trace, if any."""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, category, start, time.perf_counter(), args)
+
+
+@contextmanager
+def file_phase(name: str, filename: str) -> Iterator[None]:
+    with traced(name, "file", {"file": filename}):
+        profile = current_profile()
+        if profile is None:
+            yield
+        else:
+            with timed(profile.timings, name):
+                yield
+
+
+@contextmanager
+def profile_function(name: str) -> Iterator[None]:
+    with traced(name, "function"):
+        profile = current_profile()
+        if profile is None:
+            yield
+            return
+        prev = current_function_profile()
+        fn = FunctionProfile(name)
+        profile.functions.append(fn)
+        _state.function = fn
+        unify_calls = types.unify_calls
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            fn.total = time.perf_counter() - start
+            # unify_calls is process-wide, so this is only exact when functions
+            # are not profiled concurrently on several threads.
+            fn.counters["unify_calls"] = types.unify_calls - unify_calls
+            _state.function = prev
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    with traced(name, "phase"):
+        fn = current_function_profile()
+        if fn is None:
+            yield
+        else:
+            with timed(fn.timings, name):
+                yield
+
+
+def count(name: str, value: int) -> None:
+    fn = current_function_profile()
+    if fn is not None:
+        fn.counters[name] = value
@@ -0,0 +1,289 @@
+"""Storing the result of every decompiled function in an SQLite database, for
+--db. Each run records a row per function with its C code or error, hashes of
+its assembly and of everything else the output depends on, and timings, e.g.
+
+    SELECT file, name, error FROM functions WHERE status != 'ok';
+    SELECT name FROM functions WHERE changed_run = (SELECT MAX(id) FROM runs);
+
+Functions are identified by their file and name, and, since a file can
+contain several (e.g. static) functions with the same name, by 'occurrence':
+the number of functions with that name before it in the file.
+
+Rows whose result didn't change keep their old contents (only 'seen_run' is
+updated), and a function whose hashes match a stored successful row isn't
+decompiled again: the stored C code is printed instead.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import attr
+
+from .input_file import input_stat
+from .options import Options
+from .parse_file import Function, MIPSFile, Rodata
+from .parse_instruction import Instruction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    file TEXT NOT NULL,
+    options_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    body_hash TEXT NOT NULL,
+    options_hash TEXT NOT NULL,
+    -- 'ok', 'failed' (a DecompFailure) or 'internal_error'
+    status TEXT NOT NULL,
+    c_code TEXT,
+    error TEXT,
+    -- JSON object of seconds per phase, and the total
+    timings TEXT NOT NULL,
+    -- The last run which changed the row, and the last run which produced it
+    changed_run INTEGER NOT NULL REFERENCES runs (id),
+    seen_run INTEGER NOT NULL REFERENCES runs (id),
+    PRIMARY KEY (file, name, occurrence)
+);
+CREATE INDEX IF NOT EXISTS functions_by_name ON functions (name);
+CREATE INDEX IF NOT EXISTS functions_by_changed_run ON functions (changed_run);
+"""
+
+# Stored as the database's user_version. Databases with an older schema have
+# their functions table recreated, since it can't be migrated in place.
+SCHEMA_VERSION = 1
+
+# Number of functions written per transaction.
+BATCH_SIZE = 500
+
+# Options that don't change the C code of a function; everything else does.
+OPTIONS_NOT_HASHED = {
+    "filename",
+    "function_index_or_name",
+    "debug",
+    "print_assembly",
+    "visualize_flowgraph",
+    "dump_typemap",
+    "pdb_translate",
+    "profile",
+    "profile_json",
+    "trace",
+    "shard",
+    "db",
+    "dedupe",
+    "watch",
+}
+
+
+@attr.s
+class StoredResult:
+    body_hash: str = attr.ib()
+    options_hash: str = attr.ib()
+    status: str = attr.ib()
+    c_code: Optional[str] = attr.ib()
+    error: Optional[str] = attr.ib()
+
+
+def sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def function_hash(function: Function) -> str:
+    """Hash the assembly of a function. Which branches were marked with a
+    --goto pattern is included, since it's not visible in the instructions."""
+    lines = [function.name]
+    for item in function.body:
+        line = str(item)
+        if isinstance(item, Instruction) and item.meta.emit_goto:
+            line += " # goto"
+        lines.append(line)
+    return sha1("\n".join(lines).encode("utf-8"))
+
+
+def rodata_hash(rodata: Rodata) -> str:
+    h = hashlib.sha1()
+    for name, entry in rodata.values.items():
+        h.update(f"{name} {entry.is_string} {len(entry.items)}\n".encode("utf-8"))
+        for item in entry.items:
+            if isinstance(item, str):
+                h.update(f"sym {item}\n".encode("utf-8"))
+            else:
+                h.update(rodata.buffer[item[0] : item[1]])
+    return h.hexdigest()
+
+
+def file_state(path: str) -> Tuple[str, int, int]:
+    stat = input_stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+decompiler_hash_value: Optional[str] = None
+
+
+def decompiler_hash() -> str:
+    """Hash the decompiler's own source, so that results from another version
+    are not reused."""
+    global decompiler_hash_value
+    if decompiler_hash_value is None:
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha1()
+        for name in sorted(os.listdir(src_dir)):
+            if name.endswith(".py"):
+                with open(os.path.join(src_dir, name), "rb") as f:
+                    h.update(f.read())
+        decompiler_hash_value = h.hexdigest()
+    return decompiler_hash_value
+
+
+def options_hash(options: Options, mips_file: MIPSFile) -> str:
+    """Hash everything besides the function's assembly that its output
+    depends on: the options, the rodata in the file, the --rodata and
+    --context files (by modification time), and the decompiler itself."""
+    state = {
+        "options": attr.asdict(
+            options, filter=lambda a, _: a.name not in OPTIONS_NOT_HASHED
+        ),
+        "rodata": rodata_hash(mips_file.rodata),
+        "rodata_files": [file_state(path) for path in options.rodata_files],
+        "context": file_state(options.c_context) if options.c_context else None,
+        "decompiler": decompiler_hash(),
+    }
+    return sha1(json.dumps(state, sort_keys=True).encode("utf-8"))
+
+
+@attr.s
+class ResultsDb:
+    connection: sqlite3.Connection = attr.ib()
+    file: str = attr.ib()
+    options_hash: str = attr.ib()
+    run_id: int = attr.ib()
+    # The occurrence of each function of the file, by id().
+    occurrences: Dict[int, int] = attr.ib()
+    stored: Dict[Tuple[str, int], StoredResult] = attr.ib()
+    changed_rows: List[Tuple[object, ...]] = attr.ib(factory=list)
+    seen_keys: List[Tuple[str, int]] = attr.ib(factory=list)
+
+    @staticmethod
+    def open(path: str, options: Options, mips_file: MIPSFile) -> "ResultsDb":
+        """Open (or create) the database, start a run for the file being
+        decompiled, and load the rows stored for it by earlier runs."""
+        connection = sqlite3.connect(path)
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            connection.executescript(
+                "DROP TABLE IF EXISTS functions; "
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+        connection.executescript(SCHEMA)
+        if options.filename == "-":
+            file = "-"
+        else:
+            file = os.path.abspath(options.filename)
+        digest = options_hash(options, mips_file)
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (started, file, options_hash) VALUES (?, ?, ?)",
+                (time.time(), file, digest),
+            )
+        run_id = cursor.lastrowid
+        assert run_id is not None
+        occurrences: Dict[int, int] = {}
+        counts: Dict[str, int] = {}
+        for function in mips_file.functions:
+            occurrences[id(function)] = counts.get(function.name, 0)
+            counts[function.name] = occurrences[id(function)] + 1
+        stored = {
+            (name, occurrence): StoredResult(*row)
+            for name, occurrence, *row in connection.execute(
+                "SELECT name, occurrence, body_hash, options_hash, status, "
+                "c_code, error FROM functions WHERE file = ?",
+                (file,),
+            )
+        }
+        return ResultsDb(connection, file, digest, run_id, occurrences, stored)
+
+    def key(self, function: Function) -> Tuple[str, int]:
+        return function.name, self.occurrences[id(function)]
+
+    def lookup(self, function: Function) -> Optional[StoredResult]:
+        """The stored result for the function, if it is still valid. Failures
+        aren't reused, since their error messages contain line numbers, which
+        aren't part of the hash."""
+        stored = self.stored.get(self.key(function))
+        if (
+            stored is None
+            or stored.status != "ok"
+            or stored.options_hash != self.options_hash
+            or stored.body_hash != function_hash(function)
+        ):
+            return None
+        return stored
+
+    def keep(self, function: Function) -> None:
+        """Mark a stored result as produced by this run, without changing it."""
+        self.seen_keys.append(self.key(function))
+        self.flush_if_full()
+
+    def add(
+        self,
+        function: Function,
+        status: str,
+        c_code: Optional[str],
+        error: Optional[str],
+        timings: Dict[str, float],
+    ) -> None:
+        body_hash = function_hash(function)
+        name, occurrence = self.key(function)
+        stored = self.stored.get((name, occurrence))
+        if stored == StoredResult(body_hash, self.options_hash, status, c_code, error):
+            self.keep(function)
+            return
+        self.changed_rows.append(
+            (
+                self.file,
+                name,
+                occurrence,
+                body_hash,
+                self.options_hash,
+                status,
+                c_code,
+                error,
+                json.dumps(timings, sort_keys=True),
+                self.run_id,
+                self.run_id,
+            )
+        )
+        self.flush_if_full()
+
+    def flush_if_full(self) -> None:
+        if len(self.changed_rows) + len(self.seen_keys) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO functions VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.changed_rows,
+            )
+            self.connection.executemany(
+                "UPDATE functions SET seen_run = ? "
+                "WHERE file = ? AND name = ? AND occurrence = ?",
+                [
+                    (self.run_id, self.file, name, occurrence)
+                    for name, occurrence in self.seen_keys
+                ],
+            )
+        self.changed_rows = []
+        self.seen_keys = []
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
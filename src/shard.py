@@ -0,0 +1,126 @@
+"""Splitting the functions of a file between several runs with --shard i/N,
+and merging the outputs of those runs back together.
+
+The assignment of functions to shards only depends on the assembly, so every
+machine computes the same partition without any coordination. To merge the
+outputs in the original function order, run from the repository root:
+
+    python3 -m src.shard shard0.c shard1.c ... > merged.c
+"""
+
+import argparse
+import re
+import sys
+import zlib
+from typing import Dict, List, Tuple
+
+from .parse_file import Function
+from .parse_instruction import Instruction
+
+# Printed before each function in the output of a sharded run.
+MARKER_FORMAT = "// mips_to_c shard: function {index} of {count} ({name})"
+MARKER_RE = re.compile(r"// mips_to_c shard: function (\d+) of (\d+) \((.*)\)$")
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse "i/N" into (i, N), with 0 <= i < N."""
+    index_str, _, count_str = spec.partition("/")
+    try:
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {spec!r}") from None
+    if not (0 <= index < count):
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count})")
+    return index, count
+
+
+def function_weight(function: Function) -> int:
+    return max(sum(1 for item in function.body if isinstance(item, Instruction)), 1)
+
+
+def assign_shards(functions: List[Function], num_shards: int) -> List[int]:
+    """Assign each function to a shard, balancing the number of instructions.
+
+    Functions are placed heaviest first on the least loaded shard. Ties are
+    broken by a hash of the function name (not Python's hash(), which is
+    randomized per process), then by position, so the result is the same
+    on every machine."""
+    weights = [function_weight(fn) for fn in functions]
+    order = sorted(
+        range(len(functions)),
+        key=lambda i: (-weights[i], zlib.crc32(functions[i].name.encode()), i),
+    )
+    loads = [0] * num_shards
+    shards = [0] * len(functions)
+    for i in order:
+        shard = min(range(num_shards), key=lambda s: (loads[s], s))
+        shards[i] = shard
+        loads[shard] += weights[i]
+    return shards
+
+
+def split_shard_output(text: str) -> Tuple[str, Dict[int, str], int]:
+    """Split the output of a sharded run into the text before the first
+    function (e.g. notes from parsing), and the text for each function.
+    Also return the total number of functions in the file, or -1 if the
+    output doesn't contain any."""
+    preamble: List[str] = []
+    chunks: Dict[int, List[str]] = {}
+    count = -1
+    current = preamble
+    for line in text.splitlines(keepends=True):
+        m = MARKER_RE.match(line.rstrip("\n"))
+        if m:
+            current = chunks.setdefault(int(m.group(1)), [])
+            count = int(m.group(2))
+        else:
+            current.append(line)
+    chunk_texts = {index: "".join(chunk) for index, chunk in chunks.items()}
+    return "".join(preamble), chunk_texts, count
+
+
+def merge_shard_outputs(texts: List[str]) -> str:
+    """Reassemble the outputs of all shards of a run into the output that a
+    run without --shard would have produced."""
+    preamble = ""
+    chunks: Dict[int, str] = {}
+    count = 0
+    for i, text in enumerate(texts):
+        shard_preamble, shard_chunks, shard_count = split_shard_output(text)
+        if i == 0:
+            preamble = shard_preamble
+        count = max(count, shard_count)
+        for index, chunk in shard_chunks.items():
+            if index in chunks:
+                raise ValueError(f"Function {index} occurs in more than one shard.")
+            chunks[index] = chunk
+    missing = [i for i in range(count) if i not in chunks]
+    if missing:
+        raise ValueError(
+            f"Function {missing[0]} is missing; are the outputs of all shards given?"
+        )
+    return preamble + "\n".join(chunks[i] for i in range(count))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Merge the outputs of mips_to_c runs with --shard i/N, in "
+        "the original function order."
+    )
+    parser.add_argument("outputs", nargs="+", help="output files of all shards")
+    args = parser.parse_args()
+
+    texts: List[str] = []
+    for path in args.outputs:
+        with open(path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    try:
+        sys.stdout.write(merge_shard_outputs(texts))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Rendering a function with every combination of the formatting options, for
+--sweep. These options don't affect translation, so each function is parsed
+and translated once, and only rendered once per combination."""
+
+import multiprocessing
+from typing import List, Optional, TextIO, Tuple
+
+import attr
+
+from .if_statements import get_function_text
+from .options import CodingStyle, Options
+from .translate import FunctionInfo
+from .types import undo_changes
+
+# The options that are varied, as command-line flags.
+SWEEP_FLAGS: List[str] = ["--allman", "--no-casts", "--no-andor", "--no-ifs"]
+
+# Printed before each variant.
+MARKER_FORMAT = "// mips_to_c variant: {flags}"
+
+
+def sweep_variants(options: Options) -> List[Tuple[str, Options]]:
+    """Return the options for every combination of SWEEP_FLAGS, with the flags
+    that are set, starting with none of them."""
+    variants = []
+    for mask in range(2 ** len(SWEEP_FLAGS)):
+        flags = [flag for i, flag in enumerate(SWEEP_FLAGS) if mask & (1 << i)]
+        allman = "--allman" in flags
+        variant = attr.evolve(
+            options,
+            coding_style=CodingStyle(
+                newline_after_function=allman,
+                newline_after_if=allman,
+                newline_before_else=allman,
+            ),
+            skip_casts="--no-casts" in flags,
+            andor_detection="--no-andor" not in flags,
+            ifs="--no-ifs" not in flags,
+        )
+        variants.append((" ".join(flags) or "(none)", variant))
+    return variants
+
+
+def render_variant(function_info: FunctionInfo, options: Options) -> str:
+    """Render a translated function, leaving it as it was: rendering unifies
+    types too, which would otherwise leak into the next variant."""
+    with undo_changes():
+        return get_function_text(function_info, options)
+
+
+# The function being rendered by the processes of render_variants().
+shared_function_info: Optional[FunctionInfo] = None
+
+
+def render_shared(options: Options) -> str:
+    assert shared_function_info is not None
+    return render_variant(shared_function_info, options)
+
+
+def render_variants(
+    function_info: FunctionInfo, variants: List[Options], *, processes: int = 1
+) -> List[str]:
+    """Render a translated function once for each of 'variants'. Renders don't
+    affect each other, so the result is the same as translating the function
+    again for each of them.
+
+    With processes > 1, the renders are split between forked processes, which
+    each get a copy of 'function_info'. Where fork isn't available, they're
+    done one after another."""
+    global shared_function_info
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [render_variant(function_info, options) for options in variants]
+    shared_function_info = function_info
+    try:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            return pool.map(render_shared, variants)
+    finally:
+        shared_function_info = None
+
+
+def write_sweep(function_info: FunctionInfo, options: Options, out: TextIO) -> None:
+    """Write the C code for every variant of a function to 'out', each preceded
+    by a comment with its flags, without a trailing newline."""
+    variants = sweep_variants(options)
+    texts = render_variants(function_info, [variant for _, variant in variants])
+    for i, ((flags, _), text) in enumerate(zip(variants, texts)):
+        if i != 0:
+            out.write("\n\n")
+        out.write(MARKER_FORMAT.format(flags=flags) + "\n")
+        out.write(text)
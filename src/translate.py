@@ -16,7 +16,9 @@ from .c_types import (
     get_primitive_list,
     is_struct_type,
 )
+from .diagnostics import current_diagnostics
 from .error import DecompFailure
+from .profiling import count, phase
 from .flow_graph import (
     FlowGraph,
     Function,
@@ -43,6 +45,7 @@ from .types import (
     get_field,
     get_pointer_target,
     ptr_type_from_ctype,
+    record_undo,
     type_from_ctype,
 )
 
@@ -151,10 +154,24 @@ class Formatter:
     skip_casts: bool = attr.ib(default=False)
     extra_indent: int = attr.ib(default=0)
     debug: bool = attr.ib(default=False)
+    # Names of temporaries are given out in the order they are first printed,
+    # separately for each Formatter, so that a function can be rendered more
+    # than once.
+    var_names: Dict["Var", str] = attr.ib(factory=dict)
+    temp_name_counter: Dict[str, int] = attr.ib(factory=dict)
 
     def indent(self, indent: int, line: str) -> str:
         return self.indent_step * max(indent + self.extra_indent, 0) + line
 
+    def var_name(self, var: "Var") -> str:
+        name = self.var_names.get(var)
+        if name is None:
+            counter = self.temp_name_counter.get(var.prefix, 0) + 1
+            self.temp_name_counter[var.prefix] = counter
+            name = var.prefix + (f"_{counter}" if counter > 1 else "")
+            self.var_names[var] = name
+        return name
+
 
 def as_type(expr: "Expression", type: Type, silent: bool) -> "Expression":
     if expr.type.unify(type):
@@ -217,19 +234,16 @@ class StackInfo:
     return_addr_location: int = attr.ib(default=0)
     callee_save_reg_locations: Dict[Register, int] = attr.ib(factory=dict)
     unique_type_map: Dict[Any, "Type"] = attr.ib(factory=dict)
-    local_vars: List["LocalVar"] = attr.ib(factory=list)
+    local_vars: Dict[int, "LocalVar"] = attr.ib(factory=dict)
     temp_vars: List["EvalOnceStmt"] = attr.ib(factory=list)
     phi_vars: List["PhiExpr"] = attr.ib(factory=list)
-    arguments: List["PassedInArg"] = attr.ib(factory=list)
-    temp_name_counter: Dict[str, int] = attr.ib(factory=dict)
+    arguments: Dict[int, "PassedInArg"] = attr.ib(factory=dict)
+    unique_local_vars: Dict[int, "LocalVar"] = attr.ib(factory=dict)
+    unique_arguments: Dict[int, "PassedInArg"] = attr.ib(factory=dict)
+    num_created_phis: int = attr.ib(default=0)
     nonzero_accesses: Set["Expression"] = attr.ib(factory=set)
     param_names: Dict[int, str] = attr.ib(factory=dict)
 
-    def temp_var(self, prefix: str) -> str:
-        counter = self.temp_name_counter.get(prefix, 0) + 1
-        self.temp_name_counter[prefix] = counter
-        return prefix + (f"_{counter}" if counter > 1 else "")
-
     def in_subroutine_arg_region(self, location: int) -> bool:
         if self.is_leaf:
             return False
@@ -258,26 +272,30 @@ class StackInfo:
         return self.param_names.get(offset)
 
     def add_local_var(self, var: "LocalVar") -> None:
-        if any(v.value == var.value for v in self.local_vars):
-            return
-        self.local_vars.append(var)
-        # Make sure the local vars stay sorted in order on the stack.
-        self.local_vars.sort(key=lambda v: v.value)
+        self.local_vars.setdefault(var.value, var)
 
     def add_argument(self, arg: "PassedInArg") -> None:
-        if any(a.value == arg.value for a in self.arguments):
-            return
-        self.arguments.append(arg)
-        self.arguments.sort(key=lambda a: a.value)
+        self.arguments.setdefault(arg.value, arg)
+
+    def sorted_local_vars(self) -> List["LocalVar"]:
+        """Local vars, in order on the stack."""
+        return [self.local_vars[offset] for offset in sorted(self.local_vars)]
+
+    def sorted_arguments(self) -> List["PassedInArg"]:
+        """Arguments, in order of their stack offsets."""
+        return [self.arguments[offset] for offset in sorted(self.arguments)]
 
     def get_argument(self, location: int) -> Tuple["Expression", "PassedInArg"]:
         real_location = location & -4
-        arg = PassedInArg(
-            real_location,
-            copied=True,
-            stack_info=self,
-            type=self.unique_type_for("arg", real_location),
-        )
+        arg = self.unique_arguments.get(real_location)
+        if arg is None:
+            arg = PassedInArg(
+                real_location,
+                copied=True,
+                stack_info=self,
+                type=self.unique_type_for("arg", real_location),
+            )
+            self.unique_arguments[real_location] = arg
         if real_location == location - 3:
             return as_type(arg, Type.of_size(8), True), arg
         if real_location == location - 2:
@@ -320,7 +338,11 @@ class StackInfo:
 
     def get_stack_var(self, location: int, *, store: bool) -> "Expression":
         if self.in_local_var_region(location):
-            return LocalVar(location, type=self.unique_type_for("stack", location))
+            var = self.unique_local_vars.get(location)
+            if var is None:
+                var = LocalVar(location, type=self.unique_type_for("stack", location))
+                self.unique_local_vars[location] = var
+            return var
         elif self.location_above_stack(location):
             ret, arg = self.get_argument(location - self.allocated_stack_size)
             if not store:
@@ -341,9 +363,11 @@ class StackInfo:
         return False
 
     def address_of_gsym(self, sym: "GlobalSymbol") -> "Expression":
-        ent = self.rodata.values.get(sym.symbol_name)
-        if ent and ent.is_string and ent.data and isinstance(ent.data[0], bytes):
-            return StringLiteral(ent.data[0], type=Type.ptr(Type.s8()))
+        ent = self.rodata.get(sym.symbol_name)
+        if ent and ent.is_string:
+            data = ent.leading_bytes()
+            if data is not None:
+                return StringLiteral(data.tobytes(), type=Type.ptr(Type.s8()))
         type = Type.ptr()
         typemap = self.typemap
         if typemap:
@@ -456,15 +480,11 @@ def escape_char(ch: str) -> str:
 
 @attr.s(eq=False)
 class Var:
-    stack_info: StackInfo = attr.ib(repr=False)
     prefix: str = attr.ib()
     num_usages: int = attr.ib(default=0)
-    name: Optional[str] = attr.ib(default=None)
 
     def format(self, fmt: Formatter) -> str:
-        if self.name is None:
-            self.name = self.stack_info.temp_var(self.prefix)
-        return self.name
+        return fmt.var_name(self)
 
     def __str__(self) -> str:
         return "<temp>"
@@ -493,9 +513,21 @@ class Expression(abc.ABC):
             expr.use()
 
     @abc.abstractmethod
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        """Append the C text for the expression to 'out'.
+
+        If 'needs_parens' is False, the surrounding context already delimits
+        the expression (e.g. it is a whole statement, a function argument, or
+        the left operand in a chain of the same associative operator), so
+        parentheses around a binary operation at its root can be left out.
+        Everything else gets parenthesized fully."""
         ...
 
+    def format(self, fmt: Formatter) -> str:
+        out: List[str] = []
+        self.emit(fmt, out, needs_parens=True)
+        return "".join(out)
+
     def __str__(self) -> str:
         """Stringify an expression for debug purposes. The output can change
         depending on when this is called, e.g. because of EvalOnceExpr state.
@@ -538,10 +570,11 @@ class ErrorExpr(Condition):
     def negated(self) -> "Condition":
         return self
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if self.desc is not None:
-            return f"ERROR({self.desc})"
-        return "ERROR"
+            out.append(f"ERROR({self.desc})")
+        else:
+            out.append("ERROR")
 
 
 @attr.s(frozen=True, eq=False)
@@ -551,8 +584,11 @@ class SecondF64Half(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
-        return "(second half of f64)"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        if needs_parens:
+            out.append("(second half of f64)")
+        else:
+            out.append("second half of f64")
 
 
 @attr.s(frozen=True, eq=False)
@@ -678,18 +714,19 @@ class BinaryOp(Condition):
     def dependencies(self) -> List[Expression]:
         return [self.left, self.right]
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if (
             self.is_boolean()
             and isinstance(self.left, Literal)
             and not isinstance(self.right, Literal)
         ):
-            return BinaryOp(
+            BinaryOp(
                 left=self.right,
                 op=self.op.translate(str.maketrans("<>", "><")),
                 right=self.left,
                 type=self.type,
-            ).format(fmt)
+            ).emit(fmt, out, needs_parens=needs_parens)
+            return
 
         if (
             not self.floating
@@ -699,24 +736,30 @@ class BinaryOp(Condition):
             if self.op == "+":
                 neg = Literal(value=-self.right.value, type=self.right.type)
                 sub = BinaryOp(op="-", left=self.left, right=neg, type=self.type)
-                return sub.format(fmt)
+                sub.emit(fmt, out, needs_parens=needs_parens)
+                return
             if self.op in ("&", "|"):
                 neg = Literal(value=~self.right.value, type=self.right.type)
                 right = UnaryOp("~", neg, type=Type.any())
                 expr = BinaryOp(op=self.op, left=self.left, right=right, type=self.type)
-                return expr.format(fmt)
+                expr.emit(fmt, out, needs_parens=needs_parens)
+                return
 
         # For commutative, left-associative operations, strip unnecessary parentheses.
         left_expr = late_unwrap(self.left)
-        lhs = left_expr.format(fmt)
-        if (
+        chained = (
             isinstance(left_expr, BinaryOp)
             and left_expr.op == self.op
             and self.op in ASSOCIATIVE_OPS
-        ):
-            lhs = lhs[1:-1]
+        )
 
-        return f"({lhs} {self.op} {self.right.format(fmt)})"
+        if needs_parens:
+            out.append("(")
+        left_expr.emit(fmt, out, needs_parens=not chained)
+        out.append(f" {self.op} ")
+        self.right.emit(fmt, out, needs_parens=True)
+        if needs_parens:
+            out.append(")")
 
 
 @attr.s(frozen=True, eq=False)
@@ -733,8 +776,9 @@ class UnaryOp(Condition):
             return self.expr
         return UnaryOp("!", self, type=Type.bool())
 
-    def format(self, fmt: Formatter) -> str:
-        return f"{self.op}{self.expr.format(fmt)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append(self.op)
+        self.expr.emit(fmt, out, needs_parens=True)
 
 
 @attr.s(frozen=True, eq=False)
@@ -749,9 +793,12 @@ class ExprCondition(Condition):
     def negated(self) -> "Condition":
         return ExprCondition(self.expr, self.type, not self.is_negated)
 
-    def format(self, fmt: Formatter) -> str:
-        neg = "!" if self.is_negated else ""
-        return f"{neg}{self.expr.format(fmt)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        if self.is_negated:
+            out.append("!")
+            self.expr.emit(fmt, out, needs_parens=True)
+        else:
+            self.expr.emit(fmt, out, needs_parens=needs_parens)
 
 
 @attr.s(frozen=True, eq=False)
@@ -767,11 +814,16 @@ class CommaConditionExpr(Condition):
     def negated(self) -> "Condition":
         return CommaConditionExpr(self.statements, self.condition.negated())
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         comma_joined = ", ".join(
             stmt.format(fmt).rstrip(";") for stmt in self.statements
         )
-        return f"({comma_joined}, {self.condition.format(fmt)})"
+        if needs_parens:
+            out.append("(")
+        out.append(f"{comma_joined}, ")
+        self.condition.emit(fmt, out, needs_parens=True)
+        if needs_parens:
+            out.append(")")
 
 
 @attr.s(frozen=True, eq=False)
@@ -798,18 +850,22 @@ class Cast(Expression):
             return True
         return False
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if self.reinterpret and self.expr.type.is_float() != self.type.is_float():
             # This shouldn't happen, but mark it in the output if it does.
-            return f"(bitwise {self.type}) {self.expr.format(fmt)}"
-        if self.reinterpret and (
-            self.silent
-            or (is_type_obvious(self.expr) and self.expr.type.unify(self.type))
-        ):
-            return self.expr.format(fmt)
-        if fmt.skip_casts:
-            return f"{self.expr.format(fmt)}"
-        return f"({self.type}) {self.expr.format(fmt)}"
+            out.append(f"(bitwise {self.type}) ")
+            self.expr.emit(fmt, out, needs_parens=True)
+        elif (
+            self.reinterpret
+            and (
+                self.silent
+                or (is_type_obvious(self.expr) and self.expr.type.unify(self.type))
+            )
+        ) or fmt.skip_casts:
+            self.expr.emit(fmt, out, needs_parens=needs_parens)
+        else:
+            out.append(f"({self.type}) ")
+            self.expr.emit(fmt, out, needs_parens=True)
 
 
 @attr.s(frozen=True, eq=False)
@@ -821,9 +877,14 @@ class FuncCall(Expression):
     def dependencies(self) -> List[Expression]:
         return self.args + [self.function]
 
-    def format(self, fmt: Formatter) -> str:
-        args = ", ".join(format_expr(arg, fmt) for arg in self.args)
-        return f"{self.function.format(fmt)}({args})"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        self.function.emit(fmt, out, needs_parens=True)
+        out.append("(")
+        for i, arg in enumerate(self.args):
+            if i != 0:
+                out.append(", ")
+            arg.emit(fmt, out, needs_parens=False)
+        out.append(")")
 
 
 @attr.s(frozen=True, eq=True)
@@ -834,8 +895,8 @@ class LocalVar(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
-        return f"sp{format_hex(self.value)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append(f"sp{format_hex(self.value)}")
 
 
 @attr.s(frozen=True, eq=True)
@@ -848,10 +909,10 @@ class PassedInArg(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         assert self.value % 4 == 0
         name = self.stack_info.get_param_name(self.value)
-        return name or f"arg{format_hex(self.value // 4)}"
+        out.append(name or f"arg{format_hex(self.value // 4)}")
 
 
 @attr.s(frozen=True, eq=True)
@@ -862,8 +923,8 @@ class SubroutineArg(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
-        return f"subroutine_arg{format_hex(self.value // 4)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append(f"subroutine_arg{format_hex(self.value // 4)}")
 
 
 @attr.s(eq=True, hash=True)
@@ -892,6 +953,7 @@ class StructAccess(Expression):
             and self.stack_info.typemap
             and not self.has_late_field_name
         ):
+            record_undo(self.forget_late_field_name)
             var = late_unwrap(self.struct_var)
             self.field_name = get_field(
                 var.type,
@@ -902,6 +964,10 @@ class StructAccess(Expression):
             self.has_late_field_name = True
         return self.field_name
 
+    def forget_late_field_name(self) -> None:
+        self.field_name = None
+        self.has_late_field_name = False
+
     def late_has_known_type(self) -> bool:
         if self.late_field_name() is not None:
             return True
@@ -916,7 +982,7 @@ class StructAccess(Expression):
                 return True
         return False
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         var = late_unwrap(self.struct_var)
         has_nonzero_access = self.stack_info.has_nonzero_access(var)
 
@@ -929,14 +995,17 @@ class StructAccess(Expression):
 
         if isinstance(var, AddressOf):
             if self.offset == 0 and not has_nonzero_access:
-                return f"{var.expr.format(fmt)}"
+                var.expr.emit(fmt, out, needs_parens=needs_parens)
             else:
-                return f"{parenthesize_for_struct_access(var.expr, fmt)}.{field_name}"
+                parenthesize_for_struct_access(var.expr, fmt, out)
+                out.append(f".{field_name}")
         else:
             if self.offset == 0 and not has_nonzero_access:
-                return f"*{var.format(fmt)}"
+                out.append("*")
+                var.emit(fmt, out, needs_parens=True)
             else:
-                return f"{parenthesize_for_struct_access(var, fmt)}->{field_name}"
+                parenthesize_for_struct_access(var, fmt, out)
+                out.append(f"->{field_name}")
 
 
 @attr.s(frozen=True, eq=True)
@@ -949,10 +1018,11 @@ class ArrayAccess(Expression):
     def dependencies(self) -> List[Expression]:
         return [self.ptr, self.index]
 
-    def format(self, fmt: Formatter) -> str:
-        base = parenthesize_for_struct_access(self.ptr, fmt)
-        index = format_expr(self.index, fmt)
-        return f"{base}[{index}]"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        parenthesize_for_struct_access(self.ptr, fmt, out)
+        out.append("[")
+        self.index.emit(fmt, out, needs_parens=False)
+        out.append("]")
 
 
 @attr.s(frozen=True, eq=True)
@@ -963,8 +1033,8 @@ class GlobalSymbol(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
-        return self.symbol_name
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append(self.symbol_name)
 
 
 @attr.s(frozen=True, eq=True)
@@ -975,14 +1045,16 @@ class Literal(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if self.type.is_float():
             if self.type.get_size_bits() == 32:
-                return format_f32_imm(self.value) + "f"
+                out.append(format_f32_imm(self.value) + "f")
             else:
-                return format_f64_imm(self.value)
+                out.append(format_f64_imm(self.value))
+            return
         if self.type.is_pointer() and self.value == 0:
-            return "NULL"
+            out.append("NULL")
+            return
 
         prefix = ""
         suffix = ""
@@ -1000,7 +1072,7 @@ class Literal(Expression):
             if abs(self.value) < 10
             else hex(self.value).upper().replace("X", "x")
         )
-        return prefix + mid + suffix
+        out.append(prefix + mid + suffix)
 
 
 @attr.s(frozen=True)
@@ -1011,7 +1083,7 @@ class StringLiteral(Expression):
     def dependencies(self) -> List[Expression]:
         return []
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         has_trailing_null = False
         strdata: str
         try:
@@ -1024,7 +1096,7 @@ class StringLiteral(Expression):
         ret = '"' + "".join(map(escape_char, strdata)) + '"'
         if not has_trailing_null:
             ret += " /* not null-terminated */"
-        return ret
+        out.append(ret)
 
 
 @attr.s(frozen=True, eq=True)
@@ -1035,8 +1107,9 @@ class AddressOf(Expression):
     def dependencies(self) -> List[Expression]:
         return [self.expr]
 
-    def format(self, fmt: Formatter) -> str:
-        return f"&{self.expr.format(fmt)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append("&")
+        self.expr.emit(fmt, out, needs_parens=True)
 
 
 @attr.s(frozen=True)
@@ -1048,8 +1121,10 @@ class Lwl(Expression):
     def dependencies(self) -> List[Expression]:
         return [self.load_expr]
 
-    def format(self, fmt: Formatter) -> str:
-        return f"LWL({self.load_expr.format(fmt)})"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append("LWL(")
+        self.load_expr.emit(fmt, out, needs_parens=True)
+        out.append(")")
 
 
 @attr.s(frozen=True)
@@ -1060,8 +1135,9 @@ class Load3Bytes(Expression):
     def dependencies(self) -> List[Expression]:
         return [self.load_expr]
 
-    def format(self, fmt: Formatter) -> str:
-        return f"(first 3 bytes) {self.load_expr.format(fmt)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append("(first 3 bytes) ")
+        self.load_expr.emit(fmt, out, needs_parens=True)
 
 
 @attr.s(frozen=True)
@@ -1072,8 +1148,9 @@ class UnalignedLoad(Expression):
     def dependencies(self) -> List[Expression]:
         return [self.load_expr]
 
-    def format(self, fmt: Formatter) -> str:
-        return f"(unaligned s32) {self.load_expr.format(fmt)}"
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        out.append("(unaligned s32) ")
+        self.load_expr.emit(fmt, out, needs_parens=True)
 
 
 @attr.s(frozen=False, eq=False)
@@ -1115,11 +1192,11 @@ class EvalOnceExpr(Expression):
     def need_decl(self) -> bool:
         return self.num_usages > 1 and not self.trivial
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if not self.need_decl():
-            return self.wrapped_expr.format(fmt)
+            self.wrapped_expr.emit(fmt, out, needs_parens=needs_parens)
         else:
-            return self.var.format(fmt)
+            out.append(self.var.format(fmt))
 
 
 @attr.s(eq=False)
@@ -1144,8 +1221,8 @@ class ForceVarExpr(Expression):
         self.wrapped_expr.use()
         self.wrapped_expr.use()
 
-    def format(self, fmt: Formatter) -> str:
-        return self.wrapped_expr.format(fmt)
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
+        self.wrapped_expr.emit(fmt, out, needs_parens=needs_parens)
 
 
 @attr.s(frozen=False, eq=False)
@@ -1186,10 +1263,11 @@ class PhiExpr(Expression):
             return self
         return self.used_by.propagates_to()
 
-    def format(self, fmt: Formatter) -> str:
+    def emit(self, fmt: Formatter, out: List[str], *, needs_parens: bool) -> None:
         if self.replacement_expr:
-            return self.replacement_expr.format(fmt)
-        return self.get_var_name()
+            self.replacement_expr.emit(fmt, out, needs_parens=needs_parens)
+        else:
+            out.append(self.get_var_name())
 
 
 @attr.s
@@ -1641,38 +1719,25 @@ def simplify_condition(expr: Expression) -> Expression:
     return expr
 
 
-def balanced_parentheses(string: str) -> bool:
-    """
-    Check if parentheses in a string are balanced, ignoring any non-parenthesis
-    characters. E.g. true for "(x())yz", false for ")(" or "(".
-    """
-    bal = 0
-    for c in string:
-        if c == "(":
-            bal += 1
-        elif c == ")":
-            if bal == 0:
-                return False
-            bal -= 1
-    return bal == 0
-
-
 def format_expr(expr: Expression, fmt: Formatter) -> str:
-    """Stringify an expression, stripping unnecessary parentheses around it."""
-    ret = expr.format(fmt)
-    if ret.startswith("(") and balanced_parentheses(ret[1:-1]):
-        return ret[1:-1]
-    return ret
+    """Stringify an expression, without unnecessary parentheses around it."""
+    out: List[str] = []
+    expr.emit(fmt, out, needs_parens=False)
+    return "".join(out)
 
 
-def parenthesize_for_struct_access(expr: Expression, fmt: Formatter) -> str:
+def parenthesize_for_struct_access(
+    expr: Expression, fmt: Formatter, out: List[str]
+) -> None:
     # Nested dereferences may need to be parenthesized. All other
     # expressions will already have adequate parentheses added to them.
     # (Except Cast's, TODO...)
-    s = expr.format(fmt)
-    if s.startswith("*") or s.startswith("&"):
-        return f"({s})"
-    return s
+    start = len(out)
+    expr.emit(fmt, out, needs_parens=True)
+    first = next((s for s in out[start:] if s), "")
+    if first.startswith("*") or first.startswith("&"):
+        out.insert(start, "(")
+        out.append(")")
 
 
 def elide_casts_for_store(expr: Expression) -> Expression:
@@ -1960,19 +2025,14 @@ def handle_load(args: InstrArgs, type: Type) -> Expression:
             and type.is_float()
         ):
             sym_name = target.expr.symbol_name
-            ent = args.stack_info.rodata.values.get(sym_name)
-            if (
-                ent
-                and ent.data
-                and isinstance(ent.data[0], bytes)
-                and len(ent.data[0]) >= size
-            ):
-                data = ent.data[0][:size]
+            ent = args.stack_info.rodata.get(sym_name)
+            data = ent.leading_bytes() if ent else None
+            if data is not None and len(data) >= size:
                 val: int
                 if size == 4:
-                    (val,) = struct.unpack(">I", data)
+                    (val,) = struct.unpack_from(">I", data)
                 else:
-                    (val,) = struct.unpack(">Q", data)
+                    (val,) = struct.unpack_from(">Q", data)
                 return Literal(value=val, type=type)
 
     return as_type(expr, type, silent=True)
@@ -2082,8 +2142,29 @@ def handle_sra(args: InstrArgs) -> Expression:
     return BinaryOp(as_s32(lhs), ">>", as_intish(shift), type=Type.s32())
 
 
+# Formatted float literals by bit pattern. The same constants (1.0f, 0.5f,
+# etc.) recur throughout a project, so this is shared by the whole process.
+f32_imm_cache: Dict[int, str] = {}
+f64_imm_cache: Dict[int, str] = {}
+
+# Formatting a float with 9 significant digits always round-trips it. In
+# notation "e" that takes 8 decimals, in "g" 9 digits, and in "f" (used for
+# values between 1e-7 and 1) at most 6 + 9 decimals. format_f32_imm() would
+# accept every precision above these, so its search can start here.
+F32_ROUNDTRIP_PRECISION: Dict[str, int] = {"e": 8, "g": 9, "f": 15}
+
+
 def format_f32_imm(num: int) -> str:
-    packed = struct.pack(">I", num & (2 ** 32 - 1))
+    num &= 2 ** 32 - 1
+    ret = f32_imm_cache.get(num)
+    if ret is None:
+        ret = format_f32_imm_uncached(num)
+        f32_imm_cache[num] = ret
+    return ret
+
+
+def format_f32_imm_uncached(num: int) -> str:
+    packed = struct.pack(">I", num)
     value = struct.unpack(">f", packed)[0]
 
     if not value or value == 4294967296.0:
@@ -2102,7 +2183,7 @@ def format_f32_imm(num: int) -> str:
     def fmt(prec: int) -> str:
         """Format 'value' with 'prec' significant digits/decimals, in either scientific
         or regular notation depending on 'fmt_char'."""
-        ret = ("{:." + str(prec) + fmt_char + "}").format(value)
+        ret = format(value, f".{prec}{fmt_char}")
         if fmt_char == "e":
             return ret.replace("e+", "e").replace("e0", "e").replace("e-0", "e-")
         if "e" in ret:
@@ -2117,8 +2198,12 @@ def format_f32_imm(num: int) -> str:
             return "0"
         return ret
 
-    # 20 decimals is more than enough for a float. Start there, then try to shrink it.
+    # 20 decimals is more than enough for a float. Start there (or rather, at the
+    # first precision that is known to round-trip), then try to shrink it.
     prec = 20
+    start_prec = F32_ROUNDTRIP_PRECISION[fmt_char]
+    if struct.pack(">f", float(fmt(start_prec))) == packed:
+        prec = start_prec
     while prec > 0:
         prec -= 1
         value2 = float(fmt(prec))
@@ -2138,8 +2223,14 @@ def format_f32_imm(num: int) -> str:
 
 
 def format_f64_imm(num: int) -> str:
-    (value,) = struct.unpack(">d", struct.pack(">Q", num & (2 ** 64 - 1)))
-    return str(value)
+    num &= 2 ** 64 - 1
+    ret = f64_imm_cache.get(num)
+    if ret is None:
+        # str() already gives the shortest representation that round-trips.
+        (value,) = struct.unpack(">d", struct.pack(">Q", num))
+        ret = str(value)
+        f64_imm_cache[num] = ret
+    return ret
 
 
 def fold_mul_chains(expr: Expression) -> Expression:
@@ -2773,6 +2864,79 @@ def output_regs_for_instr(
     return []
 
 
+def input_regs_for_instr(instr: Instruction) -> List[Register]:
+    """Registers that an instruction may read. This may over-approximate, but
+    must never miss a read, since it's used to decide which phis are needed."""
+    mnemonic = instr.mnemonic
+    if mnemonic in CASES_DESTINATION_FIRST:
+        args = instr.args[1:]
+    elif mnemonic in CASES_SOURCE_FIRST:
+        args = instr.args[:1]
+    else:
+        args = instr.args
+
+    ret: List[Register] = []
+    for arg in args:
+        if isinstance(arg, Register):
+            ret.append(arg)
+        elif isinstance(arg, AsmAddressMode):
+            ret.append(arg.rhs)
+
+    if "d" in mnemonic.split(".")[1:]:
+        # Double-precision operations may read the second half of the register
+        # pair as well, see InstrArgs.dreg.
+        ret.extend([r.other_f64_reg() for r in ret if r.is_float()])
+    if mnemonic == "mfhi":
+        ret.append(Register("hi"))
+    elif mnemonic == "mflo":
+        ret.append(Register("lo"))
+    elif mnemonic in CASES_FLOAT_BRANCHES:
+        ret.append(Register("condition_bit"))
+    elif mnemonic in CASES_FN_CALL:
+        ret.extend(ARGUMENT_REGS)
+        ret.extend(map(Register, ["f13", "f15"]))
+    return ret
+
+
+def compute_live_regs(
+    nodes: List[Node], typemap: Optional[TypeMap]
+) -> Dict[Node, Set[Register]]:
+    """
+    Compute, for each node, the set of registers that are live on entry to it,
+    i.e. that may be read before they are written on some path starting from
+    the node. This is a standard backwards dataflow analysis.
+    """
+    gen: Dict[Node, Set[Register]] = {}
+    kill: Dict[Node, Set[Register]] = {}
+    for node in nodes:
+        node_gen: Set[Register] = set()
+        node_kill: Set[Register] = set()
+        if isinstance(node, ReturnNode):
+            node_gen.add(Register("return"))
+        for instr in reversed(node.block.instructions):
+            with current_instr(instr):
+                outputs = output_regs_for_instr(instr, typemap)
+                if instr.mnemonic in CASES_FN_CALL:
+                    outputs = outputs + TEMP_REGS
+                inputs = input_regs_for_instr(instr)
+            node_gen.difference_update(outputs)
+            node_kill.update(outputs)
+            node_gen.update(inputs)
+        gen[node] = node_gen
+        kill[node] = node_kill
+
+    live_in: Dict[Node, Set[Register]] = {node: set(gen[node]) for node in nodes}
+    worklist = nodes[:]
+    while worklist:
+        node = worklist.pop()
+        for parent in node.parents:
+            new_regs = live_in[node] - kill[parent] - live_in[parent]
+            if new_regs:
+                live_in[parent].update(new_regs)
+                worklist.append(parent)
+    return live_in
+
+
 def regs_clobbered_until_dominator(
     node: Node, typemap: Optional[TypeMap]
 ) -> Set[Register]:
@@ -2924,7 +3088,7 @@ def translate_node_body(node: Node, regs: RegInfo, stack_info: StackInfo) -> Blo
         assert reuse_var or prefix
         if prefix == "condition_bit":
             prefix = "cond"
-        var = reuse_var or Var(stack_info, "temp_" + prefix)
+        var = reuse_var or Var("temp_" + prefix)
         expr = EvalOnceExpr(
             wrapped_expr=expr,
             var=var,
@@ -3364,6 +3528,7 @@ def translate_graph_from_block(
     stack_info: StackInfo,
     used_phis: List[PhiExpr],
     return_blocks: List[BlockInfo],
+    live_regs: Dict[Node, Set[Register]],
     options: Options,
 ) -> None:
     """
@@ -3388,22 +3553,31 @@ def translate_graph_from_block(
             instr = e.instr
             e = e.__cause__
 
+        diagnostics = current_diagnostics()
         if isinstance(e, DecompFailure):
             emsg = str(e)
-            print(emsg)
+            details = emsg
+            if diagnostics is None:
+                print(emsg)
         else:
             tb = e.__traceback__
-            traceback.print_exception(None, e, tb)
+            details = "".join(traceback.format_exception(None, e, tb)).rstrip("\n")
+            if diagnostics is None:
+                print(details, file=sys.stderr)
             emsg = str(e) or traceback.format_tb(tb)[-1]
             emsg = emsg.strip().split("\n")[-1].strip()
 
         error_stmts: List[Statement] = [CommentStmt(f"Error: {emsg}")]
         if instr is not None:
-            print(
-                f"Error occurred while processing instruction: {instr}", file=sys.stderr
-            )
+            where = f"Error occurred while processing instruction: {instr}"
+            details += f"\n{where}"
+            if diagnostics is None:
+                print(where, file=sys.stderr)
             error_stmts.append(CommentStmt(f"At instruction: {instr}"))
-        print(file=sys.stderr)
+        if diagnostics is None:
+            print(file=sys.stderr)
+        else:
+            diagnostics.errors.append(details)
         block_info = BlockInfo(
             error_stmts,
             None,
@@ -3425,15 +3599,20 @@ def translate_graph_from_block(
         new_contents = regs.contents.copy()
         phi_regs = regs_clobbered_until_dominator(child, typemap)
         for reg in phi_regs:
-            if reg_always_set(child, reg, typemap, dom_set=(reg in regs)):
+            if reg in live_regs[child] and reg_always_set(
+                child, reg, typemap, dom_set=(reg in regs)
+            ):
                 new_contents[reg] = PhiExpr(
                     reg=reg, node=child, used_phis=used_phis, type=Type.any()
                 )
+                stack_info.num_created_phis += 1
             elif reg in new_contents:
+                # Either the register is dead at this point (so its value will
+                # never be read), or it's not set along all paths.
                 del new_contents[reg]
         new_regs = RegInfo(contents=new_contents, stack_info=stack_info)
         translate_graph_from_block(
-            child, new_regs, stack_info, used_phis, return_blocks, options
+            child, new_regs, stack_info, used_phis, return_blocks, live_regs, options
         )
 
 
@@ -3452,10 +3631,17 @@ def translate_to_ast(
     information and has AST transformations for each block of code and
     branch condition.
     """
+    count(
+        "instructions",
+        sum(1 for item in function.body if isinstance(item, Instruction)),
+    )
+
     # Initialize info about the function.
-    flow_graph: FlowGraph = build_flowgraph(function, rodata)
+    with phase("build_flowgraph"):
+        flow_graph: FlowGraph = build_flowgraph(function, rodata)
     start_node = flow_graph.entry_node()
-    stack_info = get_stack_info(function, rodata, start_node, typemap)
+    with phase("get_stack_info"):
+        stack_info = get_stack_info(function, rodata, start_node, typemap)
 
     initial_regs: Dict[Register, Expression] = {
         Register("sp"): GlobalSymbol("sp", type=Type.ptr()),
@@ -3506,9 +3692,17 @@ def translate_to_ast(
     start_reg: RegInfo = RegInfo(contents=initial_regs, stack_info=stack_info)
     used_phis: List[PhiExpr] = []
     return_blocks: List[BlockInfo] = []
-    translate_graph_from_block(
-        start_node, start_reg, stack_info, used_phis, return_blocks, options
-    )
+    with phase("translate_graph"):
+        live_regs = compute_live_regs(flow_graph.nodes, typemap)
+        translate_graph_from_block(
+            start_node,
+            start_reg,
+            stack_info,
+            used_phis,
+            return_blocks,
+            live_regs,
+            options,
+        )
 
     # We mark the function as having a return type if all return nodes have
     # return values, and not all those values are trivial (e.g. from function
@@ -3536,14 +3730,25 @@ def translate_to_ast(
         for b in return_blocks:
             b.return_value = None
 
-    assign_phis(used_phis, stack_info)
+    with phase("assign_phis"):
+        assign_phis(used_phis, stack_info)
+
+    count("phis", stack_info.num_created_phis)
+    count("used_phis", len(used_phis))
+    count("temps", len(stack_info.temp_vars))
+
+    if options.debug:
+        print(
+            f"\nCreated {stack_info.num_created_phis} phi nodes, "
+            f"{len(used_phis)} of which were used"
+        )
 
     if options.pdb_translate:
         import pdb
 
         v: Dict[str, object] = {}
         fmt = Formatter()
-        for local in stack_info.local_vars:
+        for local in stack_info.sorted_local_vars():
             var_name = local.format(fmt)
             v[var_name] = local
         for temp in stack_info.temp_vars:
@@ -1,10 +1,15 @@
-from typing import Optional, Tuple, Union
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 
 import attr
 import pycparser.c_ast as ca
 
 from .c_types import (
     CType,
+    Struct,
+    StructField,
     TypeMap,
     equal_types,
     get_struct,
@@ -14,8 +19,47 @@ from .c_types import (
     var_size_align,
 )
 
+# Number of Type.unify calls so far, reported by --profile.
+unify_calls = 0
 
-@attr.s(eq=False, repr=False)
+_state = threading.local()
+
+
+def current_undo_log() -> Optional[List[Callable[[], None]]]:
+    """Inside undo_changes() on this thread, the functions that undo the
+    changes made so far; otherwise None."""
+    ret: Optional[List[Callable[[], None]]] = getattr(_state, "undo_log", None)
+    return ret
+
+
+@contextmanager
+def undo_changes() -> Iterator[None]:
+    """Undo the changes made inside the block to types (and to other state
+    which calls record_undo()) when it exits. This lets a finished translation
+    be rendered several times, since rendering unifies types too, without one
+    render seeing the types inferred by another. Used by --sweep.
+
+    Only changes made by the current thread are recorded, and types are
+    shared objects, so other threads must not use the same translation while
+    inside this block."""
+    prev = current_undo_log()
+    log: List[Callable[[], None]] = []
+    _state.undo_log = log
+    try:
+        yield
+    finally:
+        _state.undo_log = prev
+        for undo in reversed(log):
+            undo()
+
+
+def record_undo(undo: Callable[[], None]) -> None:
+    undo_log = current_undo_log()
+    if undo_log is not None:
+        undo_log.append(undo)
+
+
+@attr.s(eq=False, repr=False, slots=True)
 class Type:
     """
     Type information for an expression, which may improve over time. The least
@@ -40,6 +84,7 @@ class Type:
     size: Optional[int] = attr.ib()
     sign: int = attr.ib()
     uf_parent: Optional["Type"] = attr.ib(default=None)
+    uf_rank: int = attr.ib(default=0)
     ptr_to: Optional[Union["Type", CType]] = attr.ib(default=None)
 
     def unify(self, other: "Type") -> bool:
@@ -48,10 +93,23 @@ class Type:
         Once set equal, the types will always be equal (we use a union-find
         structure to ensure this).
         """
+        global unify_calls
+        unify_calls += 1
         x = self.get_representative()
         y = other.get_representative()
         if x is y:
             return True
+        if (
+            x.kind == y.kind
+            and x.size == y.size
+            and x.sign == y.sign
+            and x.ptr_to is y.ptr_to
+            and x.size is not None
+            and x.kind in (Type.K_INT, Type.K_PTR, Type.K_FLOAT)
+        ):
+            # Fast path: two identical concrete types, nothing to merge.
+            x.link(y)
+            return True
         if x.size is not None and y.size is not None and x.size != y.size:
             return False
         size = x.size if x.size is not None else y.size
@@ -91,18 +149,57 @@ class Type:
                     isinstance(ctype, ca.PtrDecl) and Type.ptr(ctype.type).unify(type)
                 ):
                     return False
-        x.kind = kind
-        x.size = size
-        x.sign = sign
-        x.ptr_to = ptr_to
-        y.uf_parent = x
+        root = x.link(y)
+        root.kind = kind
+        root.size = size
+        root.sign = sign
+        root.ptr_to = ptr_to
         return True
 
+    def link(self, other: "Type") -> "Type":
+        """
+        Merge the union-find sets of two representatives, using union by rank.
+        Returns the new representative, whose type information the caller is
+        responsible for updating.
+        """
+        x, y = self, other
+        if x.uf_rank < y.uf_rank:
+            x, y = y, x
+        undo_log = current_undo_log()
+        if undo_log is not None:
+            # unify() then updates the representative, which is x or y.
+            undo_log.append(x.saved_state())
+            undo_log.append(y.saved_state())
+        y.uf_parent = x
+        if x.uf_rank == y.uf_rank:
+            x.uf_rank += 1
+        return x
+
+    def saved_state(self) -> Callable[[], None]:
+        """Return a function that restores the current state of this type."""
+        uf_parent, uf_rank = self.uf_parent, self.uf_rank
+        kind, size, sign, ptr_to = self.kind, self.size, self.sign, self.ptr_to
+
+        def restore() -> None:
+            self.uf_parent, self.uf_rank = uf_parent, uf_rank
+            self.kind, self.size, self.sign, self.ptr_to = kind, size, sign, ptr_to
+
+        return restore
+
     def get_representative(self) -> "Type":
-        if self.uf_parent is None:
-            return self
-        self.uf_parent = self.uf_parent.get_representative()
-        return self.uf_parent
+        root = self
+        while root.uf_parent is not None:
+            root = root.uf_parent
+        if root is self or root is self.uf_parent:
+            return root
+        if current_undo_log() is not None:
+            # Path compression can't be undone, so skip it.
+            return root
+        # Path compression
+        node = self
+        while node.uf_parent is not None:
+            node.uf_parent, node = root, node.uf_parent
+        return root
 
     def is_float(self) -> bool:
         return self.get_representative().kind == Type.K_FLOAT
@@ -278,31 +375,8 @@ def get_field(
     if isinstance(ctype, ca.TypeDecl) and isinstance(ctype.type, (ca.Struct, ca.Union)):
         struct = get_struct(ctype.type, typemap)
         if struct:
-            fields = struct.fields.get(offset)
-            if fields:
-                # Ideally, we should use target_size and the target pointer type to
-                # determine which struct field to use if there are multiple at the
-                # same offset (e.g. if a struct starts here, or we have a union).
-                # For now though, we just use target_size as a boolean signal -- if
-                # it's known we take an arbitrary subfield that's as concrete as
-                # possible, if unknown we prefer a whole substruct. (The latter case
-                # happens when taking pointers to fields -- pointers to substructs are
-                # more common and can later be converted to concrete field pointers.)
-                if target_size is None:
-                    # Structs will be placed first in the field list.
-                    field = fields[0]
-                else:
-                    # Pick the first subfield in case of unions.
-                    correct_size_fields = [f for f in fields if f.size == target_size]
-                    if len(correct_size_fields) == 1:
-                        field = correct_size_fields[0]
-                    else:
-                        ind = 0
-                        while ind + 1 < len(fields) and fields[ind + 1].name.startswith(
-                            fields[ind].name + "."
-                        ):
-                            ind += 1
-                        field = fields[ind]
+            field = choose_field(struct, offset, target_size)
+            if field:
                 return (
                     field.name,
                     type_from_ctype(field.type, typemap),
@@ -311,6 +385,42 @@ def get_field(
     return None, Type.any(), Type.ptr(), False
 
 
+def choose_field(
+    struct: Struct, offset: int, target_size: Optional[int]
+) -> Optional[StructField]:
+    key = (offset, target_size)
+    if key in struct.field_choices:
+        return struct.field_choices[key]
+    fields = struct.fields.get(offset)
+    if not fields:
+        return None
+    # Ideally, we should use target_size and the target pointer type to
+    # determine which struct field to use if there are multiple at the
+    # same offset (e.g. if a struct starts here, or we have a union).
+    # For now though, we just use target_size as a boolean signal -- if
+    # it's known we take an arbitrary subfield that's as concrete as
+    # possible, if unknown we prefer a whole substruct. (The latter case
+    # happens when taking pointers to fields -- pointers to substructs are
+    # more common and can later be converted to concrete field pointers.)
+    if target_size is None:
+        # Structs will be placed first in the field list.
+        field = fields[0]
+    else:
+        # Pick the first subfield in case of unions.
+        correct_size_fields = [f for f in fields if f.size == target_size]
+        if len(correct_size_fields) == 1:
+            field = correct_size_fields[0]
+        else:
+            ind = 0
+            while ind + 1 < len(fields) and fields[ind + 1].name.startswith(
+                fields[ind].name + "."
+            ):
+                ind += 1
+            field = fields[ind]
+    struct.field_choices[key] = field
+    return field
+
+
 def find_substruct_array(
     type: Type, offset: int, scale: int, typemap: TypeMap
 ) -> Optional[Tuple[str, int, CType]]:
@@ -327,10 +437,10 @@ def find_substruct_array(
     struct = get_struct(ctype.type, typemap)
     if not struct:
         return None
-    try:
-        sub_offset = max(off for off in struct.fields.keys() if off <= offset)
-    except ValueError:
+    index = bisect_right(struct.sorted_offsets, offset)
+    if index == 0:
         return None
+    sub_offset = struct.sorted_offsets[index - 1]
     for field in struct.fields[sub_offset]:
         field_type = resolve_typedefs(field.type, typemap)
         if isinstance(field_type, ca.ArrayDecl):
@@ -348,6 +458,7 @@ def get_pointer_target(
     if target is None:
         return None
     if isinstance(target, Type):
+        target = target.get_representative()
         if target.size is None:
             return None
         return target.size // 8, target
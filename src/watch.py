@@ -0,0 +1,184 @@
+"""Keeping the output of a file up to date while it's being edited, for
+--watch. The input, --rodata and --context files are polled, and when one of
+them changes, only the functions whose output may have changed are
+decompiled again. The output of a function depends on
+
+- its own instructions,
+- the C context entries for the symbols it refers to (and its own name),
+  including the typedefs, structs and enums those are declared with,
+- the rodata entries for the symbols it refers to, and which of its labels
+  are referred to from rodata,
+
+so these are hashed into a key per function, and the previous output is
+reused if the key is the same.
+"""
+
+import hashlib
+from typing import Dict, List, Optional, Set, Tuple
+
+import attr
+from pycparser import c_ast as ca
+
+from .c_types import TypeMap, to_c
+from .input_file import input_stat
+from .options import Options
+from .parse_file import Function, Label, Rodata
+from .parse_instruction import (
+    Argument,
+    AsmAddressMode,
+    AsmGlobalSymbol,
+    BinOp,
+    Instruction,
+    Macro,
+)
+from .results_db import function_hash
+
+# Seconds between checks for changed files.
+POLL_INTERVAL = 0.5
+
+FileState = Optional[Tuple[int, int]]
+
+
+def file_state(path: str) -> FileState:
+    """The modification time and size of a file, or None if it doesn't exist
+    (e.g. while an editor is replacing it)."""
+    try:
+        stat = input_stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def asm_states(options: Options) -> List[FileState]:
+    return [file_state(path) for path in [options.filename, *options.rodata_files]]
+
+
+def context_state(options: Options) -> FileState:
+    if options.c_context is None:
+        return None
+    return file_state(options.c_context)
+
+
+def argument_symbols(arg: Argument, symbols: Set[str]) -> None:
+    if isinstance(arg, AsmGlobalSymbol):
+        symbols.add(arg.symbol_name)
+    elif isinstance(arg, Macro):
+        argument_symbols(arg.argument, symbols)
+    elif isinstance(arg, AsmAddressMode):
+        if arg.lhs is not None:
+            argument_symbols(arg.lhs, symbols)
+    elif isinstance(arg, BinOp):
+        argument_symbols(arg.lhs, symbols)
+        argument_symbols(arg.rhs, symbols)
+
+
+def referenced_symbols(function: Function) -> List[str]:
+    """The global symbols used by a function, and its own name."""
+    symbols = {function.name}
+    for item in function.body:
+        if isinstance(item, Instruction):
+            for arg in item.args:
+                argument_symbols(arg, symbols)
+    return sorted(symbols)
+
+
+@attr.s
+class TypemapHashes:
+    """Hashes of the C context entries for symbols, computed on demand. They
+    only depend on the text of the declarations, so they can be compared
+    between typemaps built from different versions of the context."""
+
+    typemap: Optional[TypeMap] = attr.ib()
+    hashes: Dict[str, str] = attr.ib(factory=dict)
+
+    def entry_hash(self, name: str) -> str:
+        if name not in self.hashes:
+            self.hashes[name] = self.compute_entry_hash(name)
+        return self.hashes[name]
+
+    def compute_entry_hash(self, name: str) -> str:
+        typemap = self.typemap
+        h = hashlib.sha1()
+        if typemap is None or name not in typemap.var_types:
+            return h.hexdigest()
+        seen: Set[int] = set()
+
+        def add(node: ca.Node) -> None:
+            if id(node) in seen:
+                return
+            seen.add(id(node))
+            h.update(to_c(node).encode("utf-8") + b"\n")
+            visit(node)
+
+        def visit(node: ca.Node) -> None:
+            # Add the definitions of the typedefs, structs and enumerators
+            # that a declaration refers to, recursively.
+            assert typemap is not None
+            if isinstance(node, ca.IdentifierType):
+                for type_name in node.names:
+                    if type_name in typemap.typedefs:
+                        add(typemap.typedefs[type_name])
+            elif isinstance(node, (ca.Struct, ca.Union)):
+                definition = typemap.struct_defs.get(node.name or "")
+                if node.decls is None and definition is not None:
+                    add(definition)
+            elif isinstance(node, ca.ID):
+                if node.name in typemap.enumerator_defs:
+                    add(typemap.enumerator_defs[node.name])
+            for child in node:
+                visit(child)
+
+        h.update(f"{name in typemap.functions}\n".encode("utf-8"))
+        add(typemap.var_types[name])
+        return h.hexdigest()
+
+
+def rodata_entry_hash(rodata: Rodata, name: str) -> str:
+    h = hashlib.sha1()
+    entry = rodata.get(name)
+    if entry is not None:
+        h.update(f"{entry.is_string}\n".encode("utf-8"))
+        for item in entry.items:
+            if isinstance(item, str):
+                h.update(f"sym {item}\n".encode("utf-8"))
+            else:
+                h.update(entry.buffer[item[0] : item[1]])
+    return h.hexdigest()
+
+
+def function_key(
+    function: Function, rodata: Rodata, typemap_hashes: TypemapHashes
+) -> str:
+    """Hash everything the output of a function depends on, besides the
+    options, which don't change while watching."""
+    h = hashlib.sha1(function_hash(function).encode("utf-8"))
+    for name in referenced_symbols(function):
+        h.update(
+            f"{name} {typemap_hashes.entry_hash(name)} "
+            f"{rodata_entry_hash(rodata, name)}\n".encode("utf-8")
+        )
+    for item in function.body:
+        if isinstance(item, Label) and item.name in rodata.mentioned_labels:
+            h.update(f"mentioned {item.name}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+@attr.s
+class FunctionOutput:
+    key: str = attr.ib()
+    # What is printed for the function, including error messages.
+    text: str = attr.ib()
+    # Failed functions are always decompiled again, since their error
+    # messages may include line numbers.
+    ok: bool = attr.ib()
+
+
+@attr.s
+class OutputCache:
+    outputs: Dict[str, FunctionOutput] = attr.ib(factory=dict)
+
+    def lookup(self, function: Function, key: str) -> Optional[str]:
+        output = self.outputs.get(function.name)
+        if output is None or output.key != key or not output.ok:
+            return None
+        return output.text
@@ -8,7 +8,7 @@
 # -----------------------------------------------------------------
 
 
-from typing import TextIO, Iterable, List, Any, Optional, Union as Union_
+from typing import TextIO, Iterable, Iterator, List, Any, Optional, Union as Union_
 from .plyparser import Coord
 import sys
 
@@ -19,7 +19,7 @@ class Node(object):
     def __repr__(self) -> str:
         ...
 
-    def __iter__(self) -> Iterable[Node]:
+    def __iter__(self) -> Iterator[Node]:
         ...
 
     def children(self) -> Iterable[Node]:
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+# Makes the glabel macro and the IDO section names of the tests' assembly
+# understood by llvm-mc, and keeps it from reordering or expanding anything.
+ASM_PRELUDE = """.set noreorder
+.set noat
+.macro glabel label
+.global \\label
+\\label:
+.endm
+"""
+
+
+def set_up_logging(debug: bool) -> None:
+    logging.basicConfig(
+        format="[%(levelname)s] %(message)s",
+        level=logging.DEBUG if debug else logging.INFO,
+    )
+
+
+def assemble(asm_file: Path, obj_file: Path) -> bool:
+    text = asm_file.read_text(encoding="utf-8-sig")
+    text = re.sub(r"^\.late_rodata\s*$", ".section .late_rodata", text, flags=re.M)
+    text = re.sub(r"^\.rdata\s*$", ".section .rodata", text, flags=re.M)
+    with NamedTemporaryFile("w", suffix=".s") as f:
+        f.write(ASM_PRELUDE + text)
+        f.flush()
+        result = subprocess.run(
+            [
+                "llvm-mc",
+                "-triple=mips-linux-gnu",
+                "-mcpu=mips3",
+                "-filetype=obj",
+                f.name,
+                "-o",
+                str(obj_file),
+            ],
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+    if result.returncode != 0:
+        logging.error(f"Failed to assemble {asm_file}:\n{result.stderr}")
+        return False
+    return True
+
+
+def add_elf_test(asm_file: Path) -> bool:
+    """Assemble a test's input into an object file next to it, which is tested
+    with the same flags and should give the same output."""
+    stem = asm_file.stem + "-elf"
+    obj_file = asm_file.with_name(stem + ".o")
+    logging.info(f"Assembling {asm_file} to {obj_file}...")
+    if not assemble(asm_file, obj_file):
+        return False
+    flags_file = asm_file.with_name(asm_file.stem + "-flags.txt")
+    if flags_file.is_file():
+        shutil.copyfile(flags_file, asm_file.with_name(stem + "-flags.txt"))
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Add end-to-end tests of reading ELF objects, by assembling "
+        "the input of existing tests with llvm-mc. Run run_tests.py --overwrite "
+        "afterwards to create the expected outputs."
+    )
+    parser.add_argument(
+        "files",
+        help="assembly files of existing tests, e.g. tests/end_to_end/loop/irix-o2.s",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--debug", dest="debug", help="print debug info", action="store_true"
+    )
+
+    args = parser.parse_args()
+    set_up_logging(args.debug)
+
+    if shutil.which("llvm-mc") is None:
+        logging.error("llvm-mc is required to assemble the tests. Bailing.")
+        return 2
+
+    ret = 0
+    for filename in args.files:
+        if not add_elf_test(Path(filename)):
+            ret = 1
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+struct S {
+    int getx;
+    int pad;
+};
+extern struct S gS;
@@ -0,0 +1,8 @@
+.set noat      # allow manual use of $at
+.set noreorder # don't insert nops after branches
+
+
+glabel gety
+/* 000000 00400000 3C020000 */  lui   $v0, %hi(gS)
+/* 000004 00400004 03E00008 */  jr    $ra
+/* 000008 00400008 8C420000 */   lw    $v0, %lo(gS)($v0)
@@ -0,0 +1,17 @@
+.set noat      # allow manual use of $at
+.set noreorder # don't insert nops after branches
+
+
+glabel count_a
+/* 000000 00400000 27BDFFE8 */  addiu $sp, $sp, -0x18
+/* 000004 00400004 AFBF0014 */  sw    $ra, 0x14($sp)
+/* 000008 00400008 10800005 */  beqz  $a0, .L_a_done
+/* 00000C 0040000C 00001025 */   move  $v0, $zero
+/* 000010 00400010 0C000000 */  jal   count_a
+/* 000014 00400014 2484FFFF */   addiu $a0, $a0, -1
+/* 000018 00400018 10000001 */  b     .L_a_done
+/* 00001C 0040001C 24420001 */   addiu $v0, $v0, 1
+.L_a_done:
+/* 000020 00400020 8FBF0014 */  lw    $ra, 0x14($sp)
+/* 000024 00400024 03E00008 */  jr    $ra
+/* 000028 00400028 27BD0018 */   addiu $sp, $sp, 0x18
@@ -0,0 +1,6 @@
+void test(void) {
+    D_410120 = 1.2f;
+    D_410128 = 0.0;
+    D_410130 = 14000000000.0;
+    D_410138 = "\"hello\"\n\x01\0world  /* comment */ #";
+}